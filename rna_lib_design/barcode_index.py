@@ -0,0 +1,208 @@
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import defaultdict
+from typing import List
+
+import numpy as np
+
+from rna_lib_design.edit_distance import (
+    calc_edit_distance_within,
+    get_seed_candidates,
+)
+
+
+class BarcodeIndex:
+    """
+    The barcode regions of every design accepted so far, indexed so a new
+    barcode region can be checked against all of them without comparing to each
+    one. Two barcode regions are too close if their edit distance is below
+    min_distance. Each region is cut into min_distance pieces, if two regions are
+    within min_distance - 1 edits one of the pieces of the first is found
+    unchanged in the second, so only the regions sharing a piece are compared.
+
+    After calling share() the regions are also kept in an append-only log in
+    shared memory, one fixed-width row per region and the length of each. Every process reads the regions added by the others from the
+    log before checking, and checking and adding are done under a lock, so no
+    two processes can accept regions that are too close to each other.
+    """
+
+    def __init__(self, min_distance: int):
+        self.min_distance = min_distance
+        self.keys: List[str] = []
+        # seed index and ids of the regions of each length
+        self._by_length = {}
+        self._shm = None
+        self._shm_owner = False
+        self._lock = None
+        self._count = None
+        self._log = None
+        self._lengths = None
+        self._capacity = 0
+        self._key_length = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shm is not None:
+            # the regions are read back from the shared log, not copied
+            state["keys"] = []
+            state["_by_length"] = {}
+            state["_count"] = None
+            state["_log"] = None
+            state["_lengths"] = None
+            state["_shm_owner"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._shm is not None:
+            self.__attach_shared()
+            self.__sync()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get_keys(self) -> List[str]:
+        """
+        Every region added, including those added by other processes.
+        """
+        if self._shm is not None:
+            self.__sync()
+        return list(self.keys)
+
+    def is_distinct(self, key: str) -> bool:
+        """
+        True if key is at least min_distance edits from every region added.
+        """
+        if self.min_distance <= 0:
+            return True
+        if self._shm is not None:
+            self.__sync()
+        return self.__is_distinct(key)
+
+    def add(self, key: str, force: bool = False) -> bool:
+        """
+        Adds a region if it is distinct from every region added. Returns False
+        and adds nothing otherwise, when shared the check and the add are atomic
+        across processes.
+        :param force: add the region without checking it
+        """
+        if self.min_distance <= 0:
+            return True
+        if self._lock is None:
+            if not force and not self.__is_distinct(key):
+                return False
+            self.__add_local(key)
+            return True
+        if len(key) > self._key_length:
+            raise ValueError(
+                f"barcode region {key} is longer than {self._key_length}, the "
+                "longest region the shared index was made for"
+            )
+        with self._lock:
+            self.__sync()
+            if not force and not self.__is_distinct(key):
+                return False
+            count = int(self._count[0])
+            if count >= self._capacity:
+                raise ValueError("shared barcode index is full")
+            self.__write_shared(count, key)
+            self._count[0] = count + 1
+            self.__add_local(key)
+        return True
+
+    def is_shared(self) -> bool:
+        return self._shm is not None
+
+    def share(self, capacity: int, key_length: int) -> None:
+        """
+        Moves the regions into a log in shared memory. Like SequenceStructureSet
+        the index must reach other processes when they are started.
+        :param capacity: the most regions the run can add
+        :param key_length: length of the longest region that can be added
+        """
+        if self._shm is not None or self.min_distance <= 0:
+            return
+        self._capacity = max(1, capacity + len(self.keys))
+        self._key_length = max([key_length] + [len(k) for k in self.keys])
+        # an int64 count of regions, the int32 length of each region and one
+        # row per region padded to the longest
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=8 + self._capacity * (4 + max(1, self._key_length))
+        )
+        self._shm_owner = True
+        self._lock = multiprocessing.Lock()
+        self.__attach_shared()
+        for i, key in enumerate(self.keys):
+            self.__write_shared(i, key)
+        self._count[0] = len(self.keys)
+
+    def unshare(self) -> None:
+        """
+        Reads every region added by other processes and frees the shared memory.
+        """
+        if self._shm is None:
+            return
+        self.__sync()
+        self._count = None
+        self._log = None
+        self._lengths = None
+        self._shm.close()
+        if self._shm_owner:
+            self._shm.unlink()
+        self._shm = None
+        self._shm_owner = False
+        self._lock = None
+
+    def __attach_shared(self):
+        self._count = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._lengths = np.ndarray(
+            (self._capacity,), dtype=np.int32, buffer=self._shm.buf, offset=8
+        )
+        self._log = np.ndarray(
+            (self._capacity, max(1, self._key_length)),
+            dtype=np.uint8,
+            buffer=self._shm.buf,
+            offset=8 + 4 * self._capacity,
+        )
+
+    def __write_shared(self, i, key):
+        self._log[i, : len(key)] = np.frombuffer(key.encode(), dtype=np.uint8)
+        self._lengths[i] = len(key)
+
+    def __sync(self):
+        # regions are written before the count is raised so every row below the
+        # count is complete
+        count = int(self._count[0])
+        for i in range(len(self.keys), count):
+            self.__add_local(self._log[i, : self._lengths[i]].tobytes().decode())
+
+    def __is_distinct(self, key):
+        k = self.min_distance - 1
+        for length, (index, ids) in self._by_length.items():
+            if abs(length - len(key)) > k:
+                continue
+            piece_length = length // (k + 1)
+            if piece_length == 0:
+                # regions this short are all within k of each other
+                candidates = ids
+            else:
+                candidates = get_seed_candidates(key, index, k, piece_length)
+            for j in candidates:
+                if calc_edit_distance_within(key, self.keys[j], k) <= k:
+                    return False
+        return True
+
+    def __add_local(self, key):
+        k = self.min_distance - 1
+        if len(key) not in self._by_length:
+            self._by_length[len(key)] = (defaultdict(list), [])
+        index, ids = self._by_length[len(key)]
+        i = len(self.keys)
+        self.keys.append(key)
+        ids.append(i)
+        piece_length = len(key) // (k + 1)
+        if piece_length == 0:
+            return
+        for p in range(k + 1):
+            start = p * piece_length
+            index[(p, key[start : start + piece_length])].append(i)
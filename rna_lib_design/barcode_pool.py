@@ -0,0 +1,366 @@
+from functools import partial
+from itertools import combinations, product
+from math import comb
+from typing import Callable, List, Optional
+
+import numpy as np
+from numpy import random
+
+from rna_lib_design.logger import get_logger
+
+log = get_logger("BARCODE_POOL")
+
+BASES = "ACGU"
+# every base pair a helix barcode can have, the watson-crick pairs first
+PAIRS = ["AU", "UA", "GC", "CG", "GU", "UG"]
+NUM_WC_PAIRS = 4
+# each base is stored in two bits so a code holds at most 32 bases
+MAX_CODE_LENGTH = 32
+# candidate pools larger than this are sampled instead of enumerated
+MAX_CANDIDATES = 4000000
+# largest hamming ball enumerated to remove the neighbours of a barcode, past
+# this the remaining candidates are compared to it directly
+MAX_BALL_SIZE = 200000
+# candidates compared to each other at once when picking barcodes
+CHUNK_SIZE = 512
+# most distances computed at once, bounds the memory used
+MAX_BLOCK_SIZE = 1 << 22
+LOW_BITS = np.uint64(0x5555555555555555)
+
+
+def encode(bases: np.ndarray) -> np.ndarray:
+    """
+    Packs sequences into one integer each, two bits per base.
+    :param bases: array of shape (n, length) with the index in BASES of each base
+    :return: uint64 code of each sequence
+    """
+    bases = np.asarray(bases, dtype=np.uint64)
+    if bases.shape[1] > MAX_CODE_LENGTH:
+        raise ValueError(f"sequences longer than {MAX_CODE_LENGTH} cannot be coded")
+    codes = np.zeros(len(bases), dtype=np.uint64)
+    for i in range(bases.shape[1]):
+        codes |= bases[:, i] << np.uint64(2 * i)
+    return codes
+
+
+def decode(codes: np.ndarray, length: int) -> List[str]:
+    """
+    The sequences of codes made by encode.
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    shifts = np.arange(length, dtype=np.uint64) * np.uint64(2)
+    bases = (codes[:, None] >> shifts[None, :]) & np.uint64(3)
+    chars = np.array(list(BASES))[bases.astype(np.intp)]
+    return ["".join(row) for row in chars]
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.int64)
+    counts = np.unpackbits(x.view(np.uint8)).reshape(x.shape + (64,))
+    return counts.sum(axis=-1)
+
+
+def get_hamming_distances(codes_1: np.ndarray, codes_2: np.ndarray) -> np.ndarray:
+    """
+    Hamming distances between coded sequences of the same length, the arrays
+    are broadcast against each other. The bases that differ are found for all
+    positions at once, a base differs if either of its two bits does.
+    """
+    x = np.bitwise_xor(codes_1, codes_2)
+    x = (x | (x >> np.uint64(1))) & LOW_BITS
+    return popcount(x)
+
+
+def get_ball_size(length: int, radius: int) -> int:
+    """
+    Number of sequences of a length within radius substitutions of one.
+    """
+    return sum(comb(length, i) * 3**i for i in range(radius + 1))
+
+
+def get_neighbour_masks(length: int, radius: int) -> np.ndarray:
+    """
+    Masks that turn a code into each code within radius substitutions of it
+    when xored with it. A base changes into each of the other three when
+    xored with 1, 2 or 3.
+    """
+    masks = [0]
+    for i in range(1, radius + 1):
+        for positions in combinations(range(length), i):
+            for changes in product((1, 2, 3), repeat=i):
+                mask = 0
+                for pos, change in zip(positions, changes):
+                    mask |= change << (2 * pos)
+                masks.append(mask)
+    return np.array(masks, dtype=np.uint64)
+
+
+def select_distant(
+    codes: np.ndarray,
+    length: int,
+    min_distance: int,
+    max_num: int = None,
+    screen: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+) -> np.ndarray:
+    """
+    Greedily picks codes that are all at least min_distance substitutions
+    apart. Codes are visited in order and each is kept unless it is too close
+    to one kept before, so every code left out is too close to one kept and
+    no code can be added to the result.
+
+    The codes too close to each new barcode are removed as soon as it is kept
+    so each code is checked once. If the hamming ball around a barcode is small
+    its members are looked up in the sorted codes, otherwise the codes left are
+    compared to it directly, bit-parallel on the packed codes.
+
+    If a screen is given a code is only kept if it passes it. A code that
+    fails is skipped and blocks nothing, so every code left out is either too
+    close to one kept or failed. Codes are screened in batches, once each, and
+    only when they would be kept otherwise.
+    :param codes: unique codes in the order to visit them
+    :param length: number of bases of each code
+    :param max_num: stop after this many codes are picked
+    :param screen: takes an array of codes and returns a boolean array, True for
+    each code that can be kept
+    :return: positions in codes of the codes picked
+    """
+    n = len(codes)
+    if max_num is None:
+        max_num = n
+    if min_distance <= 1 and screen is None:
+        return np.arange(min(n, max_num))
+    radius = min_distance - 1
+    ball_size = get_ball_size(length, radius)
+    masks = None
+    if ball_size <= MAX_BALL_SIZE:
+        masks = get_neighbour_masks(length, radius)
+        order = np.argsort(codes)
+        sorted_codes = codes[order]
+    alive = np.ones(n, dtype=bool)
+    # positions not visited yet, can include some removed since
+    rest = np.arange(n)
+    start = 0
+    picked = []
+    num_picked = 0
+    while start < len(rest) and num_picked < max_num:
+        chunk = rest[start : start + CHUNK_SIZE]
+        start += len(chunk)
+        chunk = chunk[alive[chunk]]
+        if len(chunk) == 0:
+            continue
+        # the chunk is already far enough from every code picked before it
+        chunk_codes = codes[chunk]
+        close = (
+            get_hamming_distances(chunk_codes[:, None], chunk_codes[None, :])
+            < min_distance
+        )
+        failed = np.zeros(len(chunk), dtype=bool)
+        screened = np.zeros(len(chunk), dtype=bool)
+        while True:
+            kept = pick_greedy(close, failed, max_num - num_picked)
+            to_screen = kept[~screened[kept]]
+            if screen is None or len(to_screen) == 0:
+                break
+            passed = np.asarray(screen(chunk_codes[to_screen]), dtype=bool)
+            screened[to_screen] = True
+            if passed.all():
+                break
+            # codes blocked by those that failed can be kept again
+            failed[to_screen[~passed]] = True
+        new = chunk[kept]
+        picked.append(new)
+        num_picked += len(new)
+        new_codes = codes[new]
+        if masks is not None and ball_size < 16 * (len(rest) - start):
+            step = max(1, MAX_BLOCK_SIZE // len(masks))
+            for i in range(0, len(new_codes), step):
+                neighbours = (new_codes[i : i + step, None] ^ masks[None, :]).ravel()
+                idx = np.searchsorted(sorted_codes, neighbours)
+                idx[idx == n] = 0
+                found = sorted_codes[idx] == neighbours
+                alive[order[idx[found]]] = False
+        else:
+            rest = rest[start:]
+            rest = rest[alive[rest]]
+            start = 0
+            rest_codes = codes[rest]
+            step = max(1, MAX_BLOCK_SIZE // max(1, len(rest)))
+            for i in range(0, len(new_codes), step):
+                dists = get_hamming_distances(
+                    rest_codes[:, None], new_codes[None, i : i + step]
+                )
+                alive[rest[(dists < min_distance).any(axis=1)]] = False
+    if len(picked) == 0:
+        return np.array([], dtype=np.intp)
+    return np.concatenate(picked)
+
+
+def pick_greedy(close: np.ndarray, skip: np.ndarray, max_num: int) -> np.ndarray:
+    """
+    Keeps each row in order unless it is skipped or close to a row kept before.
+    """
+    blocked = skip.copy()
+    kept = []
+    for j in range(len(close)):
+        if blocked[j]:
+            continue
+        kept.append(j)
+        blocked |= close[j]
+        if len(kept) >= max_num:
+            break
+    return np.array(kept, dtype=np.intp)
+
+
+def has_stretch(same: np.ndarray, size: int) -> np.ndarray:
+    """
+    True for each row of a boolean array with size or more True in a row.
+    """
+    if size <= 0:
+        return np.ones(len(same), dtype=bool)
+    if same.shape[1] < size:
+        return np.zeros(len(same), dtype=bool)
+    window = same[:, size - 1 :].copy()
+    for i in range(size - 1):
+        window &= same[:, i : i + window.shape[1]]
+    return window.any(axis=1)
+
+
+def get_candidate_digits(
+    num_values: int, length: int, max_candidates: int
+) -> np.ndarray:
+    """
+    Every row of length digits below num_values, or a random sample of
+    max_candidates rows if there are more than max_candidates of them.
+    """
+    if num_values**length <= max_candidates:
+        idx = np.arange(num_values**length)
+        digits = np.stack(
+            [(idx // num_values**i) % num_values for i in range(length)], axis=1
+        )
+    else:
+        log.info(
+            f"{num_values ** length} possible candidates, sampling {max_candidates}"
+        )
+        digits = random.randint(0, num_values, size=(max_candidates, length))
+    return digits.astype(np.uint8)
+
+
+def get_helix_pairs(length: int, gus: int, max_candidates: int) -> np.ndarray:
+    """
+    The base pairs of every helix of a length with at most gus GU pairs, as
+    indices in PAIRS. If there are more than max_candidates helices a random
+    sample of max_candidates is drawn instead.
+    """
+    num_pairs = len(PAIRS) if gus > 0 else NUM_WC_PAIRS
+    pairs = get_candidate_digits(num_pairs, length, max_candidates)
+    num_gus = (pairs >= NUM_WC_PAIRS).sum(axis=1)
+    return pairs[num_gus <= gus]
+
+
+def get_helix_candidates(
+    length: int, gus: int, max_candidates: int = MAX_CANDIDATES
+) -> np.ndarray:
+    """
+    Codes of the helices that can be helix barcodes, both strands 5' to 3'
+    one after the other, in random order. Helices with more than 3 of the
+    same base in a row on a strand or more than 3 GC pairs in a row are left
+    out.
+    :return: uint64 codes of the 2 * length bases of each helix
+    """
+    if 2 * length > MAX_CODE_LENGTH:
+        raise ValueError(
+            f"helices longer than {MAX_CODE_LENGTH // 2} are not supported"
+        )
+    pairs = get_helix_pairs(length, gus, max_candidates)
+    pair_bases = np.array([[BASES.index(b) for b in p] for p in PAIRS], dtype=np.uint8)
+    seq_1 = pair_bases[pairs, 0]
+    seq_2 = pair_bases[pairs, 1][:, ::-1]
+    keep = ~has_stretch(seq_1[:, 1:] == seq_1[:, :-1], 3)
+    keep &= ~has_stretch(seq_2[:, 1:] == seq_2[:, :-1], 3)
+    keep &= ~has_stretch((pairs == 2) | (pairs == 3), 4)
+    codes = np.unique(encode(np.concatenate([seq_1, seq_2], axis=1)[keep]))
+    return codes[random.permutation(len(codes))]
+
+
+def generate_helix_barcodes(
+    length: int,
+    min_distance: int,
+    gus: int,
+    max_num: int = 100000,
+    max_candidates: int = MAX_CANDIDATES,
+) -> List[str]:
+    """
+    Generates helix barcodes that differ at min_distance or more positions,
+    counting both strands. Every possible helix is checked if there are at most
+    max_candidates of them, so no helix can be added to the barcodes returned,
+    otherwise a random sample of max_candidates helices is.
+    :param length: number of base pairs of each helix
+    :param min_distance: the fewest positions two barcodes can differ at
+    :param gus: the most GU pairs a helix can have
+    :param max_num: the most barcodes to return
+    :param max_candidates: the most helices to check
+    :return: the barcodes as seq_1&seq_2
+    """
+    codes = get_helix_candidates(length, gus, max_candidates)
+    log.debug(f"{len(codes)} candidate helices of length {length}")
+    picked = select_distant(codes, 2 * length, min_distance, max_num)
+    if len(picked) == max_num:
+        log.warning(f"reached max num of barcodes: {max_num}")
+    seqs = decode(codes[picked], 2 * length)
+    return [seq[:length] + "&" + seq[length:] for seq in seqs]
+
+
+def get_sstrand_candidates(
+    length: int, max_candidates: int = MAX_CANDIDATES
+) -> np.ndarray:
+    """
+    Codes of the sequences that can be single strand barcodes in random order.
+    Sequences with more than 3 of the same base in a row are left out.
+    """
+    if length > MAX_CODE_LENGTH:
+        raise ValueError(f"sequences longer than {MAX_CODE_LENGTH} are not supported")
+    bases = get_candidate_digits(len(BASES), length, max_candidates)
+    keep = ~has_stretch(bases[:, 1:] == bases[:, :-1], 3)
+    codes = np.unique(encode(bases[keep]))
+    return codes[random.permutation(len(codes))]
+
+
+def screen_codes(codes: np.ndarray, screen: Callable, length: int) -> np.ndarray:
+    """
+    Runs a screen of sequences on codes made by encode.
+    """
+    return screen(decode(codes, length))
+
+
+def generate_sstrand_barcodes(
+    length: int,
+    min_distance: int,
+    max_num: int = 100000,
+    max_candidates: int = MAX_CANDIDATES,
+    screen: Optional[Callable[[List[str]], np.ndarray]] = None,
+) -> List[str]:
+    """
+    Generates single strand barcodes that differ at min_distance or more
+    positions. Like generate_helix_barcodes no candidate can be added to the
+    barcodes returned.
+
+    If a screen is given only barcodes it passes are returned, candidates that
+    fail it are skipped so the barcodes stay maximal among those that pass.
+    :param length: number of bases of each barcode
+    :param min_distance: the fewest positions two barcodes can differ at
+    :param max_num: the most barcodes to return
+    :param max_candidates: the most sequences to check
+    :param screen: takes a list of sequences and returns a boolean array, True
+    for each sequence that can be a barcode
+    :return: the barcodes
+    """
+    codes = get_sstrand_candidates(length, max_candidates)
+    log.debug(f"{len(codes)} candidate sequences of length {length}")
+    code_screen = None
+    if screen is not None:
+        code_screen = partial(screen_codes, screen=screen, length=length)
+    picked = select_distant(codes, length, min_distance, max_num, code_screen)
+    if len(picked) == max_num:
+        log.warning(f"reached max num of barcodes: {max_num}")
+    return decode(codes[picked], length)
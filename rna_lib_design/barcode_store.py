@@ -0,0 +1,91 @@
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from rna_lib_design.logger import get_logger
+from rna_lib_design.settings import get_resources_path
+
+log = get_logger("BARCODE_STORE")
+
+# suffix of a compiled csv, written next to it
+STORE_SUFFIX = ".npy"
+
+
+def get_store_path(csv_path) -> Path:
+    return Path(csv_path).with_suffix(STORE_SUFFIX)
+
+
+def is_store_current(csv_path) -> bool:
+    """
+    True if the csv has a compiled store that is at least as new as it.
+    """
+    store_path = get_store_path(csv_path)
+    if not store_path.exists():
+        return False
+    return store_path.stat().st_mtime_ns >= Path(csv_path).stat().st_mtime_ns
+
+
+def compile_table(csv_path) -> np.ndarray:
+    """
+    Compiles a csv into a structured numpy array and saves it next to the csv.
+    Text columns become fixed-width byte strings so the array can be memory
+    mapped. If the store cannot be written the array is still returned.
+    :param csv_path: path to the csv to compile
+    :return: the compiled table
+    """
+    df = pd.read_csv(csv_path)
+    columns = []
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if values.dtype == object:
+            values = np.array(df[name].astype(str).tolist(), dtype=np.bytes_)
+        columns.append((name, values))
+    table = np.empty(len(df), dtype=[(name, v.dtype) for name, v in columns])
+    for name, values in columns:
+        table[name] = values
+    store_path = get_store_path(csv_path)
+    tmp_path = None
+    try:
+        # written to a temporary file first as other processes may be reading it
+        fd, tmp_path = tempfile.mkstemp(dir=store_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, table)
+        os.replace(tmp_path, store_path)
+    except OSError as e:
+        log.debug(f"could not write compiled store {store_path}: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return table
+
+
+def load_table(csv_path) -> np.ndarray:
+    """
+    Loads a csv from its compiled store, memory mapped so only the rows used
+    are ever read. The store is compiled first if it is missing or older than
+    the csv.
+    :param csv_path: path to the csv
+    :return: structured array with a field for each column of the csv, text
+    columns are byte strings
+    """
+    if is_store_current(csv_path):
+        return np.load(get_store_path(csv_path), mmap_mode="r")
+    log.debug(f"compiling {csv_path}")
+    return compile_table(csv_path)
+
+
+def compile_barcode_resources(path=None) -> int:
+    """
+    Compiles every csv of the barcode resources, the set indices and the sets.
+    :param path: directory to compile, defaults to resources/barcodes
+    :return: the number of csvs compiled
+    """
+    if path is None:
+        path = get_resources_path() / "barcodes"
+    count = 0
+    for csv_path in sorted(Path(path).glob("**/*.csv")):
+        compile_table(csv_path)
+        count += 1
+    return count
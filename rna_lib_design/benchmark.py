@@ -0,0 +1,274 @@
+import copy
+import importlib.metadata
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from rna_lib_design import design as design_module
+from rna_lib_design.design import DesignOpts, Designer, SeqStructDesigner
+from rna_lib_design.folding import FoldCache
+from rna_lib_design.logger import get_logger
+from rna_lib_design.parameters import get_preset_parameters
+from rna_lib_design.scoring import StructureScorer
+from rna_lib_design.settings import get_resources_path
+from rna_lib_design.structure_set import SequenceStructureSet
+
+log = get_logger("BENCHMARK")
+
+# library sizes benchmarked by default
+BENCH_SIZES = [1000, 10000, 100000]
+# the stub backend folds every sequence unpaired with an ensemble defect of 0,
+# any mismatch is allowed so every attempt scores as a success and the run
+# follows the same path as a library that designs well
+BENCH_DESIGN_OPTS = {
+    "fold_backend": "fake",
+    "allowed_ss_mismatch": 1000000,
+    "allowed_ss_mismatch_barcodes": 1000000,
+}
+# how many times the barcode lengths of a preset are raised by one to get sets
+# large enough for a library before the case is skipped
+MAX_LENGTH_INCREASE = 4
+# functions on the design hot path that are timed, times are inclusive so the
+# time of get_random is also part of apply
+HOT_PATH_STAGES = {
+    "setup": (design_module, "get_seq_struct_designer"),
+    "design": (Designer, "design"),
+    "apply": (SeqStructDesigner, "apply_template"),
+    "get_random": (SequenceStructureSet, "get_random"),
+    "fold": (FoldCache, "fold_batch"),
+    # the mfe only folds of the screen, on by default
+    "fold_mfe": (FoldCache, "fold_mfe_batch"),
+    "score": (StructureScorer, "score_batch"),
+    "accept": (SeqStructDesigner, "accept_previous_solution"),
+    "write_output": (design_module, "write_output_dir"),
+}
+
+
+class StageTimer:
+    """
+    Counts the calls to and the time spent in a set of functions. Inside a
+    with block each function is replaced on its class or module by a wrapper
+    that times it, the originals are put back on exit.
+    """
+
+    def __init__(self, stages: Dict[str, Tuple[object, str]]):
+        self.stages = stages
+        self.calls = dict.fromkeys(stages, 0)
+        self.seconds = dict.fromkeys(stages, 0.0)
+        self._originals = {}
+
+    def __enter__(self):
+        for name, (owner, attr) in self.stages.items():
+            org_func = getattr(owner, attr)
+            self._originals[name] = org_func
+            setattr(owner, attr, self.__wrap(name, org_func))
+        return self
+
+    def __exit__(self, *args):
+        for name, (owner, attr) in self.stages.items():
+            setattr(owner, attr, self._originals[name])
+        self._originals = {}
+
+    def to_dict(self) -> Dict[str, dict]:
+        return {
+            name: {"calls": self.calls[name], "seconds": self.seconds[name]}
+            for name in self.stages
+        }
+
+    def __wrap(self, name, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.calls[name] += 1
+                self.seconds[name] += time.perf_counter() - start
+
+        return timed
+
+
+def get_version() -> str:
+    try:
+        return importlib.metadata.version("rna_lib_design")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Peak resident memory of this process so far in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
+
+
+def get_bench_presets() -> List[str]:
+    """
+    The name of every bundled preset, e.g. single_barcode_standard.
+    """
+    return sorted(p.stem for p in (get_resources_path() / "presets").glob("*.yml"))
+
+
+def get_preset_params(preset: str) -> dict:
+    """
+    The parameters of a bundled preset by its full name.
+    """
+    for schema in (get_resources_path() / "schemas").glob("*.json"):
+        if preset.startswith(schema.stem + "_"):
+            return get_preset_parameters(preset[len(schema.stem) + 1 :], schema.stem)
+    raise ValueError(f"unknown preset: {preset}")
+
+
+def get_synthetic_library(num_seqs: int, length: int = 60, seed: int = 0):
+    """
+    A library of random hairpins with their structure and an ensemble defect,
+    so nothing has to be folded before designing. The same seed always gives
+    the same library.
+    :param num_seqs: number of sequences
+    :param length: length of each sequence
+    """
+    rng = np.random.RandomState(seed)
+    stem = 8
+    loop = length - 2 * stem
+    bases = np.array(list("ACGU"))
+    complement = np.array([3, 2, 1, 0])
+    stems = rng.randint(0, 4, size=(num_seqs, stem))
+    loops = rng.randint(0, 4, size=(num_seqs, loop))
+    seqs = np.concatenate([stems, loops, complement[stems][:, ::-1]], axis=1)
+    structure = "(" * stem + "." * loop + ")" * stem
+    return pd.DataFrame(
+        {
+            "name": [f"seq_{i}" for i in range(num_seqs)],
+            "sequence": ["".join(row) for row in bases[seqs]],
+            "structure": structure,
+            "ens_defect": 0.0,
+        }
+    )
+
+
+def scale_barcode_lengths(params: dict, num_seqs: int) -> Optional[dict]:
+    """
+    The parameters with every barcode length raised until the barcode sets
+    are large enough for num_seqs sequences. None if they cannot be.
+    """
+    params = copy.deepcopy(params)
+    for _ in range(MAX_LENGTH_INCREASE + 1):
+        try:
+            design_module.get_seq_struct_designer(
+                num_seqs, params["build_str"], params["segments"]
+            )
+            return params
+        except ValueError as e:
+            log.debug(f"barcode sets too small for {num_seqs} sequences: {e}")
+        found = False
+        for segment in params["segments"].values():
+            if "m_type" not in segment:
+                continue
+            found = True
+            start, _, end = str(segment["length"]).partition("-")
+            if end == "":
+                segment["length"] = int(start) + 1
+            else:
+                segment["length"] = f"{int(start) + 1}-{int(end) + 1}"
+        if not found:
+            return None
+    return None
+
+
+def run_case(preset: str, num_seqs: int, length: int = 60, seed: int = 0) -> dict:
+    """
+    Designs a synthetic library with a preset, times each stage of the hot
+    path and writes the results to a temporary directory.
+    :return: the throughput, peak memory and time of each stage
+    """
+    case = {"preset": preset, "num_seqs": num_seqs}
+    params = scale_barcode_lengths(get_preset_params(preset), num_seqs)
+    if params is None:
+        case["skipped"] = "barcode sets are too small for the library"
+        log.warning(f"{preset} with {num_seqs} sequences: {case['skipped']}")
+        return case
+    case["segments"] = params["segments"]
+    design_opts = params.get("design_opts", {})
+    opts = DesignOpts(**{**design_opts, **BENCH_DESIGN_OPTS})
+    df = get_synthetic_library(num_seqs, length, seed)
+    np.random.seed(seed)
+    timer = StageTimer(HOT_PATH_STAGES)
+    with tempfile.TemporaryDirectory() as output_dir, timer:
+        start = time.perf_counter()
+        results = design_module.design(
+            1, df, params["build_str"], params["segments"], opts
+        )
+        design_seconds = time.perf_counter() - start
+        design_module.write_output_dir(results.df_results, Path(output_dir))
+        total_seconds = time.perf_counter() - start
+    case["num_designed"] = len(results.df_results)
+    case["design_seconds"] = design_seconds
+    case["total_seconds"] = total_seconds
+    case["seqs_per_sec"] = num_seqs / design_seconds
+    case["peak_rss_mb"] = get_peak_rss_mb()
+    case["stages"] = timer.to_dict()
+    log.info(
+        f"{preset} with {num_seqs} sequences: {case['seqs_per_sec']:.1f} seqs/sec "
+        f"peak rss {case['peak_rss_mb']:.1f} MB"
+    )
+    return case
+
+
+def run_benchmark(
+    presets: Optional[List[str]] = None,
+    sizes: Optional[List[int]] = None,
+    length: int = 60,
+    seed: int = 0,
+    isolate: bool = True,
+) -> dict:
+    """
+    Runs every preset on a synthetic library of every size.
+    :param presets: names of the presets, defaults to every bundled preset
+    :param sizes: library sizes, defaults to BENCH_SIZES
+    :param isolate: run each case in a new process so its peak memory is its
+    own and nothing is cached between cases
+    :return: the results of each case with details of the environment
+    """
+    if presets is None:
+        presets = get_bench_presets()
+    if sizes is None:
+        sizes = BENCH_SIZES
+    cases = []
+    for preset in presets:
+        for num_seqs in sizes:
+            if not isolate:
+                cases.append(run_case(preset, num_seqs, length, seed))
+                continue
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                future = executor.submit(run_case, preset, num_seqs, length, seed)
+                cases.append(future.result())
+    return {
+        "version": get_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "length": length,
+        "seed": seed,
+        "cases": cases,
+    }
+
+
+def write_benchmark(results: dict, path) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=4)
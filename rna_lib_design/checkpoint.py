@@ -0,0 +1,165 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+
+from rna_lib_design.logger import get_logger
+
+log = get_logger("CHECKPOINT")
+
+CHECKPOINT_STATE = "checkpoint.json"
+CHECKPOINT_ROWS = "checkpoint-rows.csv"
+
+
+class DesignCheckpoint(object):
+    """
+    Saves the progress of a design run into its output directory so it can be
+    resumed after a crash. The state file holds how many input sequences have
+    been processed, the failure and fold cache counters, the used members of
+    each barcode set, the barcode regions designed so far and the size of every
+    output file at the time it was saved. It is replaced atomically, so it
+    always describes a consistent point of the run. On load, output files are
+    truncated back to their saved sizes which drops any rows written after that
+    point.
+    """
+
+    def __init__(self, output_dir, interval: float = 60.0):
+        self.output_dir = Path(output_dir)
+        self.interval = interval
+        self.num_processed = 0
+        self.num_rows = 0
+        self.failures = {}
+        self.fold_stats = {}
+        self.used = []
+        self.barcodes = []
+        self.files = {}
+        # dtype of each column of the rows file so it can be read back as written
+        self.dtypes = {}
+        self._last_save = time.monotonic()
+
+    @property
+    def state_path(self) -> Path:
+        return self.output_dir / CHECKPOINT_STATE
+
+    @property
+    def rows_path(self) -> Path:
+        return self.output_dir / CHECKPOINT_ROWS
+
+    def load(self) -> bool:
+        """
+        Loads the saved state and truncates the output files to match it.
+        :return: False if there is no checkpoint to resume from
+        """
+        if not self.state_path.exists():
+            return False
+        with open(self.state_path) as f:
+            state = json.load(f)
+        self.num_processed = state["num_processed"]
+        self.num_rows = state["num_rows"]
+        self.failures = state["failures"]
+        self.fold_stats = state["fold_stats"]
+        self.used = state["used"]
+        self.barcodes = state.get("barcodes", [])
+        self.files = state["files"]
+        self.dtypes = state.get("dtypes", {})
+        for name, size in self.files.items():
+            path = self.output_dir / name
+            if not path.exists():
+                raise ValueError(f"checkpoint file {path} is missing, cannot resume")
+            with open(path, "r+b") as f:
+                f.truncate(size)
+        self._last_save = time.monotonic()
+        return True
+
+    def update(self, results) -> None:
+        """
+        Adds the results of a designed batch to the counters.
+        :param results: the DesignerResults of the batch
+        """
+        self.num_processed += results.num_sequences
+        self.num_rows += len(results.df_results)
+        for key, value in results.failures.items():
+            self.failures[key] = self.failures.get(key, 0) + value
+        for key, value in results.fold_stats.items():
+            self.fold_stats[key] = self.fold_stats.get(key, 0) + value
+
+    def is_due(self) -> bool:
+        """
+        True once interval seconds have passed since the last save.
+        """
+        return time.monotonic() - self._last_save >= self.interval
+
+    def save(
+        self, used: List[dict], files: List[Path], barcodes: List[str] = None
+    ) -> None:
+        """
+        Writes the state file. Files must be flushed before calling this.
+        :param used: the used state of the barcode sets
+        :param files: the output files written so far
+        :param barcodes: the barcode regions of the designs so far, only kept
+        when a minimum barcode edit distance is enforced
+        """
+        self.used = used
+        if barcodes is not None:
+            self.barcodes = barcodes
+        self.files = {
+            Path(f).name: os.path.getsize(f) for f in files if Path(f).exists()
+        }
+        state = {
+            "num_processed": self.num_processed,
+            "num_rows": self.num_rows,
+            "failures": self.failures,
+            "fold_stats": self.fold_stats,
+            "used": self.used,
+            "barcodes": self.barcodes,
+            "files": self.files,
+            "dtypes": self.dtypes,
+        }
+        tmp_path = self.state_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+        self._last_save = time.monotonic()
+        log.debug(f"checkpoint saved after {self.num_processed} sequences")
+
+    def append_rows(self, df: pd.DataFrame) -> None:
+        """
+        Appends designed rows to the checkpoint rows file, used when the results
+        are not already being written to the output directory as they are made.
+        """
+        header = not self.rows_path.exists() or self.rows_path.stat().st_size == 0
+        if header:
+            self.dtypes = {col: str(dtype) for col, dtype in df.dtypes.items()}
+        df.to_csv(self.rows_path, mode="a", header=header, index=False)
+
+    def read_rows(self) -> pd.DataFrame:
+        """
+        The rows appended so far. Every column is read as text, e.g. a name of
+        0001 stays 0001, then the numeric and bool columns get their dtype back.
+        """
+        if not self.rows_path.exists() or self.rows_path.stat().st_size == 0:
+            return pd.DataFrame()
+        df = pd.read_csv(self.rows_path, dtype=str, keep_default_na=False)
+        for col, dtype in self.dtypes.items():
+            if col not in df.columns:
+                continue
+            kind = pd.api.types.pandas_dtype(dtype).kind
+            if kind in "iuf":
+                # missing values are written as empty strings
+                df[col] = pd.to_numeric(df[col].mask(df[col] == ""))
+            elif kind == "b":
+                df[col] = df[col] == "True"
+        return df
+
+    def remove(self) -> None:
+        """
+        Removes the checkpoint once the run has finished.
+        """
+        for path in [self.state_path, self.rows_path]:
+            if path.exists():
+                path.unlink()
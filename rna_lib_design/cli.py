@@ -1,28 +1,14 @@
-import json
 import os
 import shutil
-import pandas as pd
 import cloup
-import yaml
-from tabulate import tabulate
 from cloup import option_group, option
-from pathlib import Path
 
-from rna_lib_design.design import (
-    DesignOpts,
-    design_and_save_output,
-    write_output_dir,
-    log_failed_design_sequences,
-)
-from seq_tools import calc_edit_distance, trim
 from rna_lib_design.logger import get_logger, setup_applevel_logger
-from rna_lib_design.parameters import (
-    parse_parameters_from_file,
-    combine_params,
-    get_preset_parameters,
-)
 from rna_lib_design.settings import get_resources_path
 
+# heavy dependencies (pandas, numpy, vienna, seq_tools, ...) are only imported
+# inside the commands that use them so the cli starts quickly
+
 log = get_logger("CLI")
 
 
@@ -55,6 +41,8 @@ def is_valid_method(method_name):
 
 # TODO check for edit distance of library?
 def validate_initial_library(csv):
+    import pandas as pd
+
     df = pd.read_csv(csv)
     log.info(f"csv has {len(df)} sequences")
     min_len = df["sequence"].str.len().min()
@@ -69,6 +57,12 @@ def validate_initial_library(csv):
 
 
 def get_method_params(method_name, btype, param_file, args):
+    from rna_lib_design.parameters import (
+        parse_parameters_from_file,
+        combine_params,
+        get_preset_parameters,
+    )
+
     is_valid_method(method_name)
     schema_file = get_resources_path() / "schemas" / f"{method_name}.json"
     log.info(f"Using schema file: {schema_file}")
@@ -96,10 +90,15 @@ def get_method_params(method_name, btype, param_file, args):
     params["preprocess"]["skip_length_check"] = args["skip_length_check"]
     # params["preprocess"]["skip_edit_distance_check"] = args["skip_edit_distance_check"]
     params["postprocess"]["skip_edit_distance"] = args["skip_edit_dist"]
+    if args["outputs"] is not None:
+        params["postprocess"]["outputs"] = args["outputs"].split(",")
     return params
 
 
 def setup_method(method_name, csv, btype, param_file, output, args):
+    import pandas as pd
+    from seq_tools import trim
+
     is_valid_method(method_name)
     os.makedirs(output, exist_ok=True)
     setup_log_and_log_inputs(csv, btype, param_file, output, args["debug"])
@@ -116,6 +115,22 @@ def setup_method(method_name, csv, btype, param_file, output, args):
     return params, df_seqs
 
 
+def run_method(method_name, csv, btype, param_file, output, args):
+    from rna_lib_design.design import (
+        design_and_save_output,
+        design_stream_and_save_output,
+    )
+
+    if args["stream"]:
+        os.makedirs(output, exist_ok=True)
+        setup_log_and_log_inputs(csv, btype, param_file, output, args["debug"])
+        params = get_method_params(method_name, btype, param_file, args)
+        design_stream_and_save_output(csv, output, params, args["resume"])
+        return
+    params, df_seqs = setup_method(method_name, csv, btype, param_file, output, args)
+    design_and_save_output(df_seqs, output, params, args["resume"])
+
+
 # cli commands ########################################################################
 
 
@@ -170,6 +185,31 @@ def main_options():
             default=0,
             help="trim sequence at 3' end by this length",
         ),
+        option(
+            "--stream",
+            is_flag=True,
+            help=(
+                "read the csv in chunks and write results as they are designed, "
+                "keeps memory flat for very large libraries"
+            ),
+        ),
+        option(
+            "--resume",
+            is_flag=True,
+            help=(
+                "carry on from the checkpoint of a run in the output directory, "
+                "checkpoints are saved when design_opts.checkpoint_interval is set"
+            ),
+        ),
+        option(
+            "--outputs",
+            type=str,
+            default=None,
+            help=(
+                "comma separated outputs to write from all, rna, fasta, dna, opool, "
+                "xlsx and parquet, defaults to all of them except parquet"
+            ),
+        ),
     )
 
 
@@ -189,8 +229,7 @@ def add_common(csv, btype, param_file, output, **args):
     """
     add common p5/p3 sequences
     """
-    params, df_seqs = setup_method("add_common", csv, btype, param_file, output, args)
-    design_and_save_output(df_seqs, output, params)
+    run_method("add_common", csv, btype, param_file, output, args)
 
 
 @cli.command()
@@ -200,10 +239,7 @@ def barcode(csv, btype, param_file, output, **args):
     """
     adds a single barcode
     """
-    params, df_seqs = setup_method(
-        "single_barcode", csv, btype, param_file, output, args
-    )
-    design_and_save_output(df_seqs, output, params)
+    run_method("single_barcode", csv, btype, param_file, output, args)
 
 
 @cli.command()
@@ -213,22 +249,83 @@ def barcode2(csv, btype, param_file, output, **args):
     """
     adds two barcodes
     """
-    params, df_seqs = setup_method(
-        "double_barcode", csv, btype, param_file, output, args
-    )
-    design_and_save_output(df_seqs, output, params)
+    run_method("double_barcode", csv, btype, param_file, output, args)
 
 
 @cli.command()
 @cloup.argument("csv", type=cloup.Path(exists=True))
-def edit_distance(csv):
+@option(
+    "-p",
+    "--num-processes",
+    type=int,
+    default=1,
+    help="number of processes to run simultaneously",
+)
+@option(
+    "--exact",
+    is_flag=True,
+    help="always find the exact minimum, can be slow for large libraries",
+)
+def edit_distance(csv, num_processes, exact):
     """
     compute edit distance of library
     """
+    import pandas as pd
+    from rna_lib_design.edit_distance import (
+        calc_library_edit_distance,
+        log_edit_distance_results,
+    )
+
     setup_applevel_logger()
     log.info(f"Using csv: {csv}")
     df = pd.read_csv(csv)
-    log.info("edit distance:" + str(calc_edit_distance(df)))
+    results = calc_library_edit_distance(df, num_processes, exact)
+    log_edit_distance_results(df, results)
+
+
+@cli.command()
+def compile_barcodes():
+    """
+    compiles the barcode csvs into memory mapped stores, run after changing them
+    """
+    from rna_lib_design.barcode_store import compile_barcode_resources
+
+    setup_applevel_logger()
+    count = compile_barcode_resources()
+    log.info(f"compiled {count} barcode csvs")
+
+
+@cli.command()
+@option(
+    "-n",
+    "--num-seqs",
+    type=int,
+    multiple=True,
+    help="library sizes to run, defaults to 1000, 10000 and 100000",
+)
+@option(
+    "--preset",
+    multiple=True,
+    help="presets to run e.g. single_barcode_standard, defaults to all of them",
+)
+@option("-o", "--output", default="bench.json", help="json file to write results to")
+@option("--length", type=int, default=60, help="length of each synthetic sequence")
+@option("--seed", type=int, default=0, help="seed of the synthetic libraries")
+def bench(num_seqs, preset, output, length, seed):
+    """
+    benchmarks design on synthetic libraries with a stub fold backend
+    """
+    from rna_lib_design.benchmark import run_benchmark, write_benchmark
+
+    setup_applevel_logger()
+    results = run_benchmark(
+        presets=preset or None,
+        sizes=num_seqs or None,
+        length=length,
+        seed=seed,
+    )
+    write_benchmark(results, output)
+    log.info(f"benchmark results written to {output}")
 
 
 @cli.command()
@@ -237,12 +334,15 @@ def list(name):
     """
     lists resources available
     """
+    import pandas as pd
+    from tabulate import tabulate
+    from rna_lib_design.named_seqs import get_named_seq_registry
+
     setup_applevel_logger()
     seqs = {"p5": "p5_sequences", "p3": "p3_sequences", "loops": "loops"}
     barcodes = {"helix_barcodes": "helices", "sstrand_barcodes": "sstrands"}
     if name in seqs:
-        dir_path = get_resources_path() / f"named_seqs/rna/{seqs[name]}.csv"
-        df = pd.read_csv(dir_path)
+        df = get_named_seq_registry().get_table(f"rna/{seqs[name]}")
         log.info(
             f"{name} sequences available\n"
             + tabulate(df, headers="keys", tablefmt="psql", showindex=False)
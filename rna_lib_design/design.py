@@ -1,37 +1,47 @@
 import multiprocessing
-from collections import Counter
+from collections import Counter, deque
 import os
 from tabulate import tabulate
 import yaml
 import json
 
-import pandas as pd
 import numpy as np
+import pandas as pd
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 
-from dataclasses import dataclass
-from vienna import fold
+from dataclasses import dataclass, field
 from vienna.vienna import FoldResults
 
-from seq_tools import (
-    fold as fold_seqs_in_df,
-    to_dna,
-    to_dna_template,
-    to_fasta,
-    calc_edit_distance,
-)
+from seq_tools import trim
 from rna_lib_design.structure_set import (
     SequenceStructure,
     SequenceStructureSetParser,
 )
 from rna_lib_design.structure_set import SequenceStructureSet, SequenceStructure
+from rna_lib_design.folding import (
+    FoldCache,
+    fold_dataframe,
+    get_fold_backend,
+    get_fold_executor,
+    log_fold_cache_stats,
+)
+from rna_lib_design.scoring import StructureScorer
+from rna_lib_design.checkpoint import DesignCheckpoint
+from rna_lib_design.barcode_index import BarcodeIndex
+from rna_lib_design.edit_distance import (
+    calc_library_edit_distance,
+    log_edit_distance_results,
+)
 
 from rna_lib_design.logger import get_logger
-from rna_lib_design.util import get_seq_fwd_primer
+from rna_lib_design.output import StreamOutputWriter, get_outputs, write_output_dir
 
 log = get_logger("DESIGN")
 
+# number of rows read from a csv at a time in stream mode
+STREAM_CHUNK_SIZE = 10000
+
 
 def parse_build_str(seq_str):
     """
@@ -90,13 +100,21 @@ class SeqStructDesignStep:
         self.symbol = symbol
         self.length = len(cur_set.get_random().split_strands()[0])
         self.last: SequenceStructure = None
+        # index of last in the set, used to mark it used in constant time
+        self.last_index: int = None
         self.symbol_str = symbol * self.length
+        self.num_strands = cur_set.get_random().sequence.count("&") + 1
         self.is_single = 0
         if len(self.set) == 1:
             self.is_single = 1
             self.last = self.set.get_random()
+            self.last_index = 0
+        # strand sequences and structures of each set member drawn so far
+        self._strands = {}
 
     def split(self, n_splits):
+        # split shuffles the set so the cached strands no longer line up
+        self._strands = {}
         sets = self.set.split(n_splits)
         return [
             SeqStructDesignStep(self.direction, self.name, s, self.symbol) for s in sets
@@ -144,10 +162,47 @@ class SeqStructDesignStep:
             )
             d_seq_struct = SequenceStructure(sequence, structure)
         self.last = ss
+        self.last_index = self.set.last
         return d_seq_struct
 
+    def draw(self) -> Tuple[List[str], List[str]]:
+        """
+        Picks a random SequenceStructure from the set like apply does, but
+        returns its strands as (sequences, structures) instead of building the
+        designed sequence structure. Used with SeqStructDesigner.apply_template.
+        """
+        ss = self.set.get_random()
+        self.last = ss
+        self.last_index = self.set.last
+        strands = self._strands.get(self.last_index)
+        if strands is None:
+            split = ss.split_strands()
+            strands = ([s.sequence for s in split], [s.structure for s in split])
+            self._strands[self.last_index] = strands
+        return strands
+
     def accept_design(self):
-        self.set.set_used(self.last)
+        self.set.claim(self.last_index)
+
+    def get_barcode(self, index) -> str:
+        """
+        The sequence of every strand of a member of the set joined together.
+        """
+        return self.set.seqstructs[index].sequence.replace("&", "")
+
+
+@dataclass(frozen=True)
+class DesignTemplate:
+    """
+    A designable sequence structure compiled once into the fixed pieces between
+    barcode slots. Each slot is filled by a strand of a step, given as
+    (step index, strand index), so building a design attempt is a single join
+    for the sequence and one for the structure.
+    """
+
+    seq_pieces: List[str]
+    ss_pieces: List[str]
+    slots: List[Tuple[int, int]]
 
 
 class SeqStructDesigner(object):
@@ -182,6 +237,7 @@ class SeqStructDesigner(object):
         ]
         self.symbol_count = 0
         self.steps: List[SeqStructDesignStep] = []
+        self.barcode_index: Optional[BarcodeIndex] = None
 
     def __len__(self):
         return len(self.steps)
@@ -214,16 +270,177 @@ class SeqStructDesigner(object):
             d_seq_struct = step.apply(d_seq_struct)
         return d_seq_struct
 
+    def compile(self, d_seq_struct) -> DesignTemplate:
+        """
+        Compiles a designable sequence structure into a DesignTemplate. Slots are
+        found the same way apply fills them, each strand of a step takes the
+        first run of the step's symbols not already taken.
+        """
+        spans = []
+        remaining = d_seq_struct.sequence
+        for i, step in enumerate(self.steps):
+            if step.is_single:
+                continue
+            for j in range(step.num_strands):
+                pos = remaining.find(step.symbol_str)
+                if pos == -1:
+                    break
+                end = pos + len(step.symbol_str)
+                spans.append((pos, end, i, j))
+                remaining = remaining[:pos] + "\0" * (end - pos) + remaining[end:]
+        spans.sort()
+        seq_pieces = []
+        ss_pieces = []
+        start = 0
+        for pos, end, _, _ in spans:
+            seq_pieces.append(d_seq_struct.sequence[start:pos])
+            ss_pieces.append(d_seq_struct.structure[start:pos])
+            start = end
+        seq_pieces.append(d_seq_struct.sequence[start:])
+        ss_pieces.append(d_seq_struct.structure[start:])
+        slots = [(i, j) for _, _, i, j in spans]
+        return DesignTemplate(seq_pieces, ss_pieces, slots)
+
+    def apply_template(self, template: DesignTemplate) -> SequenceStructure:
+        """
+        Same as apply but builds the design attempt from a compiled template.
+        """
+        strands = [step.draw() for step in self.steps]
+        seq_parts = [template.seq_pieces[0]]
+        ss_parts = [template.ss_pieces[0]]
+        for k, (i, j) in enumerate(template.slots):
+            seq_parts.append(strands[i][0][j])
+            seq_parts.append(template.seq_pieces[k + 1])
+            ss_parts.append(strands[i][1][j])
+            ss_parts.append(template.ss_pieces[k + 1])
+        return SequenceStructure("".join(seq_parts), "".join(ss_parts))
+
     def accept_design(self):
         for step in self.steps:
             step.accept_design()
+        if self.barcode_index is not None:
+            self.barcode_index.add(self.get_barcode(self.get_solution()))
+
+    def set_min_barcode_edit_distance(self, min_distance: int) -> None:
+        """
+        Keeps an index of the barcode regions of accepted designs so a solution
+        whose barcode region is within min_distance - 1 edits of one already
+        accepted is never accepted. 0 turns the check off.
+        """
+        self.barcode_index = None
+        if min_distance > 0 and len(self.__get_barcode_steps()) > 0:
+            self.barcode_index = BarcodeIndex(min_distance)
+
+    def get_barcode(self, solution) -> str:
+        """
+        The barcode region of a solution from get_solution, the sequences of
+        every step with more than one member joined together.
+        """
+        return "".join(
+            self.steps[i].get_barcode(solution[i]) for i in self.__get_barcode_steps()
+        )
+
+    def is_barcode_distinct(self, solution) -> bool:
+        """
+        False if the barcode region of a solution is too close to the barcode
+        region of an accepted design.
+        """
+        if self.barcode_index is None:
+            return True
+        return self.barcode_index.is_distinct(self.get_barcode(solution))
+
+    def get_solution(self) -> List[int]:
+        """
+        The index in each step's set of the SequenceStructure last applied.
+        """
+        return [step.last_index for step in self.steps]
+
+    def accept_previous_solution(self, solution) -> bool:
+        """
+        Claims every SequenceStructure in a solution from get_solution. If one
+        was already used, which can happen when the sets are shared between
+        processes, nothing is claimed and False is returned.
+        """
+        for i, index in enumerate(solution):
+            if not self.steps[i].set.claim(index):
+                for j in range(i):
+                    self.steps[j].set.release(solution[j])
+                return False
+        if self.barcode_index is None:
+            return True
+        # another process may have accepted a close barcode region since the
+        # solution was checked
+        if not self.barcode_index.add(self.get_barcode(solution)):
+            for i, index in enumerate(solution):
+                self.steps[i].set.release(index)
+            return False
+        return True
+
+    def share(self):
+        """
+        Moves the used flags of every set into shared memory so worker processes
+        can all draw from the full sets.
+        """
+        for step in self.steps:
+            step.set.share()
+        if self.barcode_index is not None:
+            steps = self.__get_barcode_steps()
+            # every design uses up a member of each barcode step
+            capacity = min(len(self.steps[i].set) for i in steps)
+            # members of a set can differ in length, e.g. a range of helix lengths
+            key_length = sum(self.steps[i].set.max_sequence_length() for i in steps)
+            self.barcode_index.share(capacity, key_length)
+
+    def unshare(self):
+        for step in self.steps:
+            step.set.unshare()
+        if self.barcode_index is not None:
+            self.barcode_index.unshare()
+
+    def get_barcodes(self) -> List[str]:
+        """
+        The barcode regions of every accepted design, empty if they are not
+        being checked.
+        """
+        if self.barcode_index is None:
+            return []
+        return self.barcode_index.get_keys()
+
+    def get_used_state(self) -> List[dict]:
+        """
+        The size of each step's set and the indices used in it, so a resumed run
+        never hands out a SequenceStructure that is already in a design.
+        """
+        return [
+            {"size": len(step.set), "used": step.set.used_indices()}
+            for step in self.steps
+        ]
 
-    def get_solution(self):
-        return [step.last for step in self.steps]
+    def restore_used_state(
+        self, used_state: List[dict], barcodes: Optional[List[str]] = None
+    ) -> None:
+        """
+        Claims everything marked as used by get_used_state. The sets must be the
+        same as the ones the state was taken from.
+        :param barcodes: the barcode regions from get_barcodes, they are added to
+        the barcode index without being checked again
+        """
+        sizes = [len(step.set) for step in self.steps]
+        if sizes != [u["size"] for u in used_state]:
+            raise ValueError(
+                "the sets of this run do not match the checkpoint, was it made "
+                "with different parameters?"
+            )
+        for step, u in zip(self.steps, used_state):
+            for index in u["used"]:
+                step.set.claim(index)
+        if self.barcode_index is None or barcodes is None:
+            return
+        for key in barcodes:
+            self.barcode_index.add(key, force=True)
 
-    def accept_previous_solution(self, solution):
-        for i, seq_struct in enumerate(solution):
-            self.steps[i].set.set_used(seq_struct)
+    def __get_barcode_steps(self) -> List[int]:
+        return [i for i, step in enumerate(self.steps) if not step.is_single]
 
 
 def get_seq_struct_designer(num_seqs, build_str, params) -> SeqStructDesigner:
@@ -268,12 +485,38 @@ class DesignOpts:
     score_method: str = "increase"
     allowed_ss_mismatch: int = 2
     allowed_ss_mismatch_barcodes: int = 2
+    fold_backend: str = "vienna"
+    fold_cache_size: int = 100000
+    fold_cache_path: str = ""
+    attempt_batch_size: int = 1
+    fold_executor: str = "serial"
+    fold_workers: int = 0
+    checkpoint_interval: float = 0.0
+    min_barcode_edit_distance: int = 0
+    mfe_screen: bool = True
+
+
+# columns of the results of a design run, used when nothing was designed
+RESULT_COLUMNS = [
+    "name",
+    "sequence",
+    "structure",
+    "ens_defect",
+    "mfe",
+    "design_sequence",
+    "design_structure",
+    "org_ens_defect",
+    "org_sequence",
+    "org_structure",
+]
 
 
 @dataclass(frozen=True, order=True)
 class DesignerResults:
     df_results: pd.DataFrame
     failures: dict
+    fold_stats: dict = field(default_factory=dict)
+    num_sequences: int = 0
 
 
 class Designer:
@@ -282,48 +525,96 @@ class Designer:
         self.failures = {
             "high_ens_defect": 0,
             "ss_mismatches": 0,
-            "ss_mismatches_barcodes": 0,
+            "ss_mismatch_barcodes": 0,
+            "barcode_edit_distance": 0,
         }
+        self.fold_cache = FoldCache()
+        self.fold_executor = None
 
     def setup(
         self,
         opts: DesignOpts,
     ):
         self.opts = opts
+        cache_path = None
+        if opts.fold_cache_path != "":
+            cache_path = opts.fold_cache_path
+        self.close()
+        self.fold_cache = FoldCache(
+            opts.fold_cache_size, cache_path, get_fold_backend(opts.fold_backend)
+        )
+        self.fold_executor = get_fold_executor(
+            opts.fold_executor, opts.fold_workers, opts.attempt_batch_size
+        )
+
+    def close(self):
+        """
+        shuts down the executor used to fold batches of attempts and closes the
+        fold cache and its backend
+        """
+        if self.fold_executor is not None:
+            self.fold_executor.shutdown()
+            self.fold_executor = None
+        self.fold_cache.close()
 
     def design(self, df_sequences, seq_struct_designer):
         designer = seq_struct_designer
+        # counts are per call so a designer can be reused across batches
+        self.failures = dict.fromkeys(self.failures, 0)
+        cache_start = self.fold_cache.stats()
         df_results = self.__setup_dataframe(df_sequences)
-        count = -1
-        for i, row in df_results.iterrows():
-            count += 1
-            if count % 100 == 0 and count > 0:
-                log.info(f"processed {count} sequences")
-                print(f"processed {count} sequences")
+        num_seqs = len(df_results)
+        names = df_results["name"].tolist()
+        org_seqs = df_results["org_sequence"].tolist()
+        org_structs = df_results["org_structure"].tolist()
+        org_ens_defects = df_results["org_ens_defect"].tolist()
+        # results are collected in column buffers and put in the dataframe once
+        # at the end, setting cells one at a time is slow for large libraries
+        columns = {
+            "sequence": [""] * num_seqs,
+            "structure": [""] * num_seqs,
+            "ens_defect": np.full(num_seqs, -999.0),
+            "mfe": np.full(num_seqs, 999.0),
+            "design_sequence": [""] * num_seqs,
+            "design_structure": [""] * num_seqs,
+        }
+        designed = np.zeros(num_seqs, dtype=bool)
+        for i in range(num_seqs):
+            if i % 100 == 0 and i > 0:
+                log.info(f"processed {i} sequences")
+                print(f"processed {i} sequences")
             try:
-                soi_seq_struct = SequenceStructure(
-                    row["org_sequence"], row["org_structure"]
-                )
+                soi_seq_struct = SequenceStructure(org_seqs[i], org_structs[i])
             except:
                 log.error(
-                    f"failed process {row['name'] }{row['org_sequence']} - {row['org_structure']} skipping"
+                    f"failed process {names[i]}{org_seqs[i]} - {org_structs[i]} "
+                    "skipping"
                 )
                 continue
             d_seq_struct = designer.get_designable_seq_struct(soi_seq_struct)
-            df_results.at[i, "design_sequence"] = d_seq_struct.sequence
-            df_results.at[i, "design_structure"] = d_seq_struct.structure
-            results = self.__get_designed_seq_struct(
-                designer, d_seq_struct, row["name"], row["org_ens_defect"]
-            )
+            columns["design_sequence"][i] = d_seq_struct.sequence
+            columns["design_structure"][i] = d_seq_struct.structure
+            results = None
+            # None means another process claimed a barcode first, design again
+            while results is None:
+                results = self.__get_designed_seq_struct(
+                    designer, d_seq_struct, names[i], org_ens_defects[i]
+                )
             # no design found
             if results[0] == "":
                 continue
-            df_results.at[i, "sequence"] = results[0]
-            df_results.at[i, "structure"] = results[1]
-            df_results.at[i, "ens_defect"] = results[2]
-            df_results.at[i, "mfe"] = results[3]
-        df_results = df_results[df_results["sequence"] != ""]
-        return DesignerResults(df_results, self.failures)
+            columns["sequence"][i] = results[0]
+            columns["structure"][i] = results[1]
+            columns["ens_defect"][i] = results[2]
+            columns["mfe"][i] = results[3]
+            designed[i] = True
+        df_results = df_results.assign(**columns)[designed]
+        self.fold_cache.flush()
+        fold_stats = {
+            key: value - cache_start[key]
+            for key, value in self.fold_cache.stats().items()
+        }
+        return DesignerResults(df_results, self.failures, fold_stats, len(df_sequences))
 
     def __setup_dataframe(self, df):
         df = df.copy()
@@ -335,12 +626,13 @@ class Designer:
                 log.warn(
                     "ens_defect column found but not structure weird behavior will happen"
                 )
-            df = fold_seqs_in_df(df)
-        if "ens_defect" not in df.columns:
+        elif "ens_defect" not in df.columns:
             log.info("no 'ens_defect' column - adding one")
-            if "structure" in df.columns:
-                log.info("structure column will be overwritten with folded structure")
-            df = fold_seqs_in_df(df)
+            log.info("structure column will be overwritten with folded structure")
+        # folded once as a batch, with more than one process each worker folds
+        # the sequences of its own batches
+        if "structure" not in df.columns or "ens_defect" not in df.columns:
+            df = fold_dataframe(df, self.fold_cache, self.fold_executor)
         df.rename(
             columns={
                 "sequence": "org_sequence",
@@ -353,8 +645,8 @@ class Designer:
         df["structure"] = ""
         df["design_sequence"] = ""
         df["design_structure"] = ""
-        df["ens_defect"] = -999
-        df["mfe"] = 999
+        df["ens_defect"] = -999.0
+        df["mfe"] = 999.0
         col_order = ["name", "sequence", "structure", "ens_defect", "mfe"]
         df = df.reindex(col_order + list(df.columns.difference(col_order)), axis=1)
         return df
@@ -366,23 +658,74 @@ class Designer:
         num_solutions = 0
         no_solution = True
         fails = []
-        for i in range(0, self.opts.max_attempts):
-            final_seq_struct = designer.apply(d_seq_struct)
-            r = fold(final_seq_struct.sequence)
-            result = self.__score_design(
-                final_seq_struct.structure, d_seq_struct.structure, r
+        scorer = StructureScorer(
+            d_seq_struct.structure,
+            self.opts.allowed_ss_mismatch,
+            self.opts.allowed_ss_mismatch_barcodes,
+        )
+        template = designer.compile(d_seq_struct)
+        batch_size = max(1, self.opts.attempt_batch_size)
+        screen_mfe = self.opts.mfe_screen and self.fold_cache.backend.folds_mfe
+        attempts = 0
+        while attempts < self.opts.max_attempts:
+            # build a batch of candidates up front so they can be folded together
+            candidates = []
+            for _ in range(min(batch_size, self.opts.max_attempts - attempts)):
+                final_seq_struct = designer.apply_template(template)
+                candidates.append((final_seq_struct, designer.get_solution()))
+            attempts += len(candidates)
+            # with an mfe screen only the candidates that pass are fully folded
+            # to get their ens_defect
+            if screen_mfe:
+                folds = self.fold_cache.fold_mfe_batch(
+                    [c[0].sequence for c in candidates], self.fold_executor
+                )
+            else:
+                folds = self.fold_cache.fold_batch(
+                    [c[0].sequence for c in candidates], self.fold_executor
+                )
+            results = scorer.score_batch(
+                [c[0].structure for c in candidates], [r.dot_bracket for r in folds]
             )
-            if result != "SUCCESS":
-                fails.append(result)
-                continue
-            no_solution = False
-            if r.ens_defect < best_r.ens_defect:
-                best_r = r
-                best_seq_struct = SequenceStructure(
-                    final_seq_struct.sequence, r.dot_bracket
+            passed = []
+            for (final_seq_struct, solution), r, result in zip(
+                candidates, folds, results
+            ):
+                if result != "SUCCESS":
+                    fails.append(result)
+                    continue
+                if not designer.is_barcode_distinct(solution):
+                    fails.append("barcode_edit_distance")
+                    continue
+                passed.append((final_seq_struct, solution, r))
+                if num_solutions + len(passed) >= self.opts.max_solutions:
+                    break
+            if screen_mfe and len(passed) > 0:
+                full_folds = self.fold_cache.fold_batch(
+                    [p[0].sequence for p in passed], self.fold_executor
+                )
+                # the full fold can differ from the mfe only fold, so it is
+                # scored again before being accepted
+                results = scorer.score_batch(
+                    [p[0].structure for p in passed],
+                    [r.dot_bracket for r in full_folds],
                 )
-                best = designer.get_solution()
-            num_solutions += 1
+                screened = []
+                for p, r, result in zip(passed, full_folds, results):
+                    if result != "SUCCESS":
+                        fails.append(result)
+                        continue
+                    screened.append((p[0], p[1], r))
+                passed = screened
+            for final_seq_struct, solution, r in passed:
+                no_solution = False
+                if r.ens_defect < best_r.ens_defect:
+                    best_r = r
+                    best_seq_struct = SequenceStructure(
+                        final_seq_struct.sequence, r.dot_bracket
+                    )
+                    best = solution
+                num_solutions += 1
             if num_solutions >= self.opts.max_solutions:
                 break
         if no_solution:
@@ -404,8 +747,8 @@ class Designer:
                 return ["", "", -999, 999]
         else:
             raise ValueError("unknown score method: " + self.opts.score_method)
-        if len(best) != 0:
-            designer.accept_previous_solution(best)
+        if len(best) != 0 and not designer.accept_previous_solution(best):
+            return None
         return [
             best_seq_struct.sequence,
             best_seq_struct.structure,
@@ -413,34 +756,112 @@ class Designer:
             best_r.mfe,
         ]
 
-    def __score_design(self, structure, design_structure, r) -> str:
-        if r.dot_bracket == structure:
-            return "SUCCESS"
-        total_score = 0
-        barcode_score = 0
-        for _, (s1, s2, ds) in enumerate(
-            zip(structure, r.dot_bracket, design_structure)
-        ):
-            if s1 != s2:
-                total_score += 1
-            if s1 != s2 and ds not in ["(", ")", "."]:
-                barcode_score += 1
-        if total_score > self.opts.allowed_ss_mismatch:
-            return "ss_mismatches"
-        if barcode_score > self.opts.allowed_ss_mismatch_barcodes:
-            return "ss_mismatch_barcodes"
-        return "SUCCESS"
-
-
-def _design(df_sequences, sd, design_opts):
-    df_sequences = df_sequences.copy()
-    designer = Designer()
-    designer.setup(design_opts)
-    return designer.design(df_sequences, sd)
+
+# state of each worker process in a multicore run, set by _init_design_worker
+_worker = {}
+
+
+def _init_design_worker(sd, design_opts):
+    """
+    sets up a worker process. The SeqStructDesigner is shared so every worker
+    draws from the full barcode sets and claims barcodes atomically
+    """
+    _worker["sd"] = sd
+    _worker["designer"] = Designer()
+    _worker["designer"].setup(design_opts)
+
+
+def _design_batch(df_batch):
+    return _worker["designer"].design(df_batch, _worker["sd"])
+
+
+def get_batch_size(num_seqs, n_processes):
+    """
+    size of the batches handed out to workers. Small enough that every worker
+    gets many batches so a slow batch does not hold up the run
+    """
+    return max(1, min(100, num_seqs // (n_processes * 10)))
+
+
+def combine_designer_results(results) -> DesignerResults:
+    """
+    combines the results of designing several batches of sequences
+    """
+    dfs = []
+    failures = {}
+    fold_stats = {}
+    num_sequences = 0
+    for r in results:
+        dfs.append(r.df_results)
+        add_counts(failures, r.failures)
+        add_counts(fold_stats, r.fold_stats)
+        num_sequences += r.num_sequences
+    # there are no batches when there is nothing to design
+    if len(dfs) == 0:
+        dfs.append(pd.DataFrame(columns=RESULT_COLUMNS))
+    return DesignerResults(pd.concat(dfs), failures, fold_stats, num_sequences)
+
+
+def add_counts(total: dict, counts: dict) -> None:
+    """
+    adds each count to the running total in place
+    """
+    for key, value in counts.items():
+        total[key] = total.get(key, 0) + value
+
+
+def iter_design(n_processes, batches, sd, design_opts):
+    """
+    designs batches of sequences one after the other, yielding the results of
+    each batch in order. batches can be a generator, on multiple cores only a
+    few batches are handed out ahead of the workers so it is not read all at once
+    :param n_processes: number of processes to use
+    :param batches: iterable of dataframes of sequences to design
+    :param sd: the sequence structure designer
+    :param design_opts: design options
+    """
+    if n_processes == 1:
+        designer = Designer()
+        designer.setup(design_opts)
+        try:
+            for df_batch in batches:
+                yield designer.design(df_batch, sd)
+        finally:
+            designer.close()
+        return
+    if design_opts.fold_executor == "process":
+        raise ValueError(
+            "the process fold executor can only be used on a single core, use "
+            "the thread executor with more than one process"
+        )
+    # sets must be shared before the pool starts, they go in as initargs
+    sd.share()
+    try:
+        with multiprocessing.Pool(
+            n_processes, _init_design_worker, (sd, design_opts)
+        ) as pool:
+            # batches are picked up as workers become free
+            pending = deque()
+            for df_batch in batches:
+                pending.append(pool.apply_async(_design_batch, (df_batch,)))
+                if len(pending) >= n_processes * 2:
+                    yield pending.popleft().get()
+            while len(pending) > 0:
+                yield pending.popleft().get()
+    finally:
+        sd.unshare()
 
 
 # design interface to be used with single core or multicore
-def design(n_processes, df_sequences, build_str, params, design_opts) -> pd.DataFrame:
+def design(
+    n_processes,
+    df_sequences,
+    build_str,
+    params,
+    design_opts,
+    batch_size=None,
+    checkpoint=None,
+) -> pd.DataFrame:
     """
     design interface to be used with single core or multicore
     :param n_processes: number of processes to use
@@ -448,6 +869,9 @@ def design(n_processes, df_sequences, build_str, params, design_opts) -> pd.Data
     :param build_str: build string
     :param params: params
     :param design_opts: design options
+    :param batch_size: number of sequences handed to a worker at a time
+    :param checkpoint: saves progress as batches are designed, if it was loaded
+    from an earlier run the sequences it already processed are skipped
     :return: dataframe of designed sequences
     """
 
@@ -459,64 +883,238 @@ def design(n_processes, df_sequences, build_str, params, design_opts) -> pd.Data
         df_sequences["name"] = [f"seq_{i}" for i in range(0, len(df_sequences))]
     # generate sequencer designer from params
     sd = get_seq_struct_designer(len(df_sequences), build_str, params)
-    # setup designer object
-    designer = Designer()
-    designer.setup(design_opts)
-    # single core run
+    sd.set_min_barcode_edit_distance(design_opts.min_barcode_edit_distance)
+    if checkpoint is not None and checkpoint.num_processed > 0:
+        log.info(
+            f"resuming from checkpoint, {checkpoint.num_processed} sequences "
+            "already processed"
+        )
+        sd.restore_used_state(checkpoint.used, checkpoint.barcodes)
+        df_sequences = df_sequences.iloc[checkpoint.num_processed :]
     if n_processes == 1:
         log.info("running on single core")
-        return designer.design(df_sequences, sd)
-    # multicore runs
-    log.info(f"running on {n_processes} cores with mutliprocessing")
-    with multiprocessing.Pool(n_processes) as pool:
-        sds = sd.split(n_processes)
-        results = pool.starmap(
-            _design,
-            [
-                (df_s, sds[i], design_opts)
-                for i, df_s in enumerate(np.array_split(df_sequences, n_processes))
-            ],
-        )
-        dfs = []
-        failures = {}
-        for r in results:
-            dfs.append(r.df_results)
-            for key, value in r.failures.items():
-                if key in failures:
-                    failures[key] += value
-                else:
-                    failures[key] = value
-        return DesignerResults(pd.concat(dfs), failures)
-
-
-def design_and_save_output(df, output_dir, params):
+    else:
+        log.info(f"running on {n_processes} cores with mutliprocessing")
+    # a single core run designs everything at once unless it checkpoints
+    if n_processes == 1 and checkpoint is None:
+        batches = [df_sequences]
+    else:
+        if batch_size is None:
+            batch_size = get_batch_size(len(df_sequences), n_processes)
+        log.info(f"handing out batches of {batch_size} sequences")
+        batches = [
+            df_sequences.iloc[i : i + batch_size]
+            for i in range(0, len(df_sequences), batch_size)
+        ]
+    results = iter_design(n_processes, batches, sd, design_opts)
+    if checkpoint is None:
+        return combine_designer_results(results)
+    return checkpoint_design(results, sd, checkpoint)
+
+
+def checkpoint_design(results, sd, checkpoint) -> DesignerResults:
+    """
+    writes the rows of each designed batch to the checkpoint as they come in and
+    saves its state every checkpoint interval
+    :param results: DesignerResults of each batch in order
+    :param sd: the sequence structure designer the batches are designed with
+    :param checkpoint: the checkpoint to save to
+    :return: everything designed, including what was resumed from the checkpoint
+    """
+    # only the rows of an earlier run are read back from the checkpoint, the
+    # rows designed now are kept as they are
+    dfs = []
+    df_resumed = checkpoint.read_rows()
+    if len(df_resumed) > 0:
+        dfs.append(df_resumed)
+    for r in results:
+        checkpoint.append_rows(r.df_results)
+        checkpoint.update(r)
+        dfs.append(r.df_results)
+        if checkpoint.is_due():
+            checkpoint.save(
+                sd.get_used_state(), [checkpoint.rows_path], sd.get_barcodes()
+            )
+    checkpoint.save(sd.get_used_state(), [checkpoint.rows_path], sd.get_barcodes())
+    if len(dfs) == 0:
+        dfs.append(pd.DataFrame(columns=RESULT_COLUMNS))
+    df_results = pd.concat(dfs)
+    return DesignerResults(
+        df_results,
+        checkpoint.failures,
+        checkpoint.fold_stats,
+        checkpoint.num_processed,
+    )
+
+
+def get_checkpoint(output_dir, design_opts, resume=False):
+    """
+    sets up the checkpoint of a run, None if checkpoints are turned off
+    :param output_dir: directory the run writes to
+    :param design_opts: design options
+    :param resume: load the checkpoint left by an earlier run
+    """
+    if design_opts.checkpoint_interval <= 0:
+        if resume:
+            raise ValueError(
+                "cannot resume when checkpoint_interval is 0, checkpoints are only "
+                "saved when it is set in design_opts"
+            )
+        return None
+    checkpoint = DesignCheckpoint(output_dir, design_opts.checkpoint_interval)
+    if not resume:
+        # left over from an earlier run in the same directory
+        checkpoint.remove()
+    elif checkpoint.load():
+        log.info(f"loaded checkpoint from {checkpoint.state_path}")
+    else:
+        log.warning(f"no checkpoint in {output_dir}, starting from the beginning")
+    return checkpoint
+
+
+def design_and_save_output(df, output_dir, params, resume=False):
     os.makedirs(output_dir, exist_ok=True)
     design_opts = DesignOpts(**params["design_opts"])
+    # checked before designing so a bad selection fails straight away
+    outputs = get_outputs(params["postprocess"].get("outputs"))
     yaml.dump(params, open(f"{output_dir}/params.yml", "w"))
     log.info(f"Using parameters:\n{json.dumps(params, indent=4)}")
+    checkpoint = get_checkpoint(output_dir, design_opts, resume)
     results = design(
         params["num_of_processes"],
         df,
         params["build_str"],
         params["segments"],
         design_opts,
+        checkpoint=checkpoint,
     )
     log_failed_design_sequences(results)
+    log_fold_cache_stats(results.fold_stats)
     df_results = results.df_results
-    write_output_dir(df_results, Path(output_dir))
+    write_output_dir(df_results, Path(output_dir), outputs)
+    if checkpoint is not None:
+        checkpoint.remove()
     if not params["postprocess"]["skip_edit_distance"]:
-        edit_dist = calc_edit_distance(df_results)
-        log.info(f"the edit distance of lib is: {edit_dist}")
+        edit_dist = calc_library_edit_distance(df_results, params["num_of_processes"])
+        log_edit_distance_results(df_results, edit_dist)
     else:
         log.info("skipping edit distance calculation")
     return df_results
 
 
-def log_failed_design_sequences(results) -> None:
+def count_csv_rows(csv) -> int:
+    """
+    counts the sequences in a csv without loading it all into memory
+    """
+    num_rows = 0
+    for chunk in pd.read_csv(csv, usecols=["sequence"], chunksize=STREAM_CHUNK_SIZE):
+        num_rows += len(chunk)
+    return num_rows
+
+
+def iter_csv_batches(csv, params, batch_size, skip=0):
+    """
+    reads a csv in chunks and yields batches of sequences ready to design,
+    applying the same preprocessing as the cli does to a full dataframe
+    :param skip: number of sequences at the start of the csv to skip
+    """
+    trim_p5 = params["preprocess"]["trim_p5"]
+    trim_p3 = params["preprocess"]["trim_p3"]
+    num_read = skip
+    chunks = pd.read_csv(
+        csv, chunksize=STREAM_CHUNK_SIZE, skiprows=lambda i: 0 < i <= skip
+    )
+    for chunk in chunks:
+        if trim_p5 != 0 or trim_p3 != 0:
+            chunk = trim(chunk, trim_p5, trim_p3)
+        if "name" not in chunk.columns:
+            chunk["name"] = [f"seq_{num_read + i}" for i in range(len(chunk))]
+        num_read += len(chunk)
+        for i in range(0, len(chunk), batch_size):
+            yield chunk.iloc[i : i + batch_size]
+
+
+def design_stream_and_save_output(
+    csv, output_dir, params, resume=False
+) -> DesignerResults:
+    """
+    same as design_and_save_output but reads the csv in chunks and appends the
+    results of each batch to the output files as soon as it is designed, so
+    memory stays flat no matter how large the library is. The edit distance
+    needs the whole library and is skipped
+    :param csv: path to the csv of sequences to design
+    :param output_dir: directory to write results to
+    :param params: params
+    :param resume: carry on from the checkpoint left by an earlier run
+    :return: the failures and fold stats of the run, df_results is empty
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    design_opts = DesignOpts(**params["design_opts"])
+    outputs = get_outputs(params["postprocess"].get("outputs"))
+    yaml.dump(params, open(f"{output_dir}/params.yml", "w"))
+    log.info(f"Using parameters:\n{json.dumps(params, indent=4)}")
+    log.info("starting design in stream mode")
+    num_seqs = count_csv_rows(csv)
+    log.info(f"csv has {num_seqs} sequences")
+    sd = get_seq_struct_designer(num_seqs, params["build_str"], params["segments"])
+    sd.set_min_barcode_edit_distance(design_opts.min_barcode_edit_distance)
+    n_processes = params["num_of_processes"]
+    if n_processes == 1:
+        batch_size = STREAM_CHUNK_SIZE
+    else:
+        batch_size = get_batch_size(num_seqs, n_processes)
+    checkpoint = get_checkpoint(output_dir, design_opts, resume)
+    skip = 0
+    failures = {}
+    fold_stats = {}
+    if checkpoint is not None and checkpoint.num_processed > 0:
+        log.info(
+            f"resuming from checkpoint, {checkpoint.num_processed} sequences "
+            "already processed"
+        )
+        sd.restore_used_state(checkpoint.used, checkpoint.barcodes)
+        skip = checkpoint.num_processed
+        add_counts(failures, checkpoint.failures)
+        add_counts(fold_stats, checkpoint.fold_stats)
+        writer = StreamOutputWriter(output_dir, True, checkpoint.num_rows, outputs)
+    else:
+        writer = StreamOutputWriter(output_dir, outputs=outputs)
+    batches = iter_csv_batches(csv, params, batch_size, skip)
+    try:
+        for r in iter_design(n_processes, batches, sd, design_opts):
+            writer.write(r.df_results)
+            add_counts(failures, r.failures)
+            add_counts(fold_stats, r.fold_stats)
+            if checkpoint is None:
+                continue
+            checkpoint.update(r)
+            if checkpoint.is_due():
+                writer.flush()
+                checkpoint.save(sd.get_used_state(), writer.paths(), sd.get_barcodes())
+    finally:
+        writer.close()
+    if checkpoint is not None:
+        checkpoint.remove()
+    results = DesignerResults(pd.DataFrame(), failures, fold_stats)
+    log_failed_design_sequences(results, writer.num_rows)
+    log_fold_cache_stats(fold_stats)
+    if not params["postprocess"]["skip_edit_distance"]:
+        log.info(
+            "edit distance is not computed in stream mode, run rld edit-distance "
+            f"on {output_dir}/results-rna.csv"
+        )
+    return results
+
+
+def log_failed_design_sequences(results, num_remaining=None) -> None:
     """
     add failed sequences to log
+    :param results: the results of the design run
+    :param num_remaining: number of designed sequences, defaults to the length of
+    results.df_results
     """
-    df_results = results.df_results
+    if num_remaining is None:
+        num_remaining = len(results.df_results)
     failures = results.failures
     table = []
     total = 0
@@ -530,39 +1128,6 @@ def log_failed_design_sequences(results) -> None:
             + tabulate(table, headers=["key", "value"], tablefmt="psql")
         )
         log.info(f"total sequences discarded: {total}")
-        log.info(f"total remaining sequences: {len(df_results)}")
+        log.info(f"total remaining sequences: {num_remaining}")
     else:
         log.info("no sequences discarded")
-
-
-def write_output_dir(df: pd.DataFrame, output_dir) -> None:
-    """
-    writes out of the results of a design run to a directory
-    :param df: dataframe of results
-    """
-    if not Path(output_dir).exists():
-        raise ValueError(f"output path {output_dir} does not exist")
-    log.info(
-        f"{output_dir}/results-all.csv contains all information generated from run"
-    )
-    df.to_csv(f"{output_dir}/results-all.csv", index=False)
-    log.info(
-        f"{output_dir}/results-rna.csv contains only information related to the RNA sequence"
-    )
-    df = df[["name", "sequence", "structure", "ens_defect", "mfe"]]
-    df.to_csv(f"{output_dir}/results-rna.csv", index=False)
-    df_sub = df[["name", "sequence"]].copy()
-    # get primer for sequencing
-    p5_seq = get_seq_fwd_primer(df_sub)
-    if p5_seq is None:
-        log.warning("no p5 sequence found")
-    else:
-        log.info("p5 seq -> " + str(p5_seq))
-    df_sub = to_dna(df_sub)
-    to_fasta(df_sub, f"{output_dir}/results.fasta")
-    df_sub = to_dna_template(df_sub)
-    df_sub.to_csv(f"{output_dir}/results-dna.csv", index=False)
-    df_sub = df_sub.rename(columns={"name": "Pool name", "sequence": "Sequence"})
-    df_sub["Pool name"] = Path(output_dir).stem
-    df_sub.to_excel(f"{output_dir}/results-opool.xlsx", index=False)
-    df_sub.to_csv(f"{output_dir}/results-opool.csv", index=False)
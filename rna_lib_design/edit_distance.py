@@ -0,0 +1,298 @@
+import multiprocessing
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from rna_lib_design.logger import get_logger
+
+log = get_logger("EDIT_DISTANCE")
+
+# shortest piece worth indexing, shorter pieces are found in too many sequences
+# by chance to prune anything
+MIN_SEED_LENGTH = 10
+# libraries with at most this many pairs are always compared pair by pair
+MAX_DIRECT_PAIRS = 200000
+
+
+@dataclass(frozen=True)
+class EditDistanceResults:
+    """
+    The minimum edit distance between any two sequences of a library and every
+    pair of sequences at that distance, as positions in the library. If exact is
+    False no pair was found within the distance searched and min_edit_distance
+    is a lower bound.
+    """
+
+    min_edit_distance: int
+    pairs: List[Tuple[int, int]]
+    exact: bool = True
+
+
+def calc_min_edit_distance(
+    sequences: List[str], n_processes: int = 1, exact: bool = False
+) -> EditDistanceResults:
+    """
+    Finds the minimum edit distance of a library without comparing every pair.
+    Identical sequences are caught first. Otherwise the prefix and suffix every
+    sequence shares are removed, which does not change any edit distance, and
+    neighbours in sorted order give an upper bound k. The pairs within k of each
+    other are then found with a seed index: cut into k + 1 pieces, any sequence
+    within k edits of another has a piece that is found unchanged in the other,
+    at most k positions away. Only those pairs are compared.
+    :param sequences: the sequences of the library
+    :param n_processes: number of processes to compare sequences on
+    :param exact: when k is too large for pieces to be selective, compare every
+    pair instead of only searching as far as the pieces allow. Sequences too
+    short to be cut into pieces at all are always compared pair by pair
+    :return: the minimum and the pairs at it
+    """
+    if len(sequences) < 2:
+        return EditDistanceResults(0, [])
+    positions = defaultdict(list)
+    for i, seq in enumerate(sequences):
+        positions[seq].append(i)
+    duplicates = []
+    for seq_positions in positions.values():
+        duplicates.extend(combinations(seq_positions, 2))
+    if len(duplicates) > 0:
+        return EditDistanceResults(0, sorted(duplicates))
+    # sequences are all unique now, so each has a single position
+    unique_positions = [p[0] for p in positions.values()]
+    unique = strip_common_ends(list(positions.keys()))
+    max_k = max(len(s) for s in unique)
+    num_pairs = len(unique) * (len(unique) - 1) // 2
+    if not exact and num_pairs > MAX_DIRECT_PAIRS:
+        max_seed_k = get_max_seed_distance(unique)
+        if max_seed_k >= 1:
+            max_k = max_seed_k
+        else:
+            # too short to seed, a bound of 1 says nothing so compare every pair
+            log.debug("sequences too short to seed, comparing every pair")
+    k = get_upper_bound(unique, max_k)
+    distances = find_pairs_within(unique, k, n_processes)
+    if len(distances) == 0:
+        return EditDistanceResults(k + 1, [], False)
+    min_dist = min(distances.values())
+    pairs = [
+        (unique_positions[i], unique_positions[j])
+        for (i, j), d in distances.items()
+        if d == min_dist
+    ]
+    return EditDistanceResults(min_dist, sorted(pairs))
+
+
+def calc_library_edit_distance(
+    df: pd.DataFrame, n_processes: int = 1, exact: bool = False
+) -> EditDistanceResults:
+    """
+    calc_min_edit_distance of the sequence column of a dataframe
+    """
+    return calc_min_edit_distance(list(df["sequence"]), n_processes, exact)
+
+
+def log_edit_distance_results(
+    df: pd.DataFrame, results: EditDistanceResults, max_pairs: int = 10
+) -> None:
+    """
+    logs the minimum edit distance of a library and the pairs of sequences at it
+    """
+    if not results.exact:
+        log.info(
+            "the minimum edit distance of lib is at least: "
+            f"{results.min_edit_distance}, no closer pair of sequences exists"
+        )
+        return
+    log.info(
+        f"the minimum edit distance of lib is: {results.min_edit_distance} "
+        f"({len(results.pairs)} pairs of sequences)"
+    )
+    names = list(df["name"]) if "name" in df.columns else list(range(len(df)))
+    for i, j in results.pairs[:max_pairs]:
+        log.info(f"{names[i]} <-> {names[j]}")
+    if len(results.pairs) > max_pairs:
+        log.info(f"... and {len(results.pairs) - max_pairs} more pairs")
+
+
+def strip_common_ends(sequences: List[str]) -> List[str]:
+    """
+    removes the prefix and suffix shared by every sequence
+    """
+    prefix = len(os.path.commonprefix(sequences))
+    suffix = len(os.path.commonprefix([s[::-1] for s in sequences]))
+    # the prefix and suffix can overlap in the shortest sequence
+    suffix = min(suffix, min(len(s) for s in sequences) - prefix)
+    return [s[prefix : len(s) - suffix] for s in sequences]
+
+
+def get_upper_bound(sequences: List[str], max_k: int) -> int:
+    """
+    the smallest edit distance between neighbours when sorted forwards and when
+    sorted by their reverse, close sequences often end up next to each other.
+    Never more than max_k, the largest distance that will be searched
+    """
+    best = max_k
+    for key in [lambda i: sequences[i], lambda i: sequences[i][::-1]]:
+        order = sorted(range(len(sequences)), key=key)
+        for i, j in zip(order, order[1:]):
+            # only a distance below the current best is of any use
+            d = calc_edit_distance_within(sequences[i], sequences[j], best - 1)
+            best = min(best, d)
+    return best
+
+
+def calc_edit_distance_within(seq_1: str, seq_2: str, k: int) -> int:
+    """
+    the edit distance of two sequences if it is at most k, otherwise k + 1. Only
+    cells within k of the diagonal can be at most k, so only those are filled,
+    and it stops as soon as every cell of a row is over k
+    """
+    if len(seq_1) < len(seq_2):
+        seq_1, seq_2 = seq_2, seq_1
+    n, m = len(seq_1), len(seq_2)
+    over = k + 1
+    if n - m > k:
+        return over
+    if m == 0:
+        return n
+    prev = [j if j <= k else over for j in range(m + 1)]
+    for i in range(1, n + 1):
+        lo = max(1, i - k)
+        hi = min(m, i + k)
+        cur = [over] * (m + 1)
+        if i <= k:
+            cur[0] = i
+        c = seq_1[i - 1]
+        for j in range(lo, hi + 1):
+            d = prev[j - 1] + (c != seq_2[j - 1])
+            if prev[j] + 1 < d:
+                d = prev[j] + 1
+            if cur[j - 1] + 1 < d:
+                d = cur[j - 1] + 1
+            cur[j] = d if d < over else over
+        if min(cur[lo - 1 : hi + 1]) > k:
+            return over
+        prev = cur
+    return prev[m]
+
+
+def get_max_seed_distance(sequences: List[str]) -> int:
+    """
+    the largest distance that can be searched with pieces of MIN_SEED_LENGTH
+    """
+    return min(len(s) for s in sequences) // MIN_SEED_LENGTH - 1
+
+
+def find_pairs_within(
+    sequences: List[str], k: int, n_processes: int = 1
+) -> Dict[Tuple[int, int], int]:
+    """
+    finds every pair of sequences within k edits of each other
+    :return: the edit distance of each pair keyed on (i, j) with i < j
+    """
+    piece_length = min(len(s) for s in sequences) // (k + 1)
+    index = None
+    if piece_length >= MIN_SEED_LENGTH:
+        index = build_seed_index(sequences, k, piece_length)
+    else:
+        log.debug(f"pieces too short to seed for k={k}, comparing every pair")
+    by_length = defaultdict(list)
+    for i, seq in enumerate(sequences):
+        by_length[len(seq)].append(i)
+    chunks = split_into_chunks(len(sequences), n_processes)
+    args = (sequences, by_length, index, k, piece_length)
+    if n_processes == 1:
+        _init_worker(*args)
+        results = [_find_pairs_in_chunk(c) for c in chunks]
+    else:
+        with multiprocessing.Pool(n_processes, _init_worker, args) as pool:
+            results = pool.map(_find_pairs_in_chunk, chunks)
+    distances = {}
+    for r in results:
+        distances.update(r)
+    return distances
+
+
+def build_seed_index(
+    sequences: List[str], k: int, piece_length: int
+) -> Dict[Tuple[int, str], List[int]]:
+    """
+    indexes the first k + 1 pieces of piece_length of every sequence on the
+    number of the piece and the piece itself. k edits can change at most k of
+    the pieces, so one is always left as it was
+    """
+    index = defaultdict(list)
+    for i, seq in enumerate(sequences):
+        for p in range(k + 1):
+            start = p * piece_length
+            index[(p, seq[start : start + piece_length])].append(i)
+    return index
+
+
+def split_into_chunks(n, n_processes):
+    # many more chunks than processes so a slow chunk does not hold up the rest
+    num_chunks = max(1, min(n, n_processes * 16))
+    return [range(c, n, num_chunks) for c in range(num_chunks)]
+
+
+# state of each worker, set by _init_worker
+_worker = {}
+
+
+def _init_worker(sequences, by_length, index, k, piece_length):
+    _worker["sequences"] = sequences
+    _worker["by_length"] = by_length
+    _worker["index"] = index
+    _worker["k"] = k
+    _worker["piece_length"] = piece_length
+
+
+def _find_pairs_in_chunk(chunk):
+    sequences = _worker["sequences"]
+    index = _worker["index"]
+    k = _worker["k"]
+    distances = {}
+    for i in chunk:
+        seq = sequences[i]
+        if index is None:
+            candidates = get_length_candidates(seq, _worker["by_length"], k)
+        else:
+            candidates = get_seed_candidates(seq, index, k, _worker["piece_length"])
+        for j in candidates:
+            # each pair is compared once, from its lower id
+            if j <= i or abs(len(seq) - len(sequences[j])) > k:
+                continue
+            d = calc_edit_distance_within(seq, sequences[j], k)
+            if d <= k:
+                distances[(i, j)] = d
+    return distances
+
+
+def get_length_candidates(seq, by_length, k):
+    """
+    every sequence whose length is within k of seq
+    """
+    candidates = []
+    for length in range(len(seq) - k, len(seq) + k + 1):
+        candidates.extend(by_length.get(length, []))
+    return candidates
+
+
+def get_seed_candidates(seq, index, k, piece_length):
+    """
+    the sequences with a piece found in seq no more than k positions from where
+    the piece is in them
+    """
+    candidates = set()
+    for p in range(k + 1):
+        start = p * piece_length
+        for s in range(max(0, start - k), start + k + 1):
+            if s + piece_length > len(seq):
+                break
+            ids = index.get((p, seq[s : s + piece_length]))
+            if ids is not None:
+                candidates.update(ids)
+    return candidates
@@ -0,0 +1,528 @@
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+from vienna import fold
+from vienna.vienna import FoldResults
+
+from rna_lib_design.logger import get_logger
+
+try:
+    # the ViennaRNA python bindings, only needed for mfe only folds in process
+    import RNA
+except ImportError:
+    RNA = None
+
+log = get_logger("FOLDING")
+
+
+# fold backends #######################################################################
+
+
+class FoldBackend:
+    """
+    Folds sequences. Results from backends with the same cache_name are
+    interchangeable and share entries in an on-disk FoldCache.
+    """
+
+    cache_name = ""
+    # backends that fold a batch faster on their own than spread over an executor
+    folds_batches = False
+    # backends with an mfe only fold that is cheaper than a full fold
+    folds_mfe = False
+
+    def fold(self, seq: str) -> FoldResults:
+        raise NotImplementedError
+
+    def fold_batch(self, seqs: List[str]) -> List[FoldResults]:
+        return [self.fold(seq) for seq in seqs]
+
+    def fold_mfe(self, seq: str) -> FoldResults:
+        """
+        Folds a sequence for its mfe structure and energy only, without the
+        partition function. The ens_defect of the result is None unless the
+        backend has no mfe only fold, then this is the same as fold.
+        """
+        return self.fold(seq)
+
+    def fold_mfe_batch(self, seqs: List[str]) -> List[FoldResults]:
+        return [self.fold_mfe(seq) for seq in seqs]
+
+    def close(self) -> None:
+        pass
+
+
+class ViennaFoldBackend(FoldBackend):
+    """
+    Folds in process with vienna.fold. mfe only folds use the ViennaRNA python
+    bindings with the same options when they are installed.
+    """
+
+    cache_name = "vienna"
+    folds_mfe = RNA is not None
+
+    def fold(self, seq: str) -> FoldResults:
+        return fold(seq)
+
+    def fold_mfe(self, seq: str) -> FoldResults:
+        if RNA is None:
+            return self.fold(seq)
+        md = RNA.md()
+        md.noLP = 1
+        md.dangles = 2
+        structure, mfe = RNA.fold_compound(seq, md).mfe()
+        return FoldResults(structure, round(mfe, 2), None, [])
+
+
+class RNAfoldWorkerBackend(FoldBackend):
+    """
+    Keeps one RNAfold process running for the life of the backend and streams
+    sequences to it, so there is no start up cost per sequence. Uses the same
+    options as vienna.fold (-p --noLP -d2) so results are interchangeable. mfe
+    only folds are streamed to a second RNAfold process run without -p.
+    """
+
+    cache_name = "vienna"
+    folds_batches = True
+    folds_mfe = True
+
+    def __init__(self, exe: str = "RNAfold"):
+        self.exe = exe
+        self._proc = None
+        self._mfe_proc = None
+        self._tmp_dir = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # each process starts its own RNAfold
+        state = self.__dict__.copy()
+        state["_proc"] = None
+        state["_mfe_proc"] = None
+        state["_tmp_dir"] = None
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def fold(self, seq: str) -> FoldResults:
+        return self.fold_batch([seq])[0]
+
+    def fold_batch(self, seqs: List[str]) -> List[FoldResults]:
+        if len(seqs) == 0:
+            return []
+        with self._lock:
+            if self._proc is None:
+                self._proc = self.__start_process("-p", "--noLP", "-d2", "--noPS")
+            return self.__stream(self._proc, seqs, self.__read_result)
+
+    def fold_mfe(self, seq: str) -> FoldResults:
+        return self.fold_mfe_batch([seq])[0]
+
+    def fold_mfe_batch(self, seqs: List[str]) -> List[FoldResults]:
+        if len(seqs) == 0:
+            return []
+        with self._lock:
+            if self._mfe_proc is None:
+                self._mfe_proc = self.__start_process("--noLP", "-d2", "--noPS")
+            return self.__stream(self._mfe_proc, seqs, self.__read_mfe_result)
+
+    def close(self) -> None:
+        for proc in [self._proc, self._mfe_proc]:
+            if proc is not None:
+                proc.stdin.close()
+                proc.wait()
+        self._proc = None
+        self._mfe_proc = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def __start_process(self, *args):
+        if shutil.which(self.exe) is None:
+            raise ValueError(f"cannot find {self.exe} executable for RNAfold backend")
+        # -p writes dot plot files, keep them out of the working directory
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="rld_rnafold_")
+        return subprocess.Popen(
+            [self.exe, *args],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=self._tmp_dir,
+            text=True,
+            bufsize=1,
+        )
+
+    def __stream(self, proc, seqs, read_result):
+        # write from another thread so neither pipe can fill up and block
+        writer = threading.Thread(target=self.__write, args=(proc, seqs))
+        writer.start()
+        results = [read_result(proc) for _ in seqs]
+        writer.join()
+        return results
+
+    @staticmethod
+    def __write(proc, seqs):
+        for seq in seqs:
+            proc.stdin.write(seq + "\n")
+        proc.stdin.flush()
+
+    @staticmethod
+    def __read_result(proc):
+        # sequence, mfe structure, ensemble, centroid then a line with the
+        # frequency of the mfe structure and the ensemble diversity
+        lines = []
+        while True:
+            line = proc.stdout.readline()
+            if line == "":
+                raise ValueError("RNAfold exited unexpectedly")
+            lines.append(line)
+            if "ensemble diversity" in line:
+                break
+        m = re.match(r"^(\S+)\s+\(\s*(-?\d+\.\d+)\)", lines[1])
+        if m is None:
+            raise ValueError(f"cannot parse RNAfold output: {''.join(lines)}")
+        diversity = float(line.split("ensemble diversity")[1].split()[0])
+        return FoldResults(m.group(1), float(m.group(2)), diversity, [])
+
+    @staticmethod
+    def __read_mfe_result(proc):
+        # sequence then the mfe structure with its energy
+        lines = [proc.stdout.readline() for _ in range(2)]
+        if lines[1] == "":
+            raise ValueError("RNAfold exited unexpectedly")
+        m = re.match(r"^(\S+)\s+\(\s*(-?\d+\.\d+)\)", lines[1])
+        if m is None:
+            raise ValueError(f"cannot parse RNAfold output: {''.join(lines)}")
+        return FoldResults(m.group(1), float(m.group(2)), None, [])
+
+
+class FakeFoldBackend(FoldBackend):
+    """
+    Deterministic backend for tests and benchmarks, no folding is done. Returns
+    the results supplied for a sequence, otherwise a fully unpaired structure
+    with an mfe and ensemble defect of 0.
+    """
+
+    cache_name = "fake"
+    folds_mfe = True
+
+    def __init__(self, results: Optional[Dict[str, FoldResults]] = None):
+        self.results = results
+        if self.results is None:
+            self.results = {}
+        self.num_folds = 0
+        self.num_mfe_folds = 0
+
+    def fold(self, seq: str) -> FoldResults:
+        self.num_folds += 1
+        if seq in self.results:
+            return self.results[seq]
+        return FoldResults("." * len(seq), 0.0, 0.0, [])
+
+    def fold_mfe(self, seq: str) -> FoldResults:
+        self.num_mfe_folds += 1
+        if seq in self.results:
+            r = self.results[seq]
+            return FoldResults(r.dot_bracket, r.mfe, None, [])
+        return FoldResults("." * len(seq), 0.0, None, [])
+
+
+def get_fold_backend(name: str) -> FoldBackend:
+    """
+    creates a fold backend from its name, vienna, rnafold or fake
+    """
+    if name == "vienna":
+        return ViennaFoldBackend()
+    elif name == "rnafold":
+        return RNAfoldWorkerBackend()
+    elif name == "fake":
+        return FakeFoldBackend()
+    else:
+        raise ValueError(f"unknown fold backend: {name}")
+
+
+# fold cache ##########################################################################
+
+
+class FoldCache:
+    """
+    Caches the results of folding a sequence keyed on the full sequence. Results
+    are kept in an in-memory LRU bounded by max_size. If a path is supplied,
+    results are also stored in a sqlite database on disk which can be shared
+    between processes and between runs. Sequences not in the cache are folded
+    by the backend, vienna.fold by default. mfe only results are kept in a
+    second in-memory LRU, they are never written to disk.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100000,
+        path: Optional[str] = None,
+        backend: Optional[FoldBackend] = None,
+    ):
+        if backend is None:
+            backend = ViennaFoldBackend()
+        self.max_size = max_size
+        self.path = path
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.mfe_folds = 0
+        self._memory = OrderedDict()
+        self._mfe_memory = OrderedDict()
+        self._conn = None
+        self._pending = 0
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __getstate__(self):
+        # sqlite connections cannot be pickled, each process opens its own
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pending"] = 0
+        state["_memory"] = OrderedDict()
+        state["_mfe_memory"] = OrderedDict()
+        return state
+
+    def fold(self, seq: str) -> FoldResults:
+        """
+        Folds a sequence, returning the cached result if there is one.
+        :param seq: the sequence to fold
+        :return: the fold results of the sequence
+        """
+        r = self.get(seq)
+        if r is not None:
+            self.hits += 1
+            return r
+        self.misses += 1
+        r = self.backend.fold(seq)
+        self.put(seq, r)
+        return r
+
+    def fold_batch(
+        self, seqs: List[str], executor: Optional[Executor] = None
+    ) -> List[FoldResults]:
+        """
+        Folds a batch of sequences. Sequences not in the cache are folded
+        together, on the executor if one is given.
+        :param seqs: the sequences to fold
+        :param executor: the executor to fold the uncached sequences on
+        :return: the fold results in the same order as seqs
+        """
+        results = {}
+        to_fold = []
+        for seq in seqs:
+            if seq in results:
+                self.hits += 1
+                continue
+            r = self.get(seq)
+            if r is None:
+                self.misses += 1
+                to_fold.append(seq)
+                # placeholder so repeats within the batch count as hits
+                results[seq] = None
+                continue
+            self.hits += 1
+            results[seq] = r
+        if executor is None or len(to_fold) < 2 or self.backend.folds_batches:
+            folded = self.backend.fold_batch(to_fold)
+        else:
+            folded = executor.map(self.backend.fold, to_fold)
+        for seq, r in zip(to_fold, folded):
+            self.put(seq, r)
+            results[seq] = r
+        return [results[seq] for seq in seqs]
+
+    def fold_mfe_batch(
+        self, seqs: List[str], executor: Optional[Executor] = None
+    ) -> List[FoldResults]:
+        """
+        Folds a batch of sequences for their mfe structures only. A full result
+        already in the cache is used as is, so its ens_defect is set, otherwise
+        ens_defect is None.
+        :param seqs: the sequences to fold
+        :param executor: the executor to fold the uncached sequences on
+        :return: the fold results in the same order as seqs
+        """
+        results = {}
+        to_fold = []
+        for seq in seqs:
+            if seq in results:
+                continue
+            r = self.get(seq)
+            if r is None and seq in self._mfe_memory:
+                self._mfe_memory.move_to_end(seq)
+                r = self._mfe_memory[seq]
+            if r is None:
+                to_fold.append(seq)
+            results[seq] = r
+        if executor is None or len(to_fold) < 2 or self.backend.folds_batches:
+            folded = self.backend.fold_mfe_batch(to_fold)
+        else:
+            folded = executor.map(self.backend.fold_mfe, to_fold)
+        for seq, r in zip(to_fold, folded):
+            self.mfe_folds += 1
+            results[seq] = r
+            if self.max_size <= 0:
+                continue
+            self._mfe_memory[seq] = r
+            if len(self._mfe_memory) > self.max_size:
+                self._mfe_memory.popitem(last=False)
+        return [results[seq] for seq in seqs]
+
+    def get(self, seq: str) -> Optional[FoldResults]:
+        if seq in self._memory:
+            self._memory.move_to_end(seq)
+            return self._memory[seq]
+        if self.path is None:
+            return None
+        row = (
+            self.__get_connection()
+            .execute(
+                "SELECT dot_bracket, mfe, ens_defect FROM folds "
+                "WHERE sequence = ? AND backend = ?",
+                (seq, self.backend.cache_name),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        r = FoldResults(row[0], row[1], row[2], [])
+        self.__put_memory(seq, r)
+        return r
+
+    def put(self, seq: str, r: FoldResults) -> None:
+        self.__put_memory(seq, r)
+        if self.path is None:
+            return
+        self.__get_connection().execute(
+            "INSERT OR IGNORE INTO folds VALUES (?, ?, ?, ?, ?)",
+            (seq, self.backend.cache_name, r.dot_bracket, r.mfe, r.ens_defect),
+        )
+        self._pending += 1
+        if self._pending >= 100:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Commits any results not yet written to the on-disk store.
+        """
+        if self._conn is not None and self._pending > 0:
+            self._conn.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        """
+        Writes out pending results and closes the on-disk store and the backend.
+        """
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self.backend.close()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def stats(self) -> dict:
+        return {
+            "fold_cache_hits": self.hits,
+            "fold_cache_misses": self.misses,
+            "mfe_folds": self.mfe_folds,
+        }
+
+    def __put_memory(self, seq, r):
+        if self.max_size <= 0:
+            return
+        self._memory[seq] = r
+        self._memory.move_to_end(seq)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def __get_connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            # WAL allows readers from other processes while one process writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS folds (sequence TEXT, backend TEXT, "
+                "dot_bracket TEXT, mfe REAL, ens_defect REAL, "
+                "PRIMARY KEY (sequence, backend))"
+            )
+            self._conn.commit()
+        return self._conn
+
+
+def get_fold_executor(
+    name: str, n_workers: int = 0, batch_size: int = 1
+) -> Optional[Executor]:
+    """
+    creates the executor batches of sequences are folded on
+    :param name: serial, thread or process
+    :param n_workers: the number of workers, 0 uses one per sequence in a batch
+    up to the number of cpus
+    :param batch_size: the number of sequences folded together
+    """
+    if name == "serial":
+        return None
+    if n_workers <= 0:
+        n_workers = max(1, min(batch_size, os.cpu_count() or 1))
+    if name == "thread":
+        return ThreadPoolExecutor(n_workers)
+    elif name == "process":
+        return ProcessPoolExecutor(n_workers)
+    else:
+        raise ValueError(f"unknown fold executor: {name}")
+
+
+def log_fold_cache_stats(stats: dict) -> None:
+    """
+    logs the hit rate of the fold cache from a dictionary of counts
+    """
+    hits = stats.get("fold_cache_hits", 0)
+    total = hits + stats.get("fold_cache_misses", 0)
+    mfe_folds = stats.get("mfe_folds", 0)
+    if mfe_folds > 0:
+        log.info(f"mfe screen: {mfe_folds} mfe only folds")
+    if total == 0:
+        return
+    log.info(
+        f"fold cache: {hits} hits out of {total} folds "
+        f"({100.0 * hits / total:.1f}% hit rate)"
+    )
+
+
+def fold_dataframe(
+    df: pd.DataFrame, fold_cache: FoldCache, executor: Optional[Executor] = None
+) -> pd.DataFrame:
+    """
+    folds each sequence in the dataframe, adds the structure, mfe and ens_defect
+    columns. Same as seq_tools.fold but goes through the fold cache. Repeated
+    sequences are only folded once.
+    :param df: dataframe with a sequence column
+    :param fold_cache: the cache to use to fold
+    :param executor: the executor to fold the uncached sequences on
+    :return: a copy of the dataframe with the fold columns added
+    """
+    df = df.copy()
+    results = fold_cache.fold_batch(df["sequence"].tolist(), executor)
+    df["structure"] = [r.dot_bracket for r in results]
+    df["mfe"] = [r.mfe for r in results]
+    df["ens_defect"] = [r.ens_defect for r in results]
+    fold_cache.flush()
+    return df
@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from rna_lib_design.settings import get_resources_path
+
+
+@dataclass(frozen=True, order=True)
+class SequenceInfo:
+    name: str
+    sequence: str
+    code: str
+
+
+class NamedSeqRegistry:
+    """
+    Every named sequence in resources/named_seqs, the RNA sequences with their
+    structures and the DNA primers. The csvs are read once when the registry is
+    built, after that sequences are looked up by name or code in a dict. Use
+    get_named_seq_registry to get the shared registry.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = get_resources_path() / "named_seqs"
+        # each csv keyed on its type and file name e.g. rna/p5_sequences
+        self.tables: Dict[str, pd.DataFrame] = {}
+        for csv_path in sorted(Path(path).glob("*/*.csv")):
+            key = f"{csv_path.parent.name}/{csv_path.stem}"
+            self.tables[key] = pd.read_csv(csv_path)
+        self._rna = {}
+        self._dna = {}
+        self._codes = {}
+        for key, df in self.tables.items():
+            by_name = self._rna if key.startswith("rna/") else self._dna
+            for row in df.to_dict("records"):
+                by_name.setdefault(row["name"], row)
+                code = row.get("code")
+                if isinstance(code, str) and code != "NONE":
+                    self._codes.setdefault(code, row)
+        self._p5_sequences = [
+            SequenceInfo(row["name"], row["sequence"], row["code"])
+            for row in self.tables["rna/p5_sequences"].to_dict("records")
+        ]
+
+    def get_table(self, key: str) -> pd.DataFrame:
+        """
+        A copy of one of the csvs, e.g. rna/p5_sequences or dna/fwd_primers.
+        """
+        if key not in self.tables:
+            raise ValueError(f"no named sequences for {key}")
+        return self.tables[key].copy()
+
+    def get_rna_seq_structs(self) -> pd.DataFrame:
+        """
+        name, sequence and structure of every named RNA sequence.
+        """
+        dfs = [
+            df[["name", "sequence", "structure"]]
+            for key, df in self.tables.items()
+            if key.startswith("rna/")
+        ]
+        return pd.concat(dfs)
+
+    def get_rna(self, name: str) -> Optional[dict]:
+        """
+        The row of a named RNA sequence, None if there is none with that name.
+        """
+        return self._rna.get(name)
+
+    def get_dna(self, name: str) -> Optional[dict]:
+        """
+        The row of a named DNA primer, None if there is none with that name.
+        """
+        return self._dna.get(name)
+
+    def get_by_code(self, code: str) -> Optional[SequenceInfo]:
+        row = self._codes.get(code)
+        if row is None:
+            return None
+        return SequenceInfo(row["name"], row["sequence"], row["code"])
+
+    def get_p5_sequences(self) -> List[SequenceInfo]:
+        """
+        The named p5 sequences in the order they are listed.
+        """
+        return list(self._p5_sequences)
+
+
+@lru_cache(maxsize=None)
+def get_named_seq_registry() -> NamedSeqRegistry:
+    """
+    The registry of the named sequences shipped with rna_lib_design, built the
+    first time it is needed.
+    """
+    return NamedSeqRegistry()
@@ -0,0 +1,235 @@
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+from seq_tools import to_dna, to_dna_template
+
+from rna_lib_design.logger import get_logger
+from rna_lib_design.util import assign_fwd_primers, log_fwd_primers
+
+log = get_logger("OUTPUT")
+
+# each output that can be selected and the file it is written to
+OUTPUT_FILES = {
+    "all": "results-all.csv",
+    "rna": "results-rna.csv",
+    "fasta": "results.fasta",
+    "dna": "results-dna.csv",
+    "opool": "results-opool.csv",
+    "xlsx": "results-opool.xlsx",
+    "parquet": "results-all.parquet",
+}
+# written when no outputs are selected, parquet needs pyarrow
+DEFAULT_OUTPUTS = ["all", "rna", "fasta", "dna", "opool", "xlsx"]
+# outputs that are only complete once the writer is closed, so cannot be added
+# to when a run is resumed
+CLOSED_OUTPUTS = ["xlsx", "parquet"]
+RNA_COLUMNS = ["name", "sequence", "structure", "ens_defect", "mfe"]
+OUTPUT_DESCRIPTIONS = {
+    "all": "contains all information generated from run",
+    "rna": "contains only information related to the RNA sequence",
+    "fasta": "contains the DNA sequences",
+    "dna": "contains the DNA templates with the T7 promoter",
+    "opool": "contains the DNA templates to order as an oligo pool",
+    "xlsx": "contains the DNA templates to order as an oligo pool",
+    "parquet": "contains all information generated from run",
+}
+
+
+def get_outputs(outputs=None) -> List[str]:
+    """
+    checks a selection of outputs and puts it in a fixed order
+    :param outputs: list of output names or a comma separated string of them
+    e.g. rna,fasta, defaults to DEFAULT_OUTPUTS
+    :return: the selected outputs that can be written
+    """
+    if outputs is None:
+        outputs = DEFAULT_OUTPUTS
+    if isinstance(outputs, str):
+        outputs = [o.strip() for o in outputs.split(",") if o.strip() != ""]
+    for name in outputs:
+        if name not in OUTPUT_FILES:
+            raise ValueError(
+                f"unknown output: {name}, choose from {', '.join(OUTPUT_FILES)}"
+            )
+    if "parquet" in outputs and importlib.util.find_spec("pyarrow") is None:
+        raise ValueError("the parquet output needs pyarrow to be installed")
+    if "xlsx" in outputs and importlib.util.find_spec("openpyxl") is None:
+        log.warning(f"openpyxl is not installed, {OUTPUT_FILES['xlsx']} is skipped")
+        outputs = [o for o in outputs if o != "xlsx"]
+    return [o for o in OUTPUT_FILES if o in outputs]
+
+
+def write_output_dir(df: pd.DataFrame, output_dir, outputs=None) -> None:
+    """
+    writes out of the results of a design run to a directory
+    :param df: dataframe of results
+    :param outputs: the outputs to write, see get_outputs
+    """
+    writer = StreamOutputWriter(output_dir, outputs=outputs)
+    try:
+        writer.write(df)
+    finally:
+        writer.close()
+
+
+class StreamOutputWriter(object):
+    """
+    appends the results of a design run to an output directory one batch at a
+    time. The DNA sequences of each batch are made once and shared by every
+    output, each output is written on its own thread. The xlsx and parquet
+    files are streamed too but are only complete once the writer is closed.
+    With append the files of an earlier, resumed, run are added to instead of
+    being replaced, the xlsx and parquet files cannot be added to and are skipped
+    """
+
+    def __init__(self, output_dir, append=False, num_rows=0, outputs=None):
+        self.output_dir = Path(output_dir)
+        if not self.output_dir.exists():
+            raise ValueError(f"output path {output_dir} does not exist")
+        self.outputs = get_outputs(outputs)
+        if append:
+            skipped = [o for o in self.outputs if o in CLOSED_OUTPUTS]
+            for name in skipped:
+                log.warning(f"{OUTPUT_FILES[name]} cannot be resumed and is skipped")
+            self.outputs = [o for o in self.outputs if o not in skipped]
+        self.pool_name = self.output_dir.stem
+        self.num_rows = num_rows
+        self.p5_counts = None
+        self._started = append
+        self._fasta = None
+        if "fasta" in self.outputs:
+            self._fasta = open(self.__path("fasta"), "a" if append else "w")
+        self._workbook = None
+        self._sheet = None
+        self._parquet = None
+        # an empty batch seen before the parquet file is opened
+        self._parquet_empty = None
+        self._executor = ThreadPoolExecutor(max(1, len(self.outputs)))
+
+    def write(self, df: pd.DataFrame) -> None:
+        """
+        appends a batch of results, the first batch also writes the headers
+        :param df: dataframe of results
+        """
+        header = not self._started
+        if not self._started:
+            self.__log_files()
+            self._started = True
+        df_rna = df[RNA_COLUMNS]
+        df_sub = df_rna[["name", "sequence"]]
+        # only the p5 counts of each batch are kept, not the p5 of each sequence
+        p5_counts = assign_fwd_primers(df_sub).get_counts()
+        if self.p5_counts is None:
+            self.p5_counts = p5_counts
+        else:
+            self.p5_counts = self.p5_counts.combine(p5_counts)
+        df_dna = to_dna(df_sub)
+        df_template = to_dna_template(df_dna)
+        df_opool = pd.DataFrame(
+            {
+                "Pool name": [self.pool_name] * len(df_template),
+                "Sequence": df_template["sequence"].to_numpy(),
+            }
+        )
+        jobs = [
+            ("all", self.__write_csv, df),
+            ("rna", self.__write_csv, df_rna),
+            ("fasta", self.__write_fasta, df_dna),
+            ("dna", self.__write_csv, df_template),
+            ("opool", self.__write_csv, df_opool),
+            ("xlsx", self.__write_xlsx, df_opool),
+            ("parquet", self.__write_parquet, df),
+        ]
+        futures = [
+            self._executor.submit(func, name, df_out, header)
+            for name, func, df_out in jobs
+            if name in self.outputs
+        ]
+        for future in futures:
+            future.result()
+        self.num_rows += len(df)
+
+    def paths(self) -> List[Path]:
+        """
+        the files written so far that can be added to when resuming
+        """
+        paths = [
+            self.__path(name) for name in self.outputs if name not in CLOSED_OUTPUTS
+        ]
+        return [p for p in paths if p.exists()]
+
+    def flush(self) -> None:
+        if self._fasta is not None:
+            self._fasta.flush()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        if self._fasta is not None:
+            self._fasta.close()
+            self._fasta = None
+        if self._workbook is not None:
+            self._workbook.save(self.__path("xlsx"))
+            self._workbook = None
+        if self._parquet is None and self._parquet_empty is not None:
+            # every batch was empty, the file still has the columns
+            self.__open_parquet(self._parquet_empty)
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+        if self.p5_counts is None:
+            log.warning("no p5 sequence found")
+        else:
+            log_fwd_primers(self.p5_counts)
+
+    def __path(self, name) -> Path:
+        return self.output_dir / OUTPUT_FILES[name]
+
+    def __write_csv(self, name, df, header):
+        mode = "w" if header else "a"
+        df.to_csv(self.__path(name), mode=mode, header=header, index=False)
+
+    def __write_fasta(self, name, df, header):
+        self._fasta.write(
+            "".join(f">{n}\n{s}\n" for n, s in zip(df["name"], df["sequence"]))
+        )
+
+    def __write_xlsx(self, name, df, header):
+        # a write only workbook streams rows out instead of keeping every cell
+        if self._workbook is None:
+            from openpyxl import Workbook
+
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet("Sheet1")
+            self._sheet.append(list(df.columns))
+        for row in df.itertuples(index=False):
+            self._sheet.append(list(row))
+
+    def __write_parquet(self, name, df, header):
+        import pyarrow as pa
+
+        if self._parquet is None:
+            # the columns of an empty batch can have no type to infer, e.g. every
+            # design of it failed, so the schema is taken from the first batch
+            # with rows
+            if len(df) == 0:
+                self._parquet_empty = df
+                return
+            self.__open_parquet(df)
+        table = pa.Table.from_pandas(
+            df, schema=self._parquet.schema, preserve_index=False
+        )
+        self._parquet.write_table(table)
+
+    def __open_parquet(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        self._parquet = pq.ParquetWriter(self.__path("parquet"), schema)
+
+    def __log_files(self):
+        for name in self.outputs:
+            log.info(f"{self.__path(name)} {OUTPUT_DESCRIPTIONS[name]}")
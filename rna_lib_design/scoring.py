@@ -0,0 +1,93 @@
+from typing import List
+
+import numpy as np
+
+# characters of a designable structure that are not part of a barcode
+_DESIGNED_SS_CHARS = np.frombuffer(b"().", dtype=np.uint8)
+
+
+def to_byte_array(s: str) -> np.ndarray:
+    """
+    converts a dot bracket (or any ascii string) into a uint8 array
+    """
+    return np.frombuffer(s.encode("ascii"), dtype=np.uint8)
+
+
+class StructureScorer:
+    """
+    Scores the folded structures of design attempts against the structure each
+    attempt was designed to have. Built once per designable sequence structure
+    so the barcode mask, the positions that are still symbols in the designable
+    structure, is only computed once. A batch of attempts is scored in one
+    vectorized pass.
+
+    Each attempt is scored as "SUCCESS", "ss_mismatches" if more positions than
+    allowed_ss_mismatch differ or "ss_mismatch_barcodes" if more barcode
+    positions than allowed_ss_mismatch_barcodes differ.
+    """
+
+    def __init__(
+        self,
+        design_structure: str,
+        allowed_ss_mismatch: int,
+        allowed_ss_mismatch_barcodes: int,
+    ):
+        self.length = len(design_structure)
+        self.allowed_ss_mismatch = allowed_ss_mismatch
+        self.allowed_ss_mismatch_barcodes = allowed_ss_mismatch_barcodes
+        self.barcode_mask = ~np.isin(
+            to_byte_array(design_structure), _DESIGNED_SS_CHARS
+        )
+
+    def score(self, structure: str, dot_bracket: str) -> str:
+        """
+        scores a single attempt
+        :param structure: the structure the attempt was designed to have
+        :param dot_bracket: the structure the attempt folds into
+        """
+        return self.score_batch([structure], [dot_bracket])[0]
+
+    def score_batch(self, structures: List[str], dot_brackets: List[str]) -> List[str]:
+        """
+        scores a batch of attempts
+        :param structures: the structures the attempts were designed to have
+        :param dot_brackets: the structures the attempts fold into
+        :return: the outcome of each attempt
+        """
+        outcomes = ["SUCCESS"] * len(structures)
+        rows = []
+        for i, (structure, dot_bracket) in enumerate(zip(structures, dot_brackets)):
+            if structure == dot_bracket:
+                continue
+            if len(structure) == len(dot_bracket) == self.length:
+                rows.append(i)
+            else:
+                outcomes[i] = self.__score_unaligned(structure, dot_bracket)
+        if len(rows) == 0:
+            return outcomes
+        shape = (len(rows), self.length)
+        targets = to_byte_array("".join(structures[i] for i in rows)).reshape(shape)
+        folded = to_byte_array("".join(dot_brackets[i] for i in rows)).reshape(shape)
+        mismatches = targets != folded
+        totals = mismatches.sum(axis=1)
+        barcodes = (mismatches & self.barcode_mask).sum(axis=1)
+        for i, total, barcode in zip(rows, totals, barcodes):
+            outcomes[i] = self.__get_outcome(total, barcode)
+        return outcomes
+
+    def __score_unaligned(self, structure, dot_bracket):
+        # only possible when barcodes of different lengths are mixed, compare
+        # up to the shortest of the three like zip would
+        length = min(len(structure), len(dot_bracket), self.length)
+        mismatches = to_byte_array(structure[:length]) != to_byte_array(
+            dot_bracket[:length]
+        )
+        barcode = (mismatches & self.barcode_mask[:length]).sum()
+        return self.__get_outcome(mismatches.sum(), barcode)
+
+    def __get_outcome(self, total, barcode):
+        if total > self.allowed_ss_mismatch:
+            return "ss_mismatches"
+        if barcode > self.allowed_ss_mismatch_barcodes:
+            return "ss_mismatch_barcodes"
+        return "SUCCESS"
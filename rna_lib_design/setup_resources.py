@@ -1,78 +1,224 @@
 import click
+import hashlib
+import json
 import os
 import itertools
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import vienna
-from rna_lib_design.util import (
-    max_gc_stretch,
-    max_stretch,
-    hamming,
-    random_helix,
+from rna_lib_design import structure_set
+from rna_lib_design.barcode_pool import (
+    MAX_CANDIDATES,
+    generate_helix_barcodes,
+    generate_sstrand_barcodes,
 )
-from rna_lib_design import structure_set, params
+from rna_lib_design.folding import get_fold_backend
 from rna_lib_design.logger import get_logger, setup_applevel_logger
 
 log = get_logger(__name__)
 
+# the hairpin loop that caps a helix barcode when it is folded
+HELIX_CAP = "CUCUUCGGAG"
+HELIX_CAP_SS = "(((....)))"
+# sets with fewer barcodes are left out of the index
+MIN_SET_SIZE = 10
+# bump when the generator changes so sets made by the old one are made again
+SWEEP_VERSION = 1
 
-def generate_helix_barcodes(length, min_distance, gus, max_num=100000):
-    barcodes = []
-    count = 0
-    while True:
-        count += 1
-        if count > 1000:
-            break
-        seq_1, seq_2 = random_helix(length, gu=gus)
-        barcode = seq_1 + "&" + seq_2
-        if barcode in barcodes:
-            continue
-        if max_stretch(seq_1) > 3 or max_stretch(seq_2) > 3:
-            continue
-        if max_gc_stretch(seq_1, seq_2) > 3:
-            continue
-        fail = 0
-        for b in barcodes:
-            dist = hamming(b, barcode)
-            if dist < min_distance:
-                fail = 1
-                break
-        if fail:
-            continue
-        if len(barcodes) % 1000 == 0 and len(barcodes) != 0:
-            log.info(f"{len(barcodes)} barcodes found so far")
-        barcodes.append(barcode)
-        count = 0
-        if len(barcodes) > max_num:
-            log.warn(f"reached max num of barcodes: {max_num}")
-            break
-
-    return barcodes
-
-
-def write_barcodes_to_file(fname, barcodes):
-    f = open(fname, "w")
-    f.write("seq_1,seq_2,ss_1,ss_2,dg\n")
-    for b in barcodes:
-        spl = b.split("&")
-        seq = spl[0] + "CUCUUCGGAG" + spl[1]
-        r = vienna.fold(seq)
-        spl2 = str(r.dot_bracket).split("(((....)))")
-        if len(spl2) != 2:
+
+def write_barcodes_to_file(fname, barcodes, fold_backend="vienna") -> int:
+    """
+    Folds each helix barcode capped by a hairpin loop and writes those that
+    form the helix, with the structure each strand folds into. The barcodes
+    are folded in one batch and the file is replaced in one step so it is
+    never seen half written.
+    :param fname: the csv to write
+    :param barcodes: the barcodes as seq_1&seq_2
+    :param fold_backend: name of the backend to fold with
+    :return: the number of barcodes written
+    """
+    strands = [b.split("&") for b in barcodes]
+    backend = get_fold_backend(fold_backend)
+    try:
+        results = backend.fold_batch([s1 + HELIX_CAP + s2 for s1, s2 in strands])
+    finally:
+        backend.close()
+    rows = []
+    for (seq_1, seq_2), r in zip(strands, results):
+        spl = str(r.dot_bracket).split(HELIX_CAP_SS)
+        if len(spl) != 2:
             continue
-        f.write(
-            spl[0]
-            + ","
-            + spl[1]
-            + ","
-            + spl2[0]
-            + ","
-            + spl2[1]
-            + ","
-            + str(r.mfe)
-            + "\n"
-        )
-    f.close()
+        rows.append([seq_1 + "&" + seq_2, spl[0] + "&" + spl[1], r.mfe])
+    df = pd.DataFrame(rows, columns=["sequence", "structure", "dg"])
+    write_csv_atomic(df, fname)
+    return len(df)
+
+
+def write_csv_atomic(df: pd.DataFrame, fname) -> None:
+    dirname = os.path.dirname(os.path.abspath(fname))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            df.to_csv(f, index=False)
+        os.replace(tmp_path, fname)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_sweep_points(length_min, length_max) -> List[Tuple[int, int, int]]:
+    """
+    Every helix length, min distance and number of GU pairs a sweep makes a
+    set for.
+    """
+    points = []
+    for length in range(length_min, length_max + 1):
+        for md in range(length - 2, length * 2, 1):
+            for gu in range(0, int(length / 2), 1):
+                points.append((length, md, gu))
+    return points
+
+
+def get_sweep_key(length, md, gu, max_num, max_candidates) -> str:
+    """
+    Hash of everything the set made for a sweep point depends on. It ends the
+    path of the set, so a set already made with the same parameters is found
+    there and sets made with different ones never are.
+    """
+    params = {
+        "length": length,
+        "min_dist": md,
+        "gu": gu,
+        "max_num": max_num,
+        "max_candidates": max_candidates,
+        "version": SWEEP_VERSION,
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:10]
+
+
+def get_sweep_path(length, md, gu, key) -> str:
+    """
+    Path of the set made for a sweep point, relative to the sweep directory.
+    """
+    return f"helices/len_{length}/md_{md}_gu_{gu}_{key}.csv"
+
+
+def _run_sweep_point(args) -> Tuple[int, int, int, int, str]:
+    output_dir, length, md, gu, max_num, max_candidates, fold_backend = args
+    key = get_sweep_key(length, md, gu, max_num, max_candidates)
+    path = get_sweep_path(length, md, gu, key)
+    full_path = os.path.join(output_dir, path)
+    if os.path.isfile(full_path):
+        log.info(f"hlen={length}\tmin_dist={md}\tgu={gu}\talready made")
+        return length, md, gu, len(pd.read_csv(full_path)), path
+    # seeded from the key so the set made for a point is always the same
+    np.random.seed(int(key, 16) % 2**32)
+    barcodes = generate_helix_barcodes(length, md, gu, max_num, max_candidates)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    if len(barcodes) < MIN_SET_SIZE:
+        # written empty so the point is not tried again
+        barcodes = []
+    size = write_barcodes_to_file(full_path, barcodes, fold_backend)
+    log.info(f"hlen={length}\tmin_dist={md}\tgu={gu}\t{size} barcodes found!")
+    return length, md, gu, size, path
+
+
+def run_hcodesweep(
+    length_min,
+    length_max,
+    output_dir=".",
+    num_processes=1,
+    max_num=100000,
+    max_candidates=MAX_CANDIDATES,
+    fold_backend="vienna",
+) -> pd.DataFrame:
+    """
+    Makes a helix barcode set for every sweep point and writes the index of
+    them to helices.csv. Points are run on a process pool, a point whose set
+    was already made with the same parameters is not made again. The index is
+    replaced in one step once every point is done.
+    :param output_dir: directory the sets and helices.csv are written to
+    :param num_processes: number of points to run at once
+    :return: the index
+    """
+    points = get_sweep_points(length_min, length_max)
+    args = [
+        (output_dir, length, md, gu, max_num, max_candidates, fold_backend)
+        # longest helices first as they take the longest
+        for length, md, gu in sorted(points, key=lambda p: -p[0])
+    ]
+    if num_processes > 1:
+        with ProcessPoolExecutor(num_processes) as executor:
+            rows = list(executor.map(_run_sweep_point, args))
+    else:
+        rows = [_run_sweep_point(a) for a in args]
+    df = pd.DataFrame(rows, columns="length diff gu size path".split())
+    df = df[df["size"] >= MIN_SET_SIZE]
+    df = df.sort_values(["length", "diff", "gu"]).reset_index(drop=True)
+    write_csv_atomic(df, os.path.join(output_dir, "helices.csv"))
+    return df
+
+
+def _fold_unpaired(args) -> List[bool]:
+    fold_backend, seqs = args
+    backend = get_fold_backend(fold_backend)
+    try:
+        results = backend.fold_batch(seqs)
+    finally:
+        backend.close()
+    return [r.dot_bracket == "." * len(seq) for seq, r in zip(seqs, results)]
+
+
+def screen_unpaired(
+    seqs: List[str], fold_backend="vienna", executor: Optional[Executor] = None
+) -> np.ndarray:
+    """
+    Folds each sequence on its own and checks it stays unpaired, so it has no
+    structure of its own when used as a single strand barcode. The sequences
+    are folded in chunks on the executor if one is given.
+    :return: True for each sequence that folds fully unpaired
+    """
+    if executor is None:
+        return np.array(_fold_unpaired((fold_backend, seqs)), dtype=bool)
+    num_chunks = 4 * (os.cpu_count() or 1)
+    chunk_size = max(1, -(-len(seqs) // num_chunks))
+    chunks = [
+        (fold_backend, seqs[i : i + chunk_size])
+        for i in range(0, len(seqs), chunk_size)
+    ]
+    unpaired = []
+    for chunk in executor.map(_fold_unpaired, chunks):
+        unpaired.extend(chunk)
+    return np.array(unpaired, dtype=bool)
+
+
+def register_sstrand_set(output_dir, length, min_dist, barcodes) -> str:
+    """
+    Writes a single strand barcode set and adds it to the sstrand.csv index of
+    output_dir, replacing the set with the same length and distance if there
+    is one. Both files are replaced in one step.
+    :return: path of the set relative to output_dir
+    """
+    path = f"sstrand/sstrand_len_{length}_dist_{min_dist}.csv"
+    os.makedirs(os.path.join(output_dir, "sstrand"), exist_ok=True)
+    df = pd.DataFrame({"sequence": barcodes, "structure": "." * length})
+    write_csv_atomic(df, os.path.join(output_dir, path))
+    index_path = os.path.join(output_dir, "sstrand.csv")
+    df_index = pd.DataFrame(
+        [[length, min_dist, len(df), path]], columns="length diff size path".split()
+    )
+    if os.path.isfile(index_path):
+        df_old = pd.read_csv(index_path)
+        df_index = pd.concat([df_old[df_old["path"] != path], df_index])
+    df_index = df_index.sort_values(["length", "diff"]).reset_index(drop=True)
+    write_csv_atomic(df_index, index_path)
+    return path
 
 
 @click.group()
@@ -86,43 +232,77 @@ def cli():
 @click.option("-gu", "--gus", default=0, type=int)
 @click.option("-o", "--output", default="helices.csv")
 @click.option("-mn", "--max-num", default=100000)
-def hcodes(length, min_dist, gus, output, max_num):
-    barcodes = generate_helix_barcodes(length, min_dist, gus, max_num)
+@click.option("-mc", "--max-candidates", default=MAX_CANDIDATES)
+@click.option("-fb", "--fold-backend", default="vienna")
+def hcodes(length, min_dist, gus, output, max_num, max_candidates, fold_backend):
+    barcodes = generate_helix_barcodes(length, min_dist, gus, max_num, max_candidates)
     log.info(f"{len(barcodes)} barcodes found!")
-    write_barcodes_to_file(output, barcodes)
+    write_barcodes_to_file(output, barcodes, fold_backend)
 
 
 @cli.command()
 @click.option("-lmin", "--length-min", type=int, required=True)
 @click.option("-lmax", "--length-max", type=int, required=True)
-def hcodesweep(length_min, length_max):
-    os.makedirs("helices", exist_ok=True)
-    df = pd.DataFrame(columns="length diff gu size path".split())
-    df_pos = 0
-    for pos in range(length_min, length_max + 1):
-        for md in range(pos - 2, pos * 2, 1):
-            for gu in range(0, int(pos / 2), 1):
-                for i in range(0, 1):
-                    barcodes = generate_helix_barcodes(pos, md, gu)
-                    if len(barcodes) < 10:
-                        continue
-                    log.info(
-                        f"hlen={pos}\tmin_dist={md}\tgu={gu}\t{len(barcodes)} barcodes found!"
-                    )
-                    if not os.path.isdir(f"helices/len_{pos}"):
-                        os.mkdir(f"helices/len_{pos}")
-                    write_barcodes_to_file(
-                        f"helices/len_{pos}/md_{md}_gu_{gu}_{i}.csv", barcodes
-                    )
-                    df.loc[df_pos] = [
-                        pos,
-                        md,
-                        gu,
-                        len(barcodes),
-                        f"helices/len_{pos}/md_{md}_gu_{gu}_{i}.csv",
-                    ]
-                    df_pos += 1
-    df.to_csv("helices.csv", index=False)
+@click.option("-o", "--output-dir", default=".")
+@click.option("-p", "--num-processes", default=1)
+@click.option("-mn", "--max-num", default=100000)
+@click.option("-mc", "--max-candidates", default=MAX_CANDIDATES)
+@click.option("-fb", "--fold-backend", default="vienna")
+def hcodesweep(
+    length_min,
+    length_max,
+    output_dir,
+    num_processes,
+    max_num,
+    max_candidates,
+    fold_backend,
+):
+    df = run_hcodesweep(
+        length_min,
+        length_max,
+        output_dir,
+        num_processes,
+        max_num,
+        max_candidates,
+        fold_backend,
+    )
+    log.info(f"{len(df)} helix barcode sets in the index")
+
+
+@cli.command()
+@click.option("-l", "--length", type=int, required=True)
+@click.option("-md", "--min-dist", type=int, required=True)
+@click.option("-o", "--output-dir", default=".")
+@click.option("-p", "--num-processes", default=1)
+@click.option("-mn", "--max-num", default=100000)
+@click.option("-mc", "--max-candidates", default=MAX_CANDIDATES)
+@click.option("-fb", "--fold-backend", default="vienna")
+def sstrand(
+    length,
+    min_dist,
+    output_dir,
+    num_processes,
+    max_num,
+    max_candidates,
+    fold_backend,
+):
+    """
+    generates a single strand barcode set that folds unpaired and registers it
+    in the sstrand.csv of the output directory
+    """
+    executor = None
+    if num_processes > 1:
+        executor = ProcessPoolExecutor(num_processes)
+    try:
+        screen = partial(screen_unpaired, fold_backend=fold_backend, executor=executor)
+        barcodes = generate_sstrand_barcodes(
+            length, min_dist, max_num, max_candidates, screen
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    path = register_sstrand_set(output_dir, length, min_dist, barcodes)
+    log.info(f"{len(barcodes)} barcodes found! written to {path}")
 
 
 def __check_folds(sx_struct, sy_struct, h_set, hp_set, n=100, just_list=False):
@@ -1,5 +1,7 @@
 from typing import List, Dict
 import re
+import multiprocessing
+from multiprocessing import shared_memory
 import pandas as pd
 import numpy as np
 from numpy import random
@@ -7,7 +9,9 @@ from dataclasses import dataclass
 
 from seq_tools import SequenceStructure
 
+from rna_lib_design.barcode_store import load_table
 from rna_lib_design.logger import get_logger
+from rna_lib_design.named_seqs import get_named_seq_registry
 from rna_lib_design.settings import get_resources_path
 
 log = get_logger("SSET")
@@ -60,19 +64,110 @@ def str_to_range(x):
     )
 
 
+class PackedSeqStructs:
+    """
+    SequenceStructures kept as two arrays of fixed-width byte strings, usually
+    memory mapped from a compiled barcode store. A SequenceStructure is only
+    built the first time its member is accessed, so loading a set takes the same
+    time no matter how many members it has.
+    """
+
+    def __init__(self, sequences: np.ndarray, structures: np.ndarray):
+        self.sequences = sequences
+        self.structures = structures
+        self._built = {}
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PackedSeqStructs(self.sequences[index], self.structures[index])
+        seq_struct = self._built.get(index)
+        if seq_struct is None:
+            seq_struct = SequenceStructure(
+                self.sequences[index].decode(), self.structures[index].decode()
+            )
+            self._built[index] = seq_struct
+        return seq_struct
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        if isinstance(other, PackedSeqStructs):
+            return PackedSeqStructs(
+                np.concatenate([self.sequences, other.sequences]),
+                np.concatenate([self.structures, other.structures]),
+            )
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def max_sequence_length(self) -> int:
+        """
+        The width of the packed sequences, no member is longer.
+        """
+        return self.sequences.dtype.itemsize
+
+    def index(self, seq_struct) -> int:
+        matches = np.flatnonzero(
+            (self.sequences == seq_struct.sequence.encode())
+            & (self.structures == seq_struct.structure.encode())
+        )
+        if len(matches) == 0:
+            raise ValueError(f"{seq_struct} is not in the set")
+        return int(matches[0])
+
+
 class SequenceStructureSet:
     """
     A set of SequenceStructures that can be used to build up
     new sequences.
+
+    Unused members are kept in a free list (an array of indices plus the
+    position of each index in it) so drawing, claiming and releasing a member
+    are all constant time no matter how much of the set is used.
+
+    After calling share() the used flags live in shared memory and are claimed
+    under a lock, so many processes can draw from the same set without ever
+    using the same SequenceStructure twice.
     """
 
     def __init__(self, seqstructs: List[SequenceStructure]):
+        # seqstructs can also be a PackedSeqStructs
         if len(seqstructs) == 0:
             raise ValueError("seqstructs must have at least one SequenceStructure")
         self.seqstructs = seqstructs
         self.used = [False] * len(seqstructs)
         self.allow_duplicates = False
         self.last = None
+        self._free = []
+        self._free_pos = []
+        self._num_used = None
+        self._shm = None
+        self._shm_owner = False
+        self._lock = None
+        self.__rebuild_free()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shm is not None:
+            # the flags are reattached from shared memory, not copied
+            state["used"] = None
+            state["_num_used"] = None
+            state["_shm_owner"] = False
+            state["_free"] = []
+            state["_free_pos"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._shm is not None:
+            self.used = self.__get_shared_used()
+            self.__rebuild_free()
 
     @classmethod
     def from_csv(cls, csv_path: str):
@@ -80,10 +175,21 @@ class SequenceStructureSet:
         Creates a SequenceStructureSet from a csv file.
         """
         df = pd.read_csv(csv_path)
-        seqstructs = []
-        for _, row in df.iterrows():
-            seqstructs.append(SequenceStructure(row["sequence"], row["structure"]))
-        return cls(seqstructs)
+        return cls(
+            PackedSeqStructs(
+                np.array(df["sequence"].tolist(), dtype=np.bytes_),
+                np.array(df["structure"].tolist(), dtype=np.bytes_),
+            )
+        )
+
+    @classmethod
+    def from_store(cls, csv_path: str):
+        """
+        Creates a SequenceStructureSet from the compiled store of a csv file,
+        see barcode_store. Used for the barcode resources.
+        """
+        table = load_table(csv_path)
+        return cls(PackedSeqStructs(table["sequence"], table["structure"]))
 
     @classmethod
     def from_single(cls, seqstruct: SequenceStructure):
@@ -99,32 +205,140 @@ class SequenceStructureSet:
 
     def __add__(self, other):
         seq_struct_set = SequenceStructureSet(self.seqstructs + other.seqstructs)
-        seq_struct_set.used = self.used + other.used
+        seq_struct_set.used = list(self.used) + list(other.used)
+        seq_struct_set.__rebuild_free()
         return seq_struct_set
 
     def get_random(self) -> SequenceStructure:
-        if all(self.used):
-            raise Exception("All SequenceStructures have been used.")
-        if len(self.seqstructs) == 1:
-            return self.seqstructs[0]
-        count = 0
-        while True:
-            index = random.randint(0, len(self.seqstructs) - 1)
-            if not self.used[index]:
-                self.last = index
-                return self.seqstructs[index]
-            count += 1
-            if count > 10000:
-                raise ValueError("cannot find a random sequence structure")
+        while len(self._free) > 0:
+            index = self._free[random.randint(0, len(self._free))]
+            # when shared another process may have claimed it since
+            if self.used[index]:
+                self.__remove_free(index)
+                continue
+            self.last = index
+            return self.seqstructs[index]
+        raise Exception("All SequenceStructures have been used.")
 
     def set_used(self, sec_struct) -> None:
+        """
+        Marks a SequenceStructure as used. Has to search the set for it, use
+        claim() when the index is known.
+        """
         index = self.seqstructs.index(sec_struct)
-        if not self.allow_duplicates:
-            self.used[index] = True
+        self.claim(index)
 
     def set_last_used(self) -> None:
         if self.last is not None:
-            self.used[self.last] = True
+            self.claim(self.last)
+
+    def claim(self, index: int) -> bool:
+        """
+        Marks a SequenceStructure as used. Returns False if it was already used,
+        when shared this check and the update are atomic across processes.
+        """
+        if self.allow_duplicates:
+            return True
+        if self._lock is None:
+            if self.used[index]:
+                return False
+            self.used[index] = True
+            self.__remove_free(index)
+            return True
+        with self._lock:
+            if self.used[index]:
+                return False
+            self.used[index] = True
+            self._num_used[0] += 1
+        self.__remove_free(index)
+        return True
+
+    def release(self, index: int) -> None:
+        """
+        Marks a SequenceStructure as available again.
+        """
+        if self.allow_duplicates:
+            return
+        if self._lock is None:
+            if self.used[index]:
+                self.used[index] = False
+                self.__add_free(index)
+            return
+        with self._lock:
+            if not self.used[index]:
+                return
+            self.used[index] = False
+            self._num_used[0] -= 1
+        self.__add_free(index)
+
+    def is_shared(self) -> bool:
+        return self._shm is not None
+
+    def share(self) -> None:
+        """
+        Moves the used flags into shared memory. The set must reach other
+        processes when they are started, i.e. as Pool initargs, as the lock
+        cannot be pickled otherwise.
+        """
+        if self._shm is not None or self.allow_duplicates:
+            return
+        # an int64 count of used members followed by one flag per member
+        self._shm = shared_memory.SharedMemory(create=True, size=8 + len(self))
+        self._shm_owner = True
+        self._lock = multiprocessing.Lock()
+        used = self.__get_shared_used()
+        used[:] = self.used
+        self._num_used[0] = len(self) - len(self._free)
+        self.used = used
+
+    def unshare(self) -> None:
+        """
+        Copies the used flags back into this process and frees the shared memory.
+        """
+        if self._shm is None:
+            return
+        self.used = [bool(u) for u in self.used]
+        self._num_used = None
+        self._shm.close()
+        if self._shm_owner:
+            self._shm.unlink()
+        self._shm = None
+        self._shm_owner = False
+        self._lock = None
+        # other processes may have claimed members while shared
+        self.__rebuild_free()
+
+    def __get_shared_used(self):
+        self._num_used = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        return np.ndarray((len(self),), dtype=np.bool_, buffer=self._shm.buf, offset=8)
+
+    def __rebuild_free(self):
+        if not any(self.used):
+            # nothing used, every index is free at its own position
+            self._free = list(range(len(self.used)))
+            self._free_pos = list(range(len(self.used)))
+            return
+        self._free = [i for i, u in enumerate(self.used) if not u]
+        self._free_pos = [-1] * len(self.used)
+        for pos, index in enumerate(self._free):
+            self._free_pos[index] = pos
+
+    def __remove_free(self, index):
+        # swap with the last free index so removal is constant time
+        pos = self._free_pos[index]
+        if pos == -1:
+            return
+        last = self._free.pop()
+        if last != index:
+            self._free[pos] = last
+            self._free_pos[last] = pos
+        self._free_pos[index] = -1
+
+    def __add_free(self, index):
+        if self._free_pos[index] != -1:
+            return
+        self._free_pos[index] = len(self._free)
+        self._free.append(index)
 
     def split(self, num_sets: int):
         """
@@ -144,16 +358,35 @@ class SequenceStructureSet:
             raise ValueError(
                 "num_sets must be less than or equal to the number of sets"
             )
+        if not isinstance(self.seqstructs, list):
+            self.seqstructs = list(self.seqstructs)
         random.shuffle(self.seqstructs)
         seq_struct_splits = split_into_n(self.seqstructs, num_sets)
         return [SequenceStructureSet(s) for s in seq_struct_splits]
 
     def num_used(self):
-        return sum(self.used)
+        if self._shm is not None:
+            return int(self._num_used[0])
+        return len(self) - len(self._free)
 
     def num_available(self):
         return len(self) - self.num_used()
 
+    def max_sequence_length(self) -> int:
+        """
+        The length of the longest sequence of a member, or an upper bound on it
+        when the members are packed.
+        """
+        if isinstance(self.seqstructs, PackedSeqStructs):
+            return self.seqstructs.max_sequence_length()
+        return max(len(s.sequence) for s in self.seqstructs)
+
+    def used_indices(self) -> List[int]:
+        """
+        The indices of every used SequenceStructure, works while shared too.
+        """
+        return np.flatnonzero(np.asarray(self.used, dtype=bool)).tolist()
+
 
 class SequenceStructureSetParser:
     def __init__(self):
@@ -293,31 +526,32 @@ class SequenceStructureSetParser:
 
 
 def get_optimal_set(path, length, min_count, **kwargs) -> str:
-    df = pd.read_csv(path)
-    df = df[df["length"] == length]
-    if len(df) == 0:
+    table = load_table(path)
+    mask = table["length"] == length
+    if not mask.any():
         raise ValueError(f"no available with length {length} in {path}")
-    df = df[df["size"] > min_count]
-    df = df.sort_values(["diff"], ascending=False)
+    mask &= table["size"] > min_count
     if "gu" in kwargs and not kwargs["gu"]:
-        df = df[df["gu"] == 0]
-    if len(df) == 0:
+        mask &= table["gu"] == 0
+    rows = np.flatnonzero(mask)
+    if len(rows) == 0:
         raise ValueError(
             f"no set available with length {length} with max_count {min_count}"
         )
-    return df.iloc[0]["path"]
+    # the set with the largest distance, the first listed on ties
+    return table["path"][rows[np.argmax(table["diff"][rows])]].decode()
 
 
 def get_optimal_helix_set(length, min_count, gu=True):
     fname = get_resources_path() / "barcodes/helices.csv"
     csv_path = get_optimal_set(fname, length, min_count, gu=gu)
-    return SequenceStructureSet.from_csv(get_resources_path() / "barcodes" / csv_path)
+    return SequenceStructureSet.from_store(get_resources_path() / "barcodes" / csv_path)
 
 
 def get_optimal_sstrand_set(length, min_count):
     fname = get_resources_path() / "barcodes/sstrand.csv"
     csv_path = get_optimal_set(fname, length, min_count)
-    return SequenceStructureSet.from_csv(get_resources_path() / "barcodes" / csv_path)
+    return SequenceStructureSet.from_store(get_resources_path() / "barcodes" / csv_path)
 
 
 def get_optimal_hairpin_set(
@@ -329,32 +563,29 @@ def get_optimal_hairpin_set(
         buffer_3p = SequenceStructure("", "")
     fname = get_resources_path() / "barcodes/helices.csv"
     csv_path = get_optimal_set(fname, length, min_count, gu=gu)
-    df = pd.read_csv(get_resources_path() / "barcodes" / csv_path)
-    seqstructs = []
-    for index, row in df.iterrows():
-        h_seq_struct = SequenceStructure(row["sequence"], row["structure"])
-        h_seq_structs = h_seq_struct.split_strands()
-        seqstructs.append(
-            buffer_5p + h_seq_structs[0] + seq_struct + h_seq_structs[1] + buffer_3p
-        )
-    return SequenceStructureSet(seqstructs)
+    table = load_table(get_resources_path() / "barcodes" / csv_path)
+    # the hairpin is built for every helix at once, the 5' strand then the loop
+    # then the 3' strand
+    parts = []
+    for name in ["sequence", "structure"]:
+        strands = np.char.partition(table[name], b"&")
+        joined = np.char.add(getattr(buffer_5p, name).encode(), strands[:, 0])
+        joined = np.char.add(joined, getattr(seq_struct, name).encode())
+        joined = np.char.add(joined, strands[:, 2])
+        joined = np.char.add(joined, getattr(buffer_3p, name).encode())
+        parts.append(joined)
+    return SequenceStructureSet(PackedSeqStructs(parts[0], parts[1]))
 
 
 # get seq_structs from dataframes #####################################################
 
 
 def get_named_seq_structs():
-    dir_path = get_resources_path() / "named_seqs/rna"
-    csv_files = list(dir_path.glob("*.csv"))
-    dfs = []
-    for fname in csv_files:
-        dfs.append(pd.read_csv(fname)[["name", "sequence", "structure"]])
-    return pd.concat(dfs)
+    return get_named_seq_registry().get_rna_seq_structs()
 
 
 def get_named_seq_struct(name):
-    df = get_named_seq_structs()
-    df = df[df["name"] == name]
-    if len(df) == 0:
+    row = get_named_seq_registry().get_rna(name)
+    if row is None:
         raise ValueError(f"no sequence structure with name {name}")
-    return SequenceStructure(df.iloc[0]["sequence"], df.iloc[0]["structure"])
+    return SequenceStructure(row["sequence"], row["structure"])
@@ -1,13 +1,12 @@
+import numpy as np
 import pandas as pd
 from dataclasses import dataclass
-from typing import List, Optional
-from pathlib import Path
-
-from seq_tools.sequence import to_dna
-from seq_tools.dataframe import has_5p_sequence, has_3p_sequence
+from functools import lru_cache
+from typing import Dict, List, Optional
+from tabulate import tabulate
 
 from rna_lib_design.logger import get_logger
-from rna_lib_design.settings import get_resources_path
+from rna_lib_design.named_seqs import SequenceInfo, get_named_seq_registry
 
 log = get_logger("UTIL")
 
@@ -17,11 +16,157 @@ BASEPAIRS_WC = ["AU", "UA", "GC", "CG"]
 BASEPAIRS_GU = ["GU", "UG"]
 
 
-@dataclass(frozen=True, order=True)
-class SequenceInfo:
-    name: str
-    sequence: str
-    code: str
+@dataclass(frozen=True)
+class PrimerAssignments:
+    """
+    The primer found at the 5' end of each sequence of a library.
+    """
+
+    primers: List[SequenceInfo]
+    # index in primers of the primer each sequence starts with, -1 if none, when
+    # a sequence starts with several primers the first listed is used
+    assignments: np.ndarray
+    # number of sequences each primer is found at the 5' end of
+    counts: np.ndarray
+
+    @property
+    def primer(self) -> Optional[SequenceInfo]:
+        """
+        The first primer every sequence starts with, None if there is none.
+        """
+        return self.get_counts().primer
+
+    @property
+    def is_mixed(self) -> bool:
+        """
+        True if sequences have primers but no primer is shared by all of them.
+        """
+        return self.get_counts().is_mixed
+
+    def get_counts(self) -> "PrimerCounts":
+        """
+        The counts of each primer without the primer of each sequence.
+        """
+        num_none = int((self.assignments < 0).sum())
+        return PrimerCounts(self.primers, self.counts, len(self.assignments), num_none)
+
+    def names(self) -> List[str]:
+        """
+        The name of the primer of each sequence, empty if it has none.
+        """
+        names = [p.name for p in self.primers] + [""]
+        # -1 picks the empty name at the end
+        return [names[i] for i in self.assignments]
+
+    def combine(self, other: "PrimerAssignments") -> "PrimerAssignments":
+        """
+        The assignments of two parts of the same library together.
+        """
+        return PrimerAssignments(
+            self.primers,
+            np.concatenate([self.assignments, other.assignments]),
+            self.counts + other.counts,
+        )
+
+
+@dataclass(frozen=True)
+class PrimerCounts:
+    """
+    The number of sequences of a library that start with each primer. Unlike
+    PrimerAssignments the size does not grow with the library, so the counts of
+    parts of a library can be added up as they are written.
+    """
+
+    primers: List[SequenceInfo]
+    # number of sequences each primer is found at the 5' end of
+    counts: np.ndarray
+    num_seqs: int
+    # number of sequences that start with none of the primers
+    num_none: int
+
+    @property
+    def primer(self) -> Optional[SequenceInfo]:
+        """
+        The first primer every sequence starts with, None if there is none.
+        """
+        if self.num_seqs == 0:
+            return None
+        shared = np.flatnonzero(self.counts == self.num_seqs)
+        if len(shared) == 0:
+            return None
+        return self.primers[shared[0]]
+
+    @property
+    def is_mixed(self) -> bool:
+        """
+        True if sequences have primers but no primer is shared by all of them.
+        """
+        return self.primer is None and self.num_none < self.num_seqs
+
+    def combine(self, other: "PrimerCounts") -> "PrimerCounts":
+        """
+        The counts of two parts of the same library together.
+        """
+        return PrimerCounts(
+            self.primers,
+            self.counts + other.counts,
+            self.num_seqs + other.num_seqs,
+            self.num_none + other.num_none,
+        )
+
+
+class PrimerMatcher:
+    """
+    Finds which of a list of primers each sequence starts with. Primers are
+    hashed on their DNA sequence and grouped by length, so every sequence is
+    classified with one dict lookup per distinct primer length.
+    """
+
+    def __init__(self, primers: List[SequenceInfo]):
+        self.primers = primers
+        self._by_length: Dict[int, Dict[str, int]] = {}
+        for i, primer in enumerate(primers):
+            prefixes = self._by_length.setdefault(len(primer.sequence), {})
+            # the first primer listed wins if two have the same sequence
+            prefixes.setdefault(to_dna_str(primer.sequence), i)
+
+    def assign(self, sequences) -> PrimerAssignments:
+        """
+        :param sequences: RNA or DNA sequences
+        """
+        seqs = pd.Series(sequences, dtype=object).str.upper().str.replace("U", "T")
+        num_primers = len(self.primers)
+        assignments = np.full(len(seqs), num_primers)
+        counts = np.zeros(num_primers, dtype=int)
+        for length, prefixes in self._by_length.items():
+            matches = seqs.str[:length].map(prefixes)
+            found = matches.notna().to_numpy()
+            indices = matches[found].to_numpy(dtype=int)
+            counts += np.bincount(indices, minlength=num_primers)
+            assignments[found] = np.minimum(assignments[found], indices)
+        assignments[assignments == num_primers] = -1
+        return PrimerAssignments(self.primers, assignments, counts)
+
+
+def to_dna_str(seq: str) -> str:
+    return seq.upper().replace("U", "T")
+
+
+@lru_cache(maxsize=None)
+def get_fwd_primer_matcher() -> PrimerMatcher:
+    """
+    Matcher over the named p5 sequences, built the first time it is needed.
+    """
+    return PrimerMatcher(get_named_seq_registry().get_p5_sequences())
+
+
+def assign_fwd_primers(df: pd.DataFrame) -> PrimerAssignments:
+    """
+    finds the p5 sequence each sequence of a library starts with
+    :param df: the dataframe with sequences
+    :return: the p5 sequence of every sequence
+    """
+    return get_fwd_primer_matcher().assign(df["sequence"])
 
 
 def get_seq_fwd_primer(df: pd.DataFrame) -> Optional[SequenceInfo]:
@@ -30,14 +175,30 @@ def get_seq_fwd_primer(df: pd.DataFrame) -> Optional[SequenceInfo]:
     :param df: the dataframe with sequences
     :return: the sequence forward primer information
     """
-    df = df.copy()
-    df = to_dna(df)
-    path = get_resources_path() / "named_seqs/rna/p5_sequences.csv"
-    df_p5 = pd.read_csv(path)
-    for _, row in df_p5.iterrows():
-        if has_5p_sequence(df, row["sequence"]):
-            return SequenceInfo(row["name"], row["sequence"], row["code"])
-    return None
+    return assign_fwd_primers(df).primer
+
+
+def log_fwd_primers(counts: PrimerCounts) -> None:
+    """
+    logs the p5 sequence of a library, warns if it has none or several
+    :param counts: the p5 counts of the library, see PrimerAssignments.get_counts
+    """
+    if counts.primer is not None:
+        log.info("p5 seq -> " + str(counts.primer))
+    elif counts.is_mixed:
+        table = [
+            [p.name, count]
+            for p, count in zip(counts.primers, counts.counts)
+            if count > 0
+        ]
+        if counts.num_none > 0:
+            table.append(["none", counts.num_none])
+        log.warning(
+            "sequences do not share a p5 sequence\n"
+            + tabulate(table, headers=["p5", "sequences"], tablefmt="psql")
+        )
+    else:
+        log.warning("no p5 sequence found")
 
 
 def hamming(a, b):
@@ -21,5 +21,6 @@ setup(
     ],
     include_package_data=True,
     install_requires=requirements,
+    extras_require={"parquet": ["pyarrow"]},
     entry_points={"console_scripts": ["rld = rna_lib_design.cli:cli"]},
 )
@@ -0,0 +1,77 @@
+import multiprocessing
+
+from rna_lib_design.barcode_index import BarcodeIndex
+
+
+def test_is_distinct():
+    index = BarcodeIndex(3)
+    assert index.add("GGAACCUUGGAA")
+    # 2 edits away
+    assert not index.is_distinct("GGAUCCUUGGAU")
+    assert not index.is_distinct("GAACCUUGGAAC")
+    assert index.is_distinct("GGUUCCAAGGAA")
+    assert not index.add("GGAUCCUUGGAU")
+    assert len(index) == 1
+    assert index.add("GGAUCCUUGGAU", force=True)
+    assert len(index) == 2
+
+
+def test_short_regions():
+    # regions shorter than min_distance are always too close
+    index = BarcodeIndex(5)
+    assert index.add("GGAA")
+    assert not index.is_distinct("CCUU")
+
+
+def test_off():
+    index = BarcodeIndex(0)
+    assert index.add("GGAA")
+    assert index.add("GGAA")
+    assert len(index) == 0
+
+
+_shared = {}
+
+
+def _init_shared(index):
+    _shared["index"] = index
+
+
+def _add_all(keys):
+    index = _shared["index"]
+    return [k for k in keys if index.add(k)]
+
+
+def test_shared_index():
+    index = BarcodeIndex(2)
+    index.add("AAAAAA")
+    index.share(16, 6)
+    # every worker tries the same keys, each pair of them is 1 edit apart
+    keys = ["AAAAAC", "CCCCCC", "CCCCCG", "GGGGGG", "GGGGGU"]
+    try:
+        with multiprocessing.Pool(4, _init_shared, (index,)) as pool:
+            added = pool.map(_add_all, [keys] * 4)
+    finally:
+        index.unshare()
+    all_added = sorted(k for a in added for k in a)
+    # one key of each close pair is added, by whichever worker got there first
+    assert len(all_added) == 2
+    assert sorted(index.keys) == sorted(["AAAAAA"] + all_added)
+    assert not index.is_shared()
+
+
+def test_shared_index_mixed_lengths():
+    index = BarcodeIndex(2)
+    index.add("AAAAAA")
+    index.share(16, 7)
+    keys = ["AAAAAAC", "CCCCCC", "CCCCCCG", "GGGGGGU", "GGGGGG"]
+    try:
+        with multiprocessing.Pool(2, _init_shared, (index,)) as pool:
+            added = pool.map(_add_all, [keys] * 2)
+        assert not index.is_distinct("GGGGGGA")
+    finally:
+        index.unshare()
+    all_added = sorted(k for a in added for k in a)
+    assert len(all_added) == 2
+    # regions of both lengths are read back whole from the shared log
+    assert sorted(index.keys) == sorted(["AAAAAA"] + all_added)
@@ -0,0 +1,74 @@
+from itertools import combinations
+
+import numpy as np
+
+from rna_lib_design import barcode_pool
+from rna_lib_design.barcode_pool import (
+    decode,
+    encode,
+    generate_helix_barcodes,
+    generate_sstrand_barcodes,
+    get_hamming_distances,
+    get_helix_candidates,
+    get_sstrand_candidates,
+    select_distant,
+)
+from rna_lib_design.util import hamming
+
+
+def test_encode():
+    bases = np.array([[0, 1, 2, 3], [3, 3, 0, 0]])
+    codes = encode(bases)
+    assert decode(codes, 4) == ["ACGU", "UUAA"]
+    assert list(get_hamming_distances(codes[:1], codes)) == [0, 4]
+
+
+def test_select_distant(monkeypatch):
+    np.random.seed(0)
+    codes = encode(np.random.randint(0, 4, size=(2000, 8)))
+    codes = np.unique(codes)
+    expected = select_distant(codes, 8, 4)
+    # remove neighbours by comparing to every code left instead of by lookup
+    monkeypatch.setattr(barcode_pool, "MAX_BALL_SIZE", 0)
+    assert list(select_distant(codes, 8, 4)) == list(expected)
+    picked = codes[expected]
+    dists = get_hamming_distances(picked[:, None], picked[None, :])
+    assert (dists[~np.eye(len(picked), dtype=bool)] >= 4).all()
+    # every code left out is too close to one picked
+    dists = get_hamming_distances(codes[:, None], picked[None, :])
+    assert (dists.min(axis=1) < 4).all()
+    assert len(select_distant(codes, 8, 4, max_num=5)) == 5
+
+
+def test_generate_helix_barcodes():
+    np.random.seed(0)
+    barcodes = generate_helix_barcodes(5, 4, 1)
+    assert len(barcodes) > 10
+    for b_1, b_2 in combinations(barcodes, 2):
+        assert hamming(b_1, b_2) >= 4
+    seq_1, seq_2 = barcodes[0].split("&")
+    pairs = [seq_1[i] + seq_2[-i - 1] for i in range(5)]
+    assert all(p in barcode_pool.PAIRS for p in pairs)
+    assert sum(p in ["GU", "UG"] for p in pairs) <= 1
+    # every helix left out is too close to a barcode
+    codes = get_helix_candidates(5, 1)
+    seqs = {b.replace("&", "") for b in barcodes}
+    for seq in decode(codes, 10):
+        assert min(hamming(seq, b) for b in seqs) < 4
+
+
+def test_generate_sstrand_barcodes():
+    np.random.seed(0)
+
+    def screen(seqs):
+        return np.array([not seq.startswith("A") for seq in seqs])
+
+    barcodes = generate_sstrand_barcodes(6, 3, screen=screen)
+    assert len(barcodes) > 10
+    assert not any(b.startswith("A") for b in barcodes)
+    for b_1, b_2 in combinations(barcodes, 2):
+        assert hamming(b_1, b_2) >= 3
+    # every sequence that passes the screen and is left out is too close to one
+    for seq in decode(get_sstrand_candidates(6), 6):
+        if not seq.startswith("A"):
+            assert min(hamming(seq, b) for b in barcodes) < 3
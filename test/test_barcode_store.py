@@ -0,0 +1,51 @@
+import os
+import shutil
+
+from rna_lib_design.barcode_store import (
+    compile_barcode_resources,
+    get_store_path,
+    is_store_current,
+    load_table,
+)
+from rna_lib_design.settings import get_resources_path
+
+
+def copy_barcodes(tmp_path):
+    csv_path = tmp_path / "md_0_gu_0_0.csv"
+    shutil.copy(
+        get_resources_path() / "barcodes/helices/len_1/md_0_gu_0_0.csv", csv_path
+    )
+    return csv_path
+
+
+def test_load_table(tmp_path):
+    csv_path = copy_barcodes(tmp_path)
+    assert not is_store_current(csv_path)
+    table = load_table(csv_path)
+    assert len(table) == 4
+    assert is_store_current(csv_path)
+    stored = load_table(csv_path)
+    assert list(stored["sequence"]) == list(table["sequence"])
+    assert list(stored["structure"]) == list(table["structure"])
+    assert stored["sequence"][0].decode().count("&") == 1
+
+
+def test_stale_store(tmp_path):
+    csv_path = copy_barcodes(tmp_path)
+    load_table(csv_path)
+    # an edited csv is compiled again
+    with open(csv_path, "a") as f:
+        f.write("G&C,(&),-1.0\n")
+    mtime = get_store_path(csv_path).stat().st_mtime_ns
+    os.utime(csv_path, ns=(mtime + 10**9, mtime + 10**9))
+    assert not is_store_current(csv_path)
+    assert len(load_table(csv_path)) == 5
+
+
+def test_compile_barcode_resources(tmp_path):
+    copy_barcodes(tmp_path)
+    shutil.copy(get_resources_path() / "barcodes/helices.csv", tmp_path)
+    assert compile_barcode_resources(tmp_path) == 2
+    table = load_table(tmp_path / "helices.csv")
+    assert table["path"][0].decode() == "helices/len_1/md_0_gu_0_0.csv"
+    assert table["length"][0] == 1
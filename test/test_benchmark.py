@@ -0,0 +1,51 @@
+import json
+
+from rna_lib_design import benchmark
+from rna_lib_design.benchmark import (
+    StageTimer,
+    get_synthetic_library,
+    run_benchmark,
+    write_benchmark,
+)
+
+
+class Counter:
+    def add(self, x):
+        return x + 1
+
+
+def test_stage_timer():
+    timer = StageTimer({"add": (Counter, "add")})
+    org_add = Counter.add
+    with timer:
+        assert Counter().add(1) == 2
+        Counter().add(2)
+    assert Counter.add is org_add
+    assert timer.to_dict()["add"]["calls"] == 2
+
+
+def test_synthetic_library():
+    df = get_synthetic_library(10, 30, seed=1)
+    assert len(df) == 10
+    assert (df["sequence"].str.len() == 30).all()
+    assert df.equals(get_synthetic_library(10, 30, seed=1))
+
+
+def test_run_benchmark(tmp_path):
+    results = run_benchmark(["single_barcode_standard"], [20], isolate=False)
+    case = results["cases"][0]
+    assert case["num_designed"] == 20
+    assert case["seqs_per_sec"] > 0
+    assert case["stages"]["apply"]["calls"] >= 20
+    # attempts are screened on their mfe fold first
+    assert case["stages"]["fold_mfe"]["calls"] >= 20
+    assert case["stages"]["write_output"]["calls"] == 1
+    write_benchmark(results, tmp_path / "bench.json")
+    with open(tmp_path / "bench.json") as f:
+        assert json.load(f)["cases"][0]["preset"] == "single_barcode_standard"
+
+
+def test_run_benchmark_skipped(monkeypatch):
+    monkeypatch.setattr(benchmark, "MAX_LENGTH_INCREASE", 0)
+    results = run_benchmark(["single_barcode_sstrand"], [100000], isolate=False)
+    assert "skipped" in results["cases"][0]
@@ -0,0 +1,73 @@
+import pandas as pd
+from dataclasses import dataclass, field
+
+from rna_lib_design.checkpoint import DesignCheckpoint
+
+
+@dataclass
+class BatchResults:
+    # stands in for DesignerResults which needs the full design module
+    df_results: pd.DataFrame
+    failures: dict
+    fold_stats: dict = field(default_factory=dict)
+    num_sequences: int = 0
+
+
+def get_batch(names):
+    df = pd.DataFrame({"name": names, "sequence": ["GGGAAACCC"] * len(names)})
+    return BatchResults(df, {"ss_mismatches": 1}, {"fold_cache_hits": 2}, 3)
+
+
+class TestDesignCheckpoint:
+    def test_read_rows_keeps_types(self, tmp_path):
+        checkpoint = DesignCheckpoint(tmp_path)
+        df = pd.DataFrame(
+            {
+                "name": ["0001", "0002"],
+                "sequence": ["GGGAAACCC", ""],
+                "ens_defect": [1.5, float("nan")],
+                "count": [1, 2],
+            }
+        )
+        checkpoint.append_rows(df)
+        checkpoint.save([], [checkpoint.rows_path])
+        resumed = DesignCheckpoint(tmp_path)
+        assert resumed.load()
+        pd.testing.assert_frame_equal(resumed.read_rows(), df)
+
+    def test_save_and_load(self, tmp_path):
+        checkpoint = DesignCheckpoint(tmp_path)
+        r = get_batch(["seq_0", "seq_1"])
+        checkpoint.append_rows(r.df_results)
+        checkpoint.update(r)
+        used = [{"size": 10, "used": [1, 5]}]
+        checkpoint.save(used, [checkpoint.rows_path])
+        # written after the save so lost on resume
+        checkpoint.append_rows(get_batch(["seq_3"]).df_results)
+        assert len(checkpoint.read_rows()) == 3
+        resumed = DesignCheckpoint(tmp_path)
+        assert resumed.load()
+        assert resumed.num_processed == 3
+        assert resumed.num_rows == 2
+        assert resumed.failures == {"ss_mismatches": 1}
+        assert resumed.fold_stats == {"fold_cache_hits": 2}
+        assert resumed.used == used
+        assert list(resumed.read_rows()["name"]) == ["seq_0", "seq_1"]
+
+    def test_no_checkpoint(self, tmp_path):
+        checkpoint = DesignCheckpoint(tmp_path)
+        assert not checkpoint.load()
+        assert len(checkpoint.read_rows()) == 0
+
+    def test_is_due(self, tmp_path):
+        assert DesignCheckpoint(tmp_path, interval=0).is_due()
+        assert not DesignCheckpoint(tmp_path, interval=3600).is_due()
+
+    def test_remove(self, tmp_path):
+        checkpoint = DesignCheckpoint(tmp_path)
+        checkpoint.append_rows(get_batch(["seq_0"]).df_results)
+        checkpoint.save([], [checkpoint.rows_path])
+        checkpoint.remove()
+        assert not checkpoint.state_path.exists()
+        assert not checkpoint.rows_path.exists()
+        assert not DesignCheckpoint(tmp_path).load()
@@ -1,5 +1,7 @@
 import pytest
 import shutil
+import subprocess
+import sys
 from pathlib import Path
 import pandas as pd
 
@@ -10,6 +12,20 @@ from rna_lib_design.settings import get_resources_path, get_test_path
 
 
 TEST_RESOURCES = get_test_path() / "resources"
+# modules that must not be imported just to start the cli
+HEAVY_MODULES = [
+    "pandas",
+    "numpy",
+    "vienna",
+    "seq_tools",
+    "tabulate",
+    "yaml",
+    "jsonschema",
+    "rna_lib_design.design",
+]
+# most time the repo's own modules can take to import the cli in milliseconds,
+# the time of cloup and click is not counted as it depends on the machine
+IMPORT_BUDGET_MS = 50
 
 
 def test_cli():
@@ -19,6 +35,40 @@ def test_cli():
     assert "Show this message and exit." in result.output
 
 
+def test_cli_imports_lazily():
+    code = (
+        "import sys\n"
+        "from rna_lib_design import cli\n"
+        "try:\n"
+        "    cli.cli(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print('imported:', [m for m in {HEAVY_MODULES} if m in sys.modules])\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip().splitlines()[-1] == "imported: []"
+
+
+def test_cli_import_time():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import rna_lib_design.cli"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # each line is: import time: self [us] | cumulative | module
+    own_us = 0
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        if fields[2].strip().startswith("rna_lib_design"):
+            own_us += int(fields[0].split(":")[1])
+    assert own_us / 1000 < IMPORT_BUDGET_MS
+
+
 def test_edit_distance():
     runner = CliRunner()
     result = runner.invoke(
@@ -126,4 +176,20 @@ class TestBarcode:
         assert Path("test2").is_dir()
         shutil.rmtree("test2")
 
-    
\ No newline at end of file
+    
+    def test_stream(self):
+        runner = CliRunner()
+        result = runner.invoke(
+            cli.cli,
+            [
+                "barcode",
+                "--stream",
+                "--output",
+                "test_stream",
+                str(TEST_RESOURCES / "libs/minittr2.csv"),
+            ],
+        )
+        assert result.exit_code == 0
+        assert Path("test_stream/results-rna.csv").is_file()
+        assert Path("test_stream/results.fasta").is_file()
+        shutil.rmtree("test_stream")
@@ -1,4 +1,6 @@
 import pandas as pd
+import numpy as np
+import pytest
 from seq_tools import SequenceStructure
 from rna_lib_design.design import (
     parse_build_str,
@@ -6,9 +8,21 @@ from rna_lib_design.design import (
     design,
     Designer,
     DesignOpts,
+    design_stream_and_save_output,
 )
+from rna_lib_design import design as design_module
+from rna_lib_design.checkpoint import DesignCheckpoint
+from rna_lib_design.folding import FakeFoldBackend, FoldResults
 from rna_lib_design.settings import get_resources_path, get_test_path
 
+# the fake backend folds everything unpaired, any structure is allowed so every
+# attempt can be designed
+FAKE_FOLD_OPTS = {
+    "fold_backend": "fake",
+    "allowed_ss_mismatch": 1000,
+    "allowed_ss_mismatch_barcodes": 1000,
+}
+
 
 class TestResources:
     @staticmethod
@@ -27,6 +41,17 @@ class TestResources:
         }
         return params
 
+    @staticmethod
+    def get_library_df():
+        return pd.read_csv(get_test_path() / "resources/libs/C0098.csv")
+
+    @staticmethod
+    def get_fake_fold_opts(**kwargs):
+        """
+        design options with FAKE_FOLD_OPTS
+        """
+        return DesignOpts(**FAKE_FOLD_OPTS, **kwargs)
+
     @staticmethod
     def get_simple_sequence_df():
         return pd.DataFrame(
@@ -120,9 +145,48 @@ class TestSequencerDesigner:
         d_seq_struct = sd.get_designable_seq_struct(seq_struct)
         sd.apply(d_seq_struct)
         solution = sd.get_solution()
-        sd.accept_previous_solution(solution)
+        assert solution[1] == sd.steps[1].set.last
+        assert sd.accept_previous_solution(solution)
+        assert sd.steps[0].set.num_used() == 1
+        # barcodes in the solution are already used
+        assert not sd.accept_previous_solution(solution)
+        assert sd.steps[0].set.num_used() == 1
+
+    def test_min_barcode_edit_distance(self):
+        build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+        params = TestResources.get_complex_params()
+        sd = get_seq_struct_designer(10, build_str, params)
+        # longer than any barcode region so no two can ever be far enough apart
+        sd.set_min_barcode_edit_distance(100)
+        seq_struct = SequenceStructure("GGGAAAACCC", "(((....)))")
+        d_seq_struct = sd.get_designable_seq_struct(seq_struct)
+        sd.apply(d_seq_struct)
+        assert sd.is_barcode_distinct(sd.get_solution())
+        assert sd.accept_previous_solution(sd.get_solution())
+        assert sd.get_barcodes() == [sd.get_barcode(sd.get_solution())]
+        sd.apply(d_seq_struct)
+        solution = sd.get_solution()
+        assert not sd.is_barcode_distinct(solution)
+        assert not sd.accept_previous_solution(solution)
+        # barcodes of the rejected solution are released again
         assert sd.steps[0].set.num_used() == 1
 
+    def test_apply_template(self):
+        build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+        params = TestResources.get_complex_params()
+        sd = get_seq_struct_designer(10, build_str, params)
+        seq_struct = SequenceStructure("GGGAAAACCC", "(((....)))")
+        d_seq_struct = sd.get_designable_seq_struct(seq_struct)
+        template = sd.compile(d_seq_struct)
+        assert len(template.slots) == 3
+        for i in range(5):
+            np.random.seed(i)
+            expected = sd.apply(d_seq_struct)
+            expected_solution = sd.get_solution()
+            np.random.seed(i)
+            assert sd.apply_template(template) == expected
+            assert sd.get_solution() == expected_solution
+
 
 def _test_designer():
     build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
@@ -150,5 +214,228 @@ def _test_design():
 def test_design_w_multithreading():
     build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
     params = TestResources.get_complex_params()
-    df_sequences = pd.read_csv(get_test_path() / "resources/libs/C0098.csv")
+    df_sequences = TestResources.get_library_df()
     results = design(2, df_sequences, build_str, params, DesignOpts())
+
+
+def test_design_w_small_batches():
+    build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+    params = TestResources.get_complex_params()
+    df_sequences = TestResources.get_library_df()
+    results = design(2, df_sequences, build_str, params, DesignOpts(), batch_size=3)
+    df_results = results.df_results
+    assert len(df_results) <= len(df_sequences)
+    # every designed sequence gets its own barcodes
+    assert df_results["sequence"].is_unique
+
+
+def test_design_empty():
+    build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+    params = TestResources.get_complex_params()
+    df_sequences = TestResources.get_simple_sequence_df().iloc[:0]
+    df_single = design(1, df_sequences, build_str, params, DesignOpts()).df_results
+    df_multi = design(2, df_sequences, build_str, params, DesignOpts()).df_results
+    assert len(df_multi) == 0
+    assert list(df_multi.columns) == list(df_single.columns)
+
+
+def test_design_w_batched_attempts():
+    build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+    params = TestResources.get_complex_params()
+    df_sequences = TestResources.get_library_df()
+    opts = DesignOpts(attempt_batch_size=5, fold_executor="thread")
+    results = design(1, df_sequences, build_str, params, opts)
+    assert len(results.df_results) <= len(df_sequences)
+    assert results.df_results["sequence"].is_unique
+
+
+def test_design_w_min_barcode_edit_distance():
+    build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+    params = TestResources.get_complex_params()
+    df_sequences = TestResources.get_library_df()
+    opts = DesignOpts(min_barcode_edit_distance=3)
+    results = design(2, df_sequences, build_str, params, opts, batch_size=3)
+    assert len(results.df_results) <= len(df_sequences)
+    assert "barcode_edit_distance" in results.failures
+
+
+def test_design_w_min_barcode_edit_distance_mixed_lengths():
+    build_str = "P5-HBARCODEA-SOI-HBARCODEB-P3"
+    params = {
+        "P5": {"name": "org_minittr_pool_rev_seq_primer"},
+        "P3": {"name": "rt_tail"},
+        "HBARCODE": {"m_type": "HELIX", "length": "6-7"},
+    }
+    df_sequences = TestResources.get_library_df()
+    opts = TestResources.get_fake_fold_opts(min_barcode_edit_distance=2)
+    results = design(2, df_sequences, build_str, params, opts, batch_size=3)
+    df_results = results.df_results
+    assert len(df_results) == len(df_sequences)
+    # helices of both lengths are used
+    assert df_results["sequence"].str.len().nunique() > 1
+
+
+def test_design_w_mfe_screen():
+    build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+    params = TestResources.get_complex_params()
+    df_sequences = TestResources.get_library_df()
+    dfs = []
+    for mfe_screen in [True, False]:
+        np.random.seed(0)
+        opts = TestResources.get_fake_fold_opts(mfe_screen=mfe_screen)
+        results = design(1, df_sequences, build_str, params, opts)
+        dfs.append(results.df_results)
+    # the screen changes how much is folded but not the designs
+    assert list(dfs[0]["sequence"]) == list(dfs[1]["sequence"])
+    # the fake backend folds every sequence unpaired so every attempt fails the
+    # screen and nothing is fully folded
+    opts = DesignOpts(fold_backend="fake")
+    results = design(1, df_sequences, build_str, params, opts)
+    assert len(results.df_results) == 0
+    assert results.fold_stats["fold_cache_misses"] == 0
+    assert results.fold_stats["mfe_folds"] > 0
+
+
+class PairedFoldBackend(FakeFoldBackend):
+    """
+    folds every sequence unpaired when only the mfe is asked for but pairs
+    nearly every base in the full fold
+    """
+
+    def fold(self, seq):
+        self.num_folds += 1
+        n = len(seq) // 2
+        dot_bracket = "(" * n + "." * (len(seq) % 2) + ")" * n
+        return FoldResults(dot_bracket, 0.0, 0.0, [])
+
+
+def test_design_w_mfe_screen_rescores_full_fold(monkeypatch):
+    monkeypatch.setattr(
+        design_module, "get_fold_backend", lambda name: PairedFoldBackend()
+    )
+    build_str = "P5-SSBARCODE-SOI-P3"
+    params = {
+        "P5": {"name": "org_minittr_pool_rev_seq_primer"},
+        "P3": {"name": "rt_tail"},
+        "SSBARCODE": {"m_type": "SSTRAND", "length": "6"},
+    }
+    df_sequences = TestResources.get_library_df()
+    opts = DesignOpts(fold_backend="fake", allowed_ss_mismatch=1000)
+    results = design(1, df_sequences, build_str, params, opts)
+    # every attempt passes the unpaired mfe screen but the paired full fold
+    # breaks the single stranded barcode, so nothing is accepted
+    assert results.fold_stats["fold_cache_misses"] > 0
+    assert len(results.df_results) == 0
+    assert results.failures["ss_mismatch_barcodes"] == len(df_sequences)
+
+
+def test_design_folds_sequences_in_workers():
+    build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+    params = TestResources.get_complex_params()
+    df_sequences = TestResources.get_library_df()
+    df_sequences = df_sequences[["name", "sequence"]]
+    opts = TestResources.get_fake_fold_opts(mfe_screen=False)
+    results = design(2, df_sequences, build_str, params, opts, batch_size=3)
+    assert len(results.df_results) == len(df_sequences)
+    # folded by the fake backend in the workers
+    assert (results.df_results["org_structure"].str.count("[()]") == 0).all()
+    assert (results.df_results["org_ens_defect"] == 0.0).all()
+    assert results.fold_stats["fold_cache_misses"] >= len(df_sequences)
+
+
+def test_design_results_columns():
+    build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+    params = TestResources.get_complex_params()
+    df_sequences = TestResources.get_library_df()
+    opts = TestResources.get_fake_fold_opts()
+    df_results = design(1, df_sequences, build_str, params, opts).df_results
+    assert list(df_results.columns[:5]) == [
+        "name",
+        "sequence",
+        "structure",
+        "ens_defect",
+        "mfe",
+    ]
+    assert list(df_results["name"]) == list(df_sequences["name"])
+    assert (df_results["ens_defect"] == 0.0).all()
+    # the sequence of interest is in each design
+    for _, row in df_results.iterrows():
+        assert row["org_sequence"] in row["sequence"]
+        assert row["design_sequence"] != ""
+
+
+def test_design_stream(tmp_path, monkeypatch):
+    # small chunks so the library is read and written in several pieces
+    monkeypatch.setattr("rna_lib_design.design.STREAM_CHUNK_SIZE", 7)
+    csv = get_test_path() / "resources/libs/C0098.csv"
+    params = {
+        "build_str": "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3",
+        "segments": TestResources.get_complex_params(),
+        "design_opts": dict(FAKE_FOLD_OPTS),
+        "num_of_processes": 1,
+        "preprocess": {"trim_p5": 0, "trim_p3": 0},
+        "postprocess": {"skip_edit_distance": True},
+    }
+    design_stream_and_save_output(csv, tmp_path, params)
+    df_rna = pd.read_csv(tmp_path / "results-rna.csv")
+    df_dna = pd.read_csv(tmp_path / "results-dna.csv")
+    assert 0 < len(df_rna) <= len(pd.read_csv(csv))
+    assert len(df_dna) == len(df_rna)
+    assert df_rna["sequence"].is_unique
+    fasta = (tmp_path / "results.fasta").read_text().splitlines()
+    assert len(fasta) == 2 * len(df_rna)
+
+
+def get_barcodes(df):
+    """
+    the barcodes of each design keyed on their number in design_sequence, e.g.
+    1 for the helix barcode and 2 for the hairpin barcode
+    """
+    barcodes = {}
+    for seq, d_seq in zip(df["sequence"], df["design_sequence"]):
+        for key in set(d_seq):
+            if not key.isdigit():
+                continue
+            barcode = "".join(s for s, d in zip(seq, d_seq) if d == key)
+            barcodes.setdefault(key, set()).add(barcode)
+    return barcodes
+
+
+def test_design_resume(tmp_path, monkeypatch):
+    build_str = "P5-HPBARCODE-HBARCODE6A-SOI-HBARCODE6B-AC-P3"
+    params = TestResources.get_complex_params()
+    df_sequences = TestResources.get_library_df()
+    df_sequences["name"] = [f"seq_{i}" for i in range(len(df_sequences))]
+    # the fake backend scores every attempt as a success so every sequence is
+    # designed and uses barcodes
+    opts = TestResources.get_fake_fold_opts()
+    org_design = Designer.design
+    calls = []
+
+    def crash_on_third_batch(self, df, sd):
+        calls.append(len(df))
+        if len(calls) == 3:
+            raise RuntimeError("crash")
+        return org_design(self, df, sd)
+
+    monkeypatch.setattr(Designer, "design", crash_on_third_batch)
+    checkpoint = DesignCheckpoint(tmp_path, interval=0)
+    with pytest.raises(RuntimeError):
+        design(1, df_sequences, build_str, params, opts, 5, checkpoint)
+    monkeypatch.setattr(Designer, "design", org_design)
+    checkpoint = DesignCheckpoint(tmp_path, interval=0)
+    assert checkpoint.load()
+    assert checkpoint.num_processed == 10
+    df_before = checkpoint.read_rows()
+    assert len(df_before) == 10
+    results = design(1, df_sequences, build_str, params, opts, 5, checkpoint)
+    df_results = results.df_results
+    assert results.num_sequences == len(df_sequences)
+    # every sequence is designed once
+    assert df_results["name"].is_unique
+    df_after = df_results[~df_results["name"].isin(df_before["name"])]
+    assert len(df_before) + len(df_after) == len(df_results)
+    # no barcode used before the crash is handed out again after resuming
+    barcodes_before = get_barcodes(df_before)
+    for key, barcodes in get_barcodes(df_after).items():
+        assert barcodes_before.get(key, set()).isdisjoint(barcodes)
@@ -0,0 +1,82 @@
+import random
+from itertools import combinations, product
+
+from rna_lib_design import edit_distance
+from rna_lib_design.edit_distance import (
+    calc_edit_distance_within,
+    calc_min_edit_distance,
+    strip_common_ends,
+)
+
+
+def get_edit_distance(seq_1, seq_2):
+    return calc_edit_distance_within(seq_1, seq_2, max(len(seq_1), len(seq_2)))
+
+
+def get_random_library(num_seqs, seed=0):
+    random.seed(seed)
+    seqs = []
+    base = "".join(random.choice("ACGU") for _ in range(40))
+    for _ in range(num_seqs):
+        seq = list(base)
+        for _ in range(random.randint(1, 12)):
+            pos = random.randrange(len(seq))
+            seq[pos] = random.choice("ACGU")
+        seqs.append("GGAAGAUCG" + "".join(seq) + "AAAGAAACAACAACAACAAC")
+    return seqs
+
+
+def test_edit_distance_within():
+    assert calc_edit_distance_within("GGAAC", "GGAAC", 2) == 0
+    assert calc_edit_distance_within("GGAAC", "GGUAC", 2) == 1
+    assert calc_edit_distance_within("GGAAC", "GAAC", 2) == 1
+    assert calc_edit_distance_within("GGAAC", "CCUUG", 2) == 3
+    assert calc_edit_distance_within("GGAACAAAAA", "GG", 3) == 4
+
+
+def test_strip_common_ends():
+    assert strip_common_ends(["GGAACUU", "GGUACUU"]) == ["A", "U"]
+    assert strip_common_ends(["GGAA", "GGAAGGAA"]) == ["", "GGAA"]
+
+
+def test_duplicates():
+    results = calc_min_edit_distance(["GGAAC", "GGUAC", "GGAAC"])
+    assert results.min_edit_distance == 0
+    assert results.pairs == [(0, 2)]
+
+
+def test_matches_all_pairs():
+    seqs = get_random_library(40)
+    dists = {
+        (i, j): get_edit_distance(seqs[i], seqs[j])
+        for i, j in combinations(range(len(seqs)), 2)
+    }
+    min_dist = min(dists.values())
+    results = calc_min_edit_distance(seqs, exact=True)
+    assert results.exact
+    assert results.min_edit_distance == min_dist
+    assert results.pairs == sorted(p for p, d in dists.items() if d == min_dist)
+
+
+def test_seeded_search(monkeypatch):
+    # force the seed index on a small library
+    monkeypatch.setattr(edit_distance, "MAX_DIRECT_PAIRS", 0)
+    seqs = get_random_library(40)
+    expected = calc_min_edit_distance(seqs, exact=True)
+    results = calc_min_edit_distance(seqs, n_processes=2)
+    if results.exact:
+        assert results == expected
+    else:
+        assert results.min_edit_distance <= expected.min_edit_distance
+
+
+def test_short_library_is_exact(monkeypatch):
+    # too short to seed, so every pair is compared instead of giving a bound
+    monkeypatch.setattr(edit_distance, "MAX_DIRECT_PAIRS", 0)
+    # no two pieces differ in only one position
+    pieces = [p for p in product(range(4), repeat=3) if sum(p) % 4 == 0]
+    seqs = ["GGAA" + "".join("ACGU"[b] for b in p) + "CCUU" for p in pieces]
+    results = calc_min_edit_distance(seqs)
+    assert results == calc_min_edit_distance(seqs, exact=True)
+    assert results.exact
+    assert results.min_edit_distance == 2
@@ -0,0 +1,184 @@
+import shutil
+import sys
+import pandas as pd
+import pytest
+from vienna.vienna import FoldResults
+
+from rna_lib_design.folding import (
+    FoldCache,
+    FakeFoldBackend,
+    RNAfoldWorkerBackend,
+    fold_dataframe,
+    get_fold_backend,
+    get_fold_executor,
+)
+
+# prints output in the same format as RNAfold for every line of input, with the
+# ensemble lines only when run with -p
+FAKE_RNAFOLD = """#!{python}
+import sys
+for line in sys.stdin:
+    seq = line.strip()
+    print(seq)
+    print("." * len(seq) + " ( -1.50)")
+    if "-p" not in sys.argv:
+        sys.stdout.flush()
+        continue
+    print("." * len(seq) + " [ -2.00]")
+    print("." * len(seq) + " {{ -1.50 d=1.00}}")
+    print(" frequency of mfe structure in ensemble 0.5; ensemble diversity 1.25  ")
+    sys.stdout.flush()
+"""
+
+
+class TestFoldCache:
+    def test_fold(self):
+        fc = FoldCache()
+        r = fc.fold("GGGGAAAACCCC")
+        assert r.dot_bracket == "((((....))))"
+        assert fc.misses == 1
+        r2 = fc.fold("GGGGAAAACCCC")
+        assert r2 == r
+        assert fc.hits == 1
+        assert fc.hit_rate() == 0.5
+
+    def test_max_size(self):
+        fc = FoldCache(max_size=2)
+        fc.fold("GGGGAAAACCCC")
+        fc.fold("GGGGAAAACCCA")
+        fc.fold("GGGGAAAACCCG")
+        assert len(fc) == 2
+        # first sequence was evicted
+        fc.fold("GGGGAAAACCCC")
+        assert fc.hits == 0
+
+    def test_fold_batch(self):
+        fc = FoldCache()
+        fc.fold("GGGGAAAACCCC")
+        seqs = ["GGGGAAAACCCC", "GGGAAAACCC", "GGGAAAACCC", "GGGGGAAAACCCCC"]
+        executor = get_fold_executor("thread", 2)
+        results = fc.fold_batch(seqs, executor)
+        executor.shutdown()
+        assert [r.dot_bracket for r in results] == [
+            "((((....))))",
+            "(((....)))",
+            "(((....)))",
+            "(((((....)))))",
+        ]
+        assert fc.hits == 2
+        assert fc.misses == 3
+
+    def test_disk_store(self, tmp_path):
+        path = str(tmp_path / "folds.db")
+        fc = FoldCache(path=path)
+        r = fc.fold("GGGGAAAACCCC")
+        fc.close()
+        # a new cache (i.e. a new run or process) sees the stored result
+        fc2 = FoldCache(path=path)
+        r2 = fc2.fold("GGGGAAAACCCC")
+        assert fc2.hits == 1
+        assert r2.dot_bracket == r.dot_bracket
+        assert r2.ens_defect == r.ens_defect
+        fc2.close()
+
+    def test_fold_mfe_batch(self):
+        results = {"GGGGAAAACCCC": FoldResults("((((....))))", -5.0, 0.5, [])}
+        backend = FakeFoldBackend(results)
+        fc = FoldCache(backend=backend)
+        fc.fold("GGGGAAAACCCC")
+        seqs = ["GGGGAAAACCCC", "AAAA", "AAAA", "GGGGAAAAGGGG"]
+        folds = fc.fold_mfe_batch(seqs)
+        assert [r.dot_bracket for r in folds] == [
+            "((((....))))",
+            "....",
+            "....",
+            "............",
+        ]
+        # the full result already cached is used as is
+        assert folds[0].ens_defect == 0.5
+        assert folds[1].ens_defect is None
+        assert backend.num_mfe_folds == 2
+        assert fc.stats()["mfe_folds"] == 2
+        # mfe only results are cached but never stand in for a full fold
+        fc.fold_mfe_batch(["AAAA"])
+        assert backend.num_mfe_folds == 2
+        assert fc.fold("AAAA").ens_defect == 0.0
+        assert fc.misses == 2
+
+
+def test_fold_dataframe():
+    fc = FoldCache()
+    df = pd.DataFrame({"sequence": ["GGGGAAAACCCC", "GGGGAAAACCCC"]})
+    df = fold_dataframe(df, fc)
+    assert list(df["structure"]) == ["((((....))))", "((((....))))"]
+    assert fc.hits == 1
+    executor = get_fold_executor("thread", 2)
+    df = pd.DataFrame({"sequence": ["GGGAAAACCC", "GGGGGAAAACCCCC", "GGGAAAACCC"]})
+    df = fold_dataframe(df, fc, executor)
+    executor.shutdown()
+    assert list(df["structure"]) == ["(((....)))", "(((((....)))))", "(((....)))"]
+    assert fc.misses == 3
+
+
+def test_get_fold_executor():
+    assert get_fold_executor("serial") is None
+    with pytest.raises(ValueError):
+        get_fold_executor("not_an_executor")
+
+
+class TestFoldBackends:
+    def test_fake(self):
+        results = {"GGGGAAAACCCC": FoldResults("((((....))))", -5.0, 0.5, [])}
+        backend = FakeFoldBackend(results)
+        fc = FoldCache(backend=backend)
+        assert fc.fold("GGGGAAAACCCC").dot_bracket == "((((....))))"
+        assert fc.fold("GGGGAAAAGGGG").dot_bracket == "............"
+        fc.fold_batch(["GGGGAAAACCCC", "AAAA", "AAAA"])
+        assert backend.num_folds == 3
+
+    def test_get_fold_backend(self):
+        assert isinstance(get_fold_backend("fake"), FakeFoldBackend)
+        with pytest.raises(ValueError):
+            get_fold_backend("not_a_backend")
+
+    def test_rnafold_worker_streams(self, tmp_path):
+        exe = tmp_path / "RNAfold"
+        exe.write_text(FAKE_RNAFOLD.format(python=sys.executable))
+        exe.chmod(0o755)
+        backend = RNAfoldWorkerBackend(str(exe))
+        seqs = ["GGGGAAAACCCC" + "A" * i for i in range(500)]
+        results = backend.fold_batch(seqs)
+        # the same process is reused
+        r = backend.fold("GGGAAAACCC")
+        backend.close()
+        assert len(results) == 500
+        assert results[10].dot_bracket == "." * 22
+        assert results[10].mfe == -1.5
+        assert results[10].ens_defect == 1.25
+        assert r.dot_bracket == ".........."
+
+    def test_rnafold_worker_mfe(self, tmp_path):
+        exe = tmp_path / "RNAfold"
+        exe.write_text(FAKE_RNAFOLD.format(python=sys.executable))
+        exe.chmod(0o755)
+        backend = RNAfoldWorkerBackend(str(exe))
+        seqs = ["GGGGAAAACCCC" + "A" * i for i in range(200)]
+        results = backend.fold_mfe_batch(seqs)
+        # the full fold runs in its own process alongside
+        r = backend.fold("GGGAAAACCC")
+        backend.close()
+        assert len(results) == 200
+        assert results[10].dot_bracket == "." * 22
+        assert results[10].mfe == -1.5
+        assert results[10].ens_defect is None
+        assert r.ens_defect == 1.25
+
+    @pytest.mark.skipif(shutil.which("RNAfold") is None, reason="needs RNAfold")
+    def test_rnafold_worker_matches_vienna(self):
+        backend = RNAfoldWorkerBackend()
+        seq = "GGGGAAAACCCCAUAUGGGAAACCCAUAU"
+        r = backend.fold(seq)
+        backend.close()
+        r_vienna = get_fold_backend("vienna").fold(seq)
+        assert r.dot_bracket == r_vienna.dot_bracket
+        assert r.mfe == pytest.approx(r_vienna.mfe, abs=0.01)
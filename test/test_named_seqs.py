@@ -0,0 +1,39 @@
+from rna_lib_design.named_seqs import (
+    NamedSeqRegistry,
+    SequenceInfo,
+    get_named_seq_registry,
+)
+
+
+def test_registry_is_shared():
+    assert get_named_seq_registry() is get_named_seq_registry()
+
+
+def test_get_rna():
+    registry = NamedSeqRegistry()
+    row = registry.get_rna("uucg_p5_rev_primer")
+    assert row["sequence"] == "GGAACAGCACUUCGGUGCAAA"
+    assert row["structure"] == "......((((....))))..."
+    assert registry.get_rna("not_a_real_name") is None
+
+
+def test_get_dna():
+    registry = NamedSeqRegistry()
+    row = registry.get_dna("new_minittrs_fwd")
+    assert row["sequence"] == "TTCTAATACGACTCACTATAGGAAC"
+
+
+def test_get_by_code():
+    registry = NamedSeqRegistry()
+    p5 = registry.get_by_code("P000Y")
+    assert p5 == SequenceInfo(
+        "org_minittr_pool_rev_seq_primer", "GGAAGAUCGAGUAGAUCAAA", "P000Y"
+    )
+    assert registry.get_by_code("NONE") is None
+
+
+def test_get_p5_sequences():
+    registry = NamedSeqRegistry()
+    p5_seqs = registry.get_p5_sequences()
+    assert len(p5_seqs) == len(registry.get_table("rna/p5_sequences"))
+    assert p5_seqs[0].name == "org_minittr_pool_rev_seq_primer"
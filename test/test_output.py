@@ -0,0 +1,119 @@
+import pandas as pd
+import pytest
+
+from rna_lib_design.output import (
+    DEFAULT_OUTPUTS,
+    StreamOutputWriter,
+    get_outputs,
+    write_output_dir,
+)
+
+
+def get_results_df(num_seqs=4, start=0):
+    return pd.DataFrame(
+        {
+            "name": [f"seq_{i}" for i in range(start, start + num_seqs)],
+            "sequence": ["GGAAGAUCGAGUAGAUCAAAGCAUGC"] * num_seqs,
+            "structure": ["......((((......))))......"] * num_seqs,
+            "ens_defect": [1.5] * num_seqs,
+            "mfe": [-3.2] * num_seqs,
+            "org_sequence": ["CGAGUAGA"] * num_seqs,
+        }
+    )
+
+
+def test_get_outputs():
+    assert get_outputs() == DEFAULT_OUTPUTS
+    # put in a fixed order and repeats removed
+    assert get_outputs("fasta,rna,fasta") == ["rna", "fasta"]
+    assert get_outputs(["opool", "all"]) == ["all", "opool"]
+    with pytest.raises(ValueError):
+        get_outputs("rna,not_an_output")
+
+
+def test_write_output_dir(tmp_path):
+    df = get_results_df()
+    write_output_dir(df, tmp_path)
+    df_all = pd.read_csv(tmp_path / "results-all.csv")
+    assert list(df_all.columns) == list(df.columns)
+    df_rna = pd.read_csv(tmp_path / "results-rna.csv")
+    assert list(df_rna.columns) == list(df.columns[:5])
+    df_dna = pd.read_csv(tmp_path / "results-dna.csv")
+    assert "U" not in df_dna["sequence"].iloc[0]
+    fasta = (tmp_path / "results.fasta").read_text().splitlines()
+    assert fasta[0] == ">seq_0"
+    assert fasta[1] == "GGAAGATCGAGTAGATCAAAGCATGC"
+    df_opool = pd.read_csv(tmp_path / "results-opool.csv")
+    assert list(df_opool.columns) == ["Pool name", "Sequence"]
+    assert (df_opool["Pool name"] == tmp_path.stem).all()
+    assert list(df_opool["Sequence"]) == list(df_dna["sequence"])
+    df_xlsx = pd.read_excel(tmp_path / "results-opool.xlsx")
+    pd.testing.assert_frame_equal(df_xlsx, df_opool)
+
+
+def test_write_output_dir_selected(tmp_path):
+    write_output_dir(get_results_df(), tmp_path, ["rna", "fasta"])
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "results-rna.csv",
+        "results.fasta",
+    ]
+
+
+def test_write_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    writer = StreamOutputWriter(tmp_path, outputs=["parquet"])
+    writer.write(get_results_df(3))
+    writer.write(get_results_df(2, start=3))
+    writer.close()
+    df = pd.read_parquet(tmp_path / "results-all.parquet")
+    assert list(df["name"]) == [f"seq_{i}" for i in range(5)]
+    # only the p5 counts of the batches are kept
+    assert writer.p5_counts.num_seqs == 5
+    assert writer.p5_counts.primer is not None
+
+
+def test_write_parquet_empty_first_batch(tmp_path):
+    pytest.importorskip("pyarrow")
+    writer = StreamOutputWriter(tmp_path, outputs=["parquet"])
+    # every design of the first batch failed, with pandas < 3 its string
+    # columns are object columns that have no type
+    writer.write(get_results_df().iloc[:0].astype(object))
+    writer.write(get_results_df(3))
+    writer.write(get_results_df().iloc[:0])
+    writer.write(get_results_df(2, start=3))
+    writer.close()
+    df = pd.read_parquet(tmp_path / "results-all.parquet")
+    assert list(df["name"]) == [f"seq_{i}" for i in range(5)]
+    assert df["ens_defect"].dtype == float
+    # a run where nothing was designed still writes the columns
+    writer = StreamOutputWriter(tmp_path, outputs=["parquet"])
+    writer.write(get_results_df().iloc[:0])
+    writer.close()
+    df = pd.read_parquet(tmp_path / "results-all.parquet")
+    assert len(df) == 0
+    assert list(df.columns) == list(get_results_df().columns)
+
+
+def test_stream_output_writer_resume(tmp_path):
+    writer = StreamOutputWriter(tmp_path)
+    writer.write(get_results_df(3))
+    writer.close()
+    # the xlsx file cannot be added to so it is left as it was
+    writer = StreamOutputWriter(tmp_path, True, writer.num_rows)
+    assert "xlsx" not in writer.outputs
+    writer.write(get_results_df(2, start=3))
+    writer.close()
+    assert writer.num_rows == 5
+    df_rna = pd.read_csv(tmp_path / "results-rna.csv")
+    assert list(df_rna["name"]) == [f"seq_{i}" for i in range(5)]
+    assert len(pd.read_excel(tmp_path / "results-opool.xlsx")) == 3
+    assert all(p.suffix != ".xlsx" for p in writer.paths())
+
+
+def test_stream_output_writer_no_p5(tmp_path, caplog):
+    df = get_results_df()
+    # none of the sequences start with a known p5 sequence
+    df["sequence"] = "UAUGGAGGCAAAGAAACAACAACAACAAC"
+    with caplog.at_level("WARNING"):
+        write_output_dir(df, tmp_path, ["rna"])
+    assert "no p5 sequence found" in caplog.text
@@ -0,0 +1,63 @@
+import random
+
+from rna_lib_design.scoring import StructureScorer
+
+
+def _score_by_loop(structure, design_structure, dot_bracket, allowed, allowed_bc):
+    # the per character scoring the Designer used before StructureScorer
+    if dot_bracket == structure:
+        return "SUCCESS"
+    total_score = 0
+    barcode_score = 0
+    for s1, s2, ds in zip(structure, dot_bracket, design_structure):
+        if s1 != s2:
+            total_score += 1
+        if s1 != s2 and ds not in ["(", ")", "."]:
+            barcode_score += 1
+    if total_score > allowed:
+        return "ss_mismatches"
+    if barcode_score > allowed_bc:
+        return "ss_mismatch_barcodes"
+    return "SUCCESS"
+
+
+class TestStructureScorer:
+    def test_success(self):
+        scorer = StructureScorer("111(((....)))111", 2, 2)
+        assert scorer.score("(((((....)))))..", "(((((....)))))..") == "SUCCESS"
+        # within the allowed mismatches
+        assert scorer.score("(((((....))))).(", "(((((....)))))..") == "SUCCESS"
+
+    def test_ss_mismatches(self):
+        scorer = StructureScorer("111(((....)))111", 2, 2)
+        result = scorer.score("(((((....)))))..", "..(((....)))....")
+        assert result == "ss_mismatches"
+
+    def test_ss_mismatch_barcodes(self):
+        scorer = StructureScorer("111(((....)))111", 5, 2)
+        result = scorer.score("(((((....)))))..", "..(((....)))....")
+        assert result == "ss_mismatch_barcodes"
+
+    def test_matches_loop(self):
+        random.seed(1)
+        design = "2222" + "((((....))))" + "11" + "...." + "11"
+        scorer = StructureScorer(design, 2, 1)
+        structures = []
+        dot_brackets = []
+        for _ in range(200):
+            structure = [random.choice("(.)") for _ in design]
+            dot_bracket = list(structure)
+            for pos in random.sample(range(len(design)), random.randint(0, 4)):
+                dot_bracket[pos] = random.choice("(.)")
+            structures.append("".join(structure))
+            dot_brackets.append("".join(dot_bracket))
+        # different lengths are compared like zip
+        structures.append(structures[0][:-3])
+        dot_brackets.append(dot_brackets[0])
+        outcomes = scorer.score_batch(structures, dot_brackets)
+        expected = [
+            _score_by_loop(s, design, db, 2, 1)
+            for s, db in zip(structures, dot_brackets)
+        ]
+        assert outcomes == expected
+        assert len(set(outcomes)) == 3
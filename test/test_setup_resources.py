@@ -0,0 +1,33 @@
+import pandas as pd
+
+from rna_lib_design import setup_resources
+from rna_lib_design.setup_resources import register_sstrand_set, run_hcodesweep
+
+
+def test_hcodesweep(tmp_path, monkeypatch):
+    df = run_hcodesweep(3, 4, tmp_path)
+    assert len(df) > 0
+    df_index = pd.read_csv(tmp_path / "helices.csv")
+    assert list(df_index["path"]) == list(df["path"])
+    for _, row in df.iterrows():
+        df_set = pd.read_csv(tmp_path / row["path"])
+        assert len(df_set) == row["size"]
+        assert list(df_set.columns) == ["sequence", "structure", "dg"]
+
+    def fail(*args):
+        raise RuntimeError("set made again")
+
+    # every point is already made with the same parameters
+    monkeypatch.setattr(setup_resources, "generate_helix_barcodes", fail)
+    assert run_hcodesweep(3, 4, tmp_path).equals(df)
+
+
+def test_register_sstrand_set(tmp_path):
+    register_sstrand_set(tmp_path, 6, 3, ["AACCGG", "UUGGCC"])
+    register_sstrand_set(tmp_path, 5, 3, ["AACCG"])
+    path = register_sstrand_set(tmp_path, 6, 3, ["AACCGG"])
+    df_index = pd.read_csv(tmp_path / "sstrand.csv")
+    assert list(df_index["length"]) == [5, 6]
+    assert list(df_index["size"]) == [1, 1]
+    df = pd.read_csv(tmp_path / path)
+    assert list(df["structure"]) == ["......"]
@@ -1,8 +1,11 @@
+import multiprocessing
+import numpy as np
 import pandas as pd
 import pytest
 
 from rna_lib_design.settings import get_resources_path, get_test_path
 from rna_lib_design.structure_set import (
+    PackedSeqStructs,
     SequenceStructure,
     SequenceStructureSet,
     SequenceStructureSetParser,
@@ -63,6 +66,30 @@ class TestSequenceStructureSet:
         sss.set_last_used()
         assert sss.used[sss.last]
 
+    def test_get_random_mostly_used(self):
+        seqstructs = [SequenceStructure("A" * i, "." * i) for i in range(1, 4001)]
+        sss = SequenceStructureSet(seqstructs)
+        for _ in range(3999):
+            sss.get_random()
+            sss.set_last_used()
+        assert sss.num_available() == 1
+        sss.get_random()
+        assert not sss.used[sss.last]
+        sss.set_last_used()
+        assert sss.num_available() == 0
+        with pytest.raises(Exception):
+            sss.get_random()
+
+    def test_claim_release(self):
+        ss1 = SequenceStructure("ATCG", "((((")
+        ss2 = SequenceStructure("CGAT", "))))")
+        sss = SequenceStructureSet([ss1, ss2])
+        assert sss.claim(1)
+        assert not sss.claim(1)
+        sss.release(1)
+        assert sss.num_available() == 2
+        assert sss.claim(1)
+
     def test_from_csv(self):
         csv_path = get_resources_path() / "barcodes/helices/len_1/md_0_gu_0_0.csv"
         sss = SequenceStructureSet.from_csv(csv_path)
@@ -156,6 +183,26 @@ class TestNamedSequenceStructure:
             get_named_seq_struct("not_a_real_name")
 
 
+def test_packed_seqstructs():
+    packed = PackedSeqStructs(
+        np.array([b"GGAA", b"CCUU"]), np.array([b"((..", b"..))"])
+    )
+    assert len(packed) == 2
+    assert packed[1] == SequenceStructure("CCUU", "..))")
+    assert packed.index(SequenceStructure("CCUU", "..))")) == 1
+    assert len(packed + packed[:1]) == 3
+    sss = SequenceStructureSet(packed)
+    sss.set_used(packed[0])
+    assert sss.used[0]
+
+
+def test_get_optimal_hairpin_set():
+    loop = SequenceStructure("CAAAG", "(...)")
+    sset = get_optimal_hairpin_set(loop, 5, 10)
+    helix = get_optimal_helix_set(5, 10).seqstructs[0].split_strands()
+    assert sset.seqstructs[0] == helix[0] + loop + helix[1]
+
+
 def test_get_optimal_sstrand_set():
     sset = get_optimal_sstrand_set(5, 10)
     assert len(sset) == 32
@@ -176,3 +223,32 @@ def test_split_single_set():
     sets[0].set_used(sets[0].get_random())
     assert sets[0].num_available() == 1
     assert sets[0].num_used() == 0
+
+
+_shared = {}
+
+
+def _init_shared(sss):
+    _shared["set"] = sss
+
+
+def _claim_all(_):
+    sss = _shared["set"]
+    return [i for i in range(len(sss)) if sss.claim(i)]
+
+
+def test_shared_set():
+    csv_path = get_resources_path() / "barcodes/helices/len_2/md_0_gu_0_0.csv"
+    sss = SequenceStructureSet.from_csv(csv_path)
+    sss.share()
+    try:
+        with multiprocessing.Pool(4, _init_shared, (sss,)) as pool:
+            claimed = pool.map(_claim_all, range(4))
+        assert sss.num_used() == len(sss)
+    finally:
+        sss.unshare()
+    # every index is claimed by exactly one worker
+    all_claimed = sorted(i for c in claimed for i in c)
+    assert all_claimed == list(range(len(sss)))
+    assert all(sss.used)
+    assert not sss.is_shared()
@@ -1,4 +1,9 @@
-#from rna_lib_design import util, settings
+import pandas as pd
+
+from rna_lib_design import util
+from rna_lib_design.named_seqs import SequenceInfo
+
+# from rna_lib_design import util, settings
 
 """
 def test_max_stretch():
@@ -71,4 +76,63 @@ def test_find_valid_subsequences():
     df = util.get_primer_dataframe(settings.RESOURCES_PATH + "fwd_primers.csv")
     df_sub = util.find_valid_subsequences(df, seqs)
     assert len(df_sub) == 2
-"""
\ No newline at end of file
+"""
+
+
+def get_primers():
+    return [
+        SequenceInfo("p1", "GGAAGAUC", "P1"),
+        SequenceInfo("p2", "GGAAGAUCGAG", "P2"),
+        SequenceInfo("p3", "GGUACU", "P3"),
+    ]
+
+
+def test_primer_matcher():
+    matcher = util.PrimerMatcher(get_primers())
+    seqs = ["GGAAGAUCGAGAAAA", "ggaagatcAAAA", "GGUACUAAA", "AAAAAAAA"]
+    assignments = matcher.assign(seqs)
+    assert list(assignments.assignments) == [0, 0, 2, -1]
+    assert list(assignments.counts) == [2, 1, 1]
+    assert assignments.names() == ["p1", "p1", "p3", ""]
+    assert assignments.primer is None
+    assert assignments.is_mixed
+
+
+def test_primer_matcher_shared():
+    matcher = util.PrimerMatcher(get_primers())
+    first = matcher.assign(["GGAAGAUCGAGAAAA"])
+    second = matcher.assign(["GGAAGAUCGAGCCCC", "GGAAGAUCGAGUUUU"])
+    # both p1 and p2 are shared, the first listed is picked
+    assert first.primer.name == "p1"
+    combined = first.combine(second)
+    assert list(combined.counts) == [3, 3, 0]
+    assert combined.primer.name == "p1"
+    assert not combined.is_mixed
+    assert util.PrimerMatcher(get_primers()).assign([]).primer is None
+
+
+def test_primer_counts():
+    matcher = util.PrimerMatcher(get_primers())
+    first = matcher.assign(["GGAAGAUCGAGAAAA", "AAAAAAAA"]).get_counts()
+    assert first.num_seqs == 2
+    assert first.num_none == 1
+    assert first.primer is None
+    assert first.is_mixed
+    second = matcher.assign(["GGAAGAUCGAGCCCC"]).get_counts()
+    assert second.primer.name == "p1"
+    combined = first.combine(second)
+    assert list(combined.counts) == [2, 2, 0]
+    assert combined.num_seqs == 3
+    assert combined.num_none == 1
+    assert combined.is_mixed
+    none = matcher.assign(["AAAAAAAA"]).get_counts()
+    assert none.primer is None
+    assert not none.is_mixed
+
+
+def test_get_seq_fwd_primer():
+    seq = "GGAACAGCACUUCGGUGCAAAGGGCCCGAGUAGGGUCCAAAGCCUCCAAGGGUUGCUUCGGCA"
+    df = pd.DataFrame({"sequence": [seq]})
+    assert util.get_seq_fwd_primer(df).name == "uucg_p5_rev_primer"
+    df = pd.DataFrame({"sequence": ["UAUGGAGGCAAAGAAACAACAACAACAAC"]})
+    assert util.get_seq_fwd_primer(df) is None